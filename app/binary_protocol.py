@@ -0,0 +1,270 @@
+"""A compact binary protocol for the impala / hive partition queries.
+
+For internal high-QPS callers the JSON-over-HTTP overhead dominates, although the request is only two timestamps and
+a boolean. This module contains an asyncio server (TCP or Unix socket) that speaks a struct-framed protocol and calls
+the same generate_timerange_query as the HTTP endpoints.
+
+Every request is a fixed size frame (network byte order):
+
+    request id (uint32) | start (int64, unix seconds) | end (int64, unix seconds) | flags (uint8)
+
+Bit 0 of flags is generate_timestamp_clause, bit 1 sub_hour_precision and bits 4 to 6 the index of the timestamp_type
+in TIMESTAMP_TYPES (0 is 's'), like the parameters of the HTTP endpoints. Every response is:
+
+    request id (uint32) | status (uint8) | length (uint32) | payload (utf-8, length bytes)
+
+Status is STATUS_OK with the query as payload or STATUS_ERROR with the error message as payload. Requests can be
+pipelined: a client can send any number of requests without waiting, the responses are returned in the same order.
+The queries are generated in the thread pool, so that the server does not block the HTTP requests on the same event
+loop, the requests that arrived together are processed together.
+
+The server is started with the app if the environment variable BINARY_PROTOCOL_PORT is set (every worker binds the
+port with SO_REUSEPORT), or standalone with:
+
+    python -m app.binary_protocol --port 9090
+    python -m app.binary_protocol --unix-socket /tmp/partitioning-service.sock
+
+The requests are counted in prometheus metrics, in multiprocess mode they are exported by the /metrics endpoint of the
+app together with the HTTP metrics.
+"""
+
+import argparse
+import asyncio
+import math
+import socket
+import struct
+import time
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from prometheus_client import Counter, Histogram
+
+from app.query_utils.hive_impala_query_builder import TIMESTAMP_TYPES, convert_dt_to_utc, generate_timerange_query
+
+REQUEST_FORMAT = struct.Struct('>IqqB')
+RESPONSE_HEADER_FORMAT = struct.Struct('>IBI')
+
+FLAG_GENERATE_TIMESTAMP_CLAUSE = 0x01
+FLAG_SUB_HOUR_PRECISION = 0x02
+TIMESTAMP_TYPE_SHIFT = 4
+TIMESTAMP_TYPE_MASK = 0x07
+
+READ_SIZE = 64 * 1024
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+BINARY_REQUESTS = Counter('binary_protocol_requests_total', 'Number of requests on the binary protocol', ['status'])
+BINARY_REQUEST_DURATION = Histogram('binary_protocol_request_duration_seconds',
+                                    'Duration of processing a request on the binary protocol')
+
+
+class BinaryProtocolError(Exception):
+    """Raised by the client if the server responded with an error."""
+
+
+def encode_flags(generate_timestamp_clause: bool, timestamp_type: str = 's', sub_hour_precision: bool = False) -> int:
+    """The flags of a request.
+
+    Raises:
+        ValueError: If timestamp_type is not one of TIMESTAMP_TYPES.
+    """
+    if timestamp_type not in TIMESTAMP_TYPES:
+        raise ValueError('timestamp_type must be one of {0}'.format(', '.join(TIMESTAMP_TYPES)))
+    flags = TIMESTAMP_TYPES.index(timestamp_type) << TIMESTAMP_TYPE_SHIFT
+    if generate_timestamp_clause:
+        flags |= FLAG_GENERATE_TIMESTAMP_CLAUSE
+    if sub_hour_precision:
+        flags |= FLAG_SUB_HOUR_PRECISION
+    return flags
+
+
+def unix_seconds(d: datetime) -> int:
+    """The unix timestamp of a datetime in whole seconds, naive datetimes are in UTC like for the HTTP endpoints.
+
+    The timestamp is rounded down, so that dates before the epoch stay in their hour.
+    """
+    return math.floor(convert_dt_to_utc(d).timestamp())
+
+
+def process_request(frame: bytes) -> bytes:
+    """Process a single request frame and return the response frame.
+
+    Args:
+        frame: The request frame, REQUEST_FORMAT.size bytes.
+
+    Returns:
+        The complete response frame.
+    """
+    request_id, start, end, flags = REQUEST_FORMAT.unpack(frame)
+    started = time.perf_counter()
+    timestamp_type_index = (flags >> TIMESTAMP_TYPE_SHIFT) & TIMESTAMP_TYPE_MASK
+    if end < start:
+        status, payload = STATUS_ERROR, 'end date can not be before start date'
+    elif timestamp_type_index >= len(TIMESTAMP_TYPES):
+        status, payload = STATUS_ERROR, 'unknown timestamp type {0}'.format(timestamp_type_index)
+    else:
+        try:
+            payload = generate_timerange_query(datetime.fromtimestamp(start, timezone.utc),
+                                               datetime.fromtimestamp(end, timezone.utc),
+                                               bool(flags & FLAG_GENERATE_TIMESTAMP_CLAUSE),
+                                               TIMESTAMP_TYPES[timestamp_type_index],
+                                               bool(flags & FLAG_SUB_HOUR_PRECISION))
+            status = STATUS_OK
+        except (ValueError, OverflowError, OSError) as e:
+            status, payload = STATUS_ERROR, str(e)
+    BINARY_REQUEST_DURATION.observe(time.perf_counter() - started)
+    BINARY_REQUESTS.labels(status='ok' if status == STATUS_OK else 'error').inc()
+    data = payload.encode('utf-8')
+    return RESPONSE_HEADER_FORMAT.pack(request_id, status, len(data)) + data
+
+
+def process_requests(frames: bytes) -> bytes:
+    """Process consecutive request frames and return their response frames in the same order."""
+    return b''.join(process_request(frames[offset:offset + REQUEST_FORMAT.size])
+                    for offset in range(0, len(frames), REQUEST_FORMAT.size))
+
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Serve the requests of a single connection until the client closes it.
+
+    All complete frames received so far are processed in one call in the thread pool, so that pipelined requests
+    share the thread pool hop.
+    """
+    buffer = b''
+    try:
+        while True:
+            data = await reader.read(READ_SIZE)
+            if not data:
+                break
+            buffer += data
+            size = len(buffer) - len(buffer) % REQUEST_FORMAT.size
+            if size:
+                frames, buffer = buffer[:size], buffer[size:]
+                writer.write(await run_in_threadpool(process_requests, frames))
+                await writer.drain()
+    finally:
+        writer.close()
+
+
+async def start_server(host: Optional[str] = None, port: Optional[int] = None, unix_socket: Optional[str] = None,
+                       reuse_port: bool = False) -> asyncio.AbstractServer:
+    """Start the binary protocol server on either a TCP port or a Unix socket.
+
+    Args:
+        host: The host to bind to (TCP only).
+        port: The TCP port, 0 selects a free port.
+        unix_socket: The path of the Unix socket.
+        reuse_port: If True bind the TCP port with SO_REUSEPORT, so that several workers can share it.
+
+    Returns:
+        The started asyncio server.
+    """
+    if unix_socket is not None:
+        return await asyncio.start_unix_server(handle_connection, path=unix_socket)
+    return await asyncio.start_server(handle_connection, host=host, port=port, reuse_port=reuse_port)
+
+
+class BinaryProtocolClient(object):
+    """
+    A blocking client for the binary protocol that keeps one persistent connection.
+
+    Attributes:
+        address: The (host, port) tuple or the Unix socket path of the server.
+    """
+
+    PIPELINE_CHUNK_SIZE = 1024
+
+    def __init__(self, address):
+        """
+        Args:
+            address: A (host, port) tuple for TCP or a path for a Unix socket.
+        """
+        self.address = address
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        self._socket.connect(address)
+        self._file = self._socket.makefile('rb')
+        self._next_request_id = 0
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self) -> 'BinaryProtocolClient':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _read(self, size: int) -> bytes:
+        data = self._file.read(size)
+        if len(data) < size:
+            raise ConnectionError('the server closed the connection after {0} of {1} bytes'.format(len(data), size))
+        return data
+
+    def query_many(self, ranges: Iterable[Tuple[datetime, datetime, bool]], timestamp_type: str = 's',
+                   sub_hour_precision: bool = False) -> List[str]:
+        """Send all requests pipelined on the connection and read the responses.
+
+        Args:
+            ranges: Tuples of start, end and generate_timestamp_clause. Naive dates are in UTC, fractions of seconds
+                are dropped.
+            timestamp_type: The type of the timestamp column for all ranges, one of TIMESTAMP_TYPES.
+            sub_hour_precision: If True restrict the partitions of the start and the end hour with timestamp bounds.
+
+        Returns:
+            The queries in the order of the ranges.
+
+        Raises:
+            BinaryProtocolError: If the server responded with an error for one of the ranges.
+            ConnectionError: If the server closed the connection before all responses were read.
+            ValueError: If timestamp_type is not one of TIMESTAMP_TYPES.
+        """
+        queries = []
+        error = None
+        ranges = list(ranges)
+        options = encode_flags(False, timestamp_type, sub_hour_precision)
+        # send in chunks, so that neither side blocks on a full socket buffer while the other one is still sending
+        for offset in range(0, len(ranges), self.PIPELINE_CHUNK_SIZE):
+            frames = []
+            for start, end, generate_timestamp_clause in ranges[offset:offset + self.PIPELINE_CHUNK_SIZE]:
+                flags = options | FLAG_GENERATE_TIMESTAMP_CLAUSE if generate_timestamp_clause else options
+                frames.append(REQUEST_FORMAT.pack(self._next_request_id, unix_seconds(start), unix_seconds(end), flags))
+                self._next_request_id = (self._next_request_id + 1) % 2 ** 32
+            self._socket.sendall(b''.join(frames))
+            # always read all responses, so the connection can still be used after an error
+            for _ in frames:
+                _, status, length = RESPONSE_HEADER_FORMAT.unpack(self._read(RESPONSE_HEADER_FORMAT.size))
+                payload = self._read(length).decode('utf-8')
+                if status != STATUS_OK and error is None:
+                    error = BinaryProtocolError(payload)
+                queries.append(payload)
+        if error is not None:
+            raise error
+        return queries
+
+    def query(self, start: datetime, end: datetime, generate_timestamp_clause: bool = True, timestamp_type: str = 's',
+              sub_hour_precision: bool = False) -> str:
+        """Get the query for a single range, see query_many."""
+        return self.query_many([(start, end, generate_timestamp_clause)], timestamp_type, sub_hour_precision)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the binary protocol of the partitioning service.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9090)
+    parser.add_argument('--unix-socket', default=None, help='Serve on this Unix socket instead of TCP')
+    args = parser.parse_args()
+
+    async def serve():
+        server = await start_server(args.host, args.port, args.unix_socket)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
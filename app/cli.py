@@ -0,0 +1,296 @@
+"""Generate the partition queries for a list of time ranges offline, without the service.
+
+For pipelines that need the queries of many ranges on hosts where calling the service is awkward. The ranges are read
+from a CSV file (or stdin) or a Parquet file with a start and an end column, the queries are generated with the same
+generate_timerange_query as the /impala and /hive endpoints and written as CSV or newline delimited JSON (NDJSON) with
+all input columns plus `query` and `error`. Invalid ranges do not stop the run, their error is written instead of the
+query.
+
+The rows are streamed in chunks, optionally to several worker processes, so the memory used does not depend on the
+number of ranges. The throughput is reported on stderr at the end, to compare it with the HTTP path (see
+benchmarks/loadtest.py):
+
+    partitioning-service-generate ranges.csv --output queries.ndjson --processes 4
+    cat ranges.csv | python -m app.cli --timestamp-clause > queries.csv
+
+Reading Parquet files requires pyarrow (`pip install partitioning-service[parquet]`).
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional, Tuple
+
+import orjson
+from pydantic.datetime_parse import parse_datetime
+
+from app.query_utils.hive_impala_query_builder import TIMESTAMP_TYPES, convert_dt_to_utc, generate_timerange_query
+
+INPUT_FORMATS = ('csv', 'parquet')
+OUTPUT_FORMATS = ('csv', 'ndjson')
+
+Row = Dict[str, Any]
+
+
+class GenerationOptions(object):
+    """
+    The options of generate_timerange_query for all ranges.
+
+    Attributes:
+        generate_timestamp_clause: If True append a timestamp clause to the queries.
+        timestamp_type: The type of the timestamp column, one of TIMESTAMP_TYPES.
+        sub_hour_precision: If True restrict the partitions of the start and the end hour with timestamp bounds.
+    """
+
+    def __init__(self, generate_timestamp_clause: bool = False, timestamp_type: str = 's',
+                 sub_hour_precision: bool = False):
+        self.generate_timestamp_clause = generate_timestamp_clause
+        self.timestamp_type = timestamp_type
+        self.sub_hour_precision = sub_hour_precision
+
+
+def generate_chunk(ranges: List[Tuple[Any, Any]], options: GenerationOptions) -> List[Tuple[str, str]]:
+    """Generate the queries of a chunk of ranges, this runs in the worker processes.
+
+    Args:
+        ranges: The (start, end) values of the ranges, ISO 8601 strings, unix timestamps or datetime objects. Naive
+            dates are in UTC, like for the endpoints.
+        options: The options of generate_timerange_query.
+
+    Returns:
+        A tuple (query, error) for every range, the query is empty if the range is invalid.
+    """
+    results = []
+    for start, end in ranges:
+        try:
+            start = convert_dt_to_utc(parse_datetime(start))
+            end = convert_dt_to_utc(parse_datetime(end))
+            results.append((generate_timerange_query(start, end, options.generate_timestamp_clause,
+                                                     options.timestamp_type, options.sub_hour_precision), ''))
+        except (TypeError, ValueError, OverflowError) as e:
+            results.append(('', str(e) or type(e).__name__))
+    return results
+
+
+def read_csv(f: IO[str]) -> Iterator[Row]:
+    """Read the rows of a CSV file with a header line."""
+    return csv.DictReader(f)
+
+
+def _parquet_file(path: str):
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Reading Parquet files requires pyarrow, install it with: pip install pyarrow')
+    return pyarrow.parquet.ParquetFile(path)
+
+
+def read_parquet_columns(path: str) -> List[str]:
+    """Read the column names of a Parquet file from its schema.
+
+    Raises:
+        ImportError: If pyarrow is not installed.
+    """
+    return list(_parquet_file(path).schema_arrow.names)
+
+
+def read_parquet(path: str, batch_size: int) -> Iterator[Row]:
+    """Read the rows of a Parquet file one record batch at a time.
+
+    Raises:
+        ImportError: If pyarrow is not installed.
+    """
+    for batch in _parquet_file(path).iter_batches(batch_size=batch_size):
+        yield from batch.to_pylist()
+
+
+def chunked(rows: Iterable[Row], chunk_size: int) -> Iterator[List[Row]]:
+    """Split the rows into lists of at most chunk_size rows."""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _format_value(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+class CsvWriter(object):
+    """Writes the rows as CSV, the columns are those of the first row."""
+
+    def __init__(self, f: IO[str]):
+        self._f = f
+        self._writer: Optional[csv.DictWriter] = None
+
+    def write(self, row: Row):
+        if self._writer is None:
+            self._writer = csv.DictWriter(self._f, fieldnames=list(row))
+            self._writer.writeheader()
+        self._writer.writerow({key: _format_value(value) for key, value in row.items()})
+
+
+class NdjsonWriter(object):
+    """Writes every row as a JSON object on its own line."""
+
+    def __init__(self, f: IO[str]):
+        self._f = f
+
+    def write(self, row: Row):
+        self._f.write(orjson.dumps(row, default=str).decode('utf-8'))
+        self._f.write('\n')
+
+
+class GenerationReport(object):
+    """
+    The throughput of a run.
+
+    Attributes:
+        ranges: The number of ranges read.
+        errors: The number of ranges without a query.
+        seconds: The duration of the run in seconds.
+        processes: The number of worker processes, 0 if the queries were generated in the main process.
+    """
+
+    def __init__(self, ranges: int, errors: int, seconds: float, processes: int):
+        self.ranges = ranges
+        self.errors = errors
+        self.seconds = seconds
+        self.processes = processes
+
+    @property
+    def ranges_per_second(self) -> float:
+        return self.ranges / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self) -> str:
+        return '{0} ranges ({1} errors) in {2:.2f} s, {3:.0f} ranges/s with {4} worker process(es)'.format(
+            self.ranges, self.errors, self.seconds, self.ranges_per_second, self.processes)
+
+
+def generate(rows: Iterable[Row], writer, options: GenerationOptions, start_column: str = 'start',
+             end_column: str = 'end', processes: int = 0, chunk_size: int = 1000) -> GenerationReport:
+    """Generate the queries of all rows and write the rows with their query and error.
+
+    The rows are processed in chunks. With worker processes at most two chunks per process are in flight, so the
+    memory used is bounded by the chunk size, and the rows are written in the order they were read.
+
+    Args:
+        rows: The input rows.
+        writer: The writer of the output rows, CsvWriter or NdjsonWriter.
+        options: The options of generate_timerange_query.
+        start_column: The column of the start dates.
+        end_column: The column of the end dates.
+        processes: The number of worker processes, 0 to generate the queries in this process.
+        chunk_size: The number of rows per chunk.
+
+    Returns:
+        The report of the run.
+
+    Raises:
+        KeyError: If a row has no start or end column.
+    """
+    started = time.perf_counter()
+    count = 0
+    errors = 0
+
+    def write_chunk(chunk: List[Row], results: List[Tuple[str, str]]):
+        nonlocal count, errors
+        for row, (query, error) in zip(chunk, results):
+            row['query'] = query
+            row['error'] = error
+            writer.write(row)
+        count += len(chunk)
+        errors += sum(1 for _, error in results if error)
+
+    def ranges(chunk: List[Row]) -> List[Tuple[Any, Any]]:
+        return [(row[start_column], row[end_column]) for row in chunk]
+
+    if processes <= 0:
+        for chunk in chunked(rows, chunk_size):
+            write_chunk(chunk, generate_chunk(ranges(chunk), options))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            pending: 'deque[Tuple[List[Row], Future]]' = deque()
+            for chunk in chunked(rows, chunk_size):
+                pending.append((chunk, executor.submit(generate_chunk, ranges(chunk), options)))
+                if len(pending) >= 2 * processes:
+                    chunk, future = pending.popleft()
+                    write_chunk(chunk, future.result())
+            while pending:
+                chunk, future = pending.popleft()
+                write_chunk(chunk, future.result())
+    return GenerationReport(count, errors, time.perf_counter() - started, max(processes, 0))
+
+
+def _format_from_path(path: str, formats: Dict[str, str], default: str) -> str:
+    return formats.get(os.path.splitext(path)[1].lower(), default)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', nargs='?', default='-', help='The file with the ranges, - for stdin (CSV only)')
+    parser.add_argument('--output', '-o', default='-', help='The file to write the queries to, - for stdout')
+    parser.add_argument('--input-format', choices=INPUT_FORMATS, default=None,
+                        help='The format of the input, by default from the file extension (.parquet) or csv')
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default=None,
+                        help='The format of the output, by default from the file extension (.ndjson, .jsonl) or csv')
+    parser.add_argument('--start-column', default='start', help='The column of the start dates')
+    parser.add_argument('--end-column', default='end', help='The column of the end dates')
+    parser.add_argument('--timestamp-clause', action='store_true', help='Append a timestamp clause to the queries')
+    parser.add_argument('--timestamp-type', choices=TIMESTAMP_TYPES, default='s',
+                        help='The type of the timestamp column')
+    parser.add_argument('--sub-hour-precision', action='store_true',
+                        help='Restrict the partitions of the start and the end hour with timestamp bounds')
+    parser.add_argument('--processes', '-p', type=int, default=0,
+                        help='The number of worker processes, 0 (the default) generates in the main process')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='The number of ranges per chunk')
+    args = parser.parse_args(argv)
+    if args.chunk_size <= 0:
+        parser.error('--chunk-size must be positive')
+
+    input_format = args.input_format or _format_from_path(args.input, {'.parquet': 'parquet'}, 'csv')
+    output_format = args.output_format or _format_from_path(args.output, {'.ndjson': 'ndjson', '.jsonl': 'ndjson'},
+                                                            'csv')
+    if input_format == 'parquet' and args.input == '-':
+        parser.error('Parquet can not be read from stdin')
+    options = GenerationOptions(args.timestamp_clause, args.timestamp_type, args.sub_hour_precision)
+
+    input_file = None
+    output_file = None
+    try:
+        if input_format == 'parquet':
+            columns = read_parquet_columns(args.input)
+            rows = read_parquet(args.input, args.chunk_size)
+        else:
+            input_file = sys.stdin if args.input == '-' else open(args.input, newline='')
+            rows = read_csv(input_file)
+            columns = rows.fieldnames or []
+        # the columns are checked before the output is opened, which truncates an existing output file
+        for column in (args.start_column, args.end_column):
+            if column not in columns:
+                parser.exit(2, '{0}: error: the input has no column {1!r}\n'.format(parser.prog, column))
+        output_file = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+        writer = NdjsonWriter(output_file) if output_format == 'ndjson' else CsvWriter(output_file)
+        report = generate(rows, writer, options, args.start_column, args.end_column, args.processes,
+                          args.chunk_size)
+    finally:
+        if input_file is not None and input_file is not sys.stdin:
+            input_file.close()
+        if output_file is sys.stdout:
+            output_file.flush()
+        elif output_file is not None:
+            output_file.close()
+    print(report, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
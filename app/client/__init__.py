@@ -0,0 +1,14 @@
+"""Python client for the partitioning service.
+
+Example:
+
+    from app.client import PartitioningClient
+
+    with PartitioningClient('http://partitioning-service') as client:
+        query = client.query(start, end)
+        queries = client.query_many([(start, end), (other_start, other_end)])
+"""
+
+from .partitioning_client import AsyncPartitioningClient, PartitioningClient
+
+__all__ = ['PartitioningClient', 'AsyncPartitioningClient']
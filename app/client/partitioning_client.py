@@ -0,0 +1,213 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ..query_utils.hive_impala_query_builder import convert_dt_to_utc, generate_timerange_query
+
+_CacheKey = Tuple[str, datetime, datetime, bool]
+
+
+class _TTLCache(object):
+    """
+    A small thread-safe cache whose entries expire after a fixed time. If it is full the oldest entry is dropped.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._entries: Dict[_CacheKey, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: _CacheKey) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            return entry[1]
+
+    def put(self, key: _CacheKey, value: str):
+        with self._lock:
+            self._entries.pop(key, None)
+            if len(self._entries) >= self._max_size:
+                # dicts keep insertion order, the first entry is the oldest one
+                del self._entries[next(iter(self._entries))]
+            self._entries[key] = (time.monotonic() + self._ttl, value)
+
+
+class PartitioningClient(object):
+    """
+    Client for the impala / hive endpoints of the partitioning service.
+
+    It keeps a pooled keep-alive session, caches the responses for a while and can generate the queries in-process
+    (with the same generate_timerange_query the service uses), either always (local=True) or as fallback when the
+    service can not be reached (fallback=True).
+
+    Attributes:
+        base_url: The base url of the service, for example "http://partitioning-service".
+        engine: The endpoint to use, "impala" or "hive".
+        local: If True never call the service but always generate the queries in-process.
+        fallback: If True generate the query in-process if the service can not be reached.
+        timeout: The timeout of a request to the service in seconds.
+    """
+
+    def __init__(self, base_url: str = 'http://localhost:8080', engine: str = 'impala', local: bool = False,
+                 fallback: bool = True, timeout: float = 5.0, cache_ttl: float = 300.0, cache_size: int = 10000,
+                 pool_size: int = 10, session: Optional[requests.Session] = None):
+        """
+        Args:
+            base_url: The base url of the service.
+            engine: The endpoint to use, "impala" or "hive".
+            local: If True never call the service but always generate the queries in-process.
+            fallback: If True generate the query in-process if the service can not be reached.
+            timeout: The timeout of a request to the service in seconds.
+            cache_ttl: Seconds to keep a query in the local cache, 0 disables the cache.
+            cache_size: The maximum number of queries in the local cache.
+            pool_size: The number of keep-alive connections and of parallel requests in query_many.
+            session: The session to use, by default a new session with a connection pool of pool_size. A session
+                passed here is not closed by close.
+
+        Raises:
+            ValueError: If engine is not "impala" or "hive".
+        """
+        if engine not in ('impala', 'hive'):
+            raise ValueError('engine must be "impala" or "hive", not "%s"' % engine)
+        self.base_url = base_url.rstrip('/')
+        self.engine = engine
+        self.local = local
+        self.fallback = fallback
+        self.timeout = timeout
+        self._cache = _TTLCache(cache_ttl, cache_size) if cache_ttl > 0 else None
+        self._pool_size = pool_size
+        # only close the session on close if it has been created here
+        self._owns_session = session is None
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self._session = session
+
+    def close(self):
+        if self._owns_session:
+            self._session.close()
+
+    def __enter__(self) -> 'PartitioningClient':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _request(self, start: datetime, end: datetime, generate_timestamp_clause: bool) -> str:
+        """Get the query from the service.
+
+        Raises:
+            ValueError: If the service rejected the range (end before start).
+            requests.ConnectionError: If the service can not be reached.
+            requests.Timeout: If the service did not respond in time.
+        """
+        response = self._session.get('{0}/{1}'.format(self.base_url, self.engine),
+                                     params={'start': start.isoformat(), 'end': end.isoformat(),
+                                             'generate_timestamp_clause': str(generate_timestamp_clause).lower()},
+                                     timeout=self.timeout)
+        if response.status_code == 422:
+            raise ValueError(response.json()['detail'])
+        response.raise_for_status()
+        return response.json()['query']
+
+    def query(self, start: datetime, end: datetime, generate_timestamp_clause: bool = True) -> str:
+        """Get the partition query for a time range.
+
+        Naive datetimes are interpreted as UTC, like the service does.
+
+        Args:
+            start: The start date of the time range.
+            end: The end date of the time range.
+            generate_timestamp_clause: If True also generate a timestamp BETWEEN clause.
+
+        Returns:
+            The query string.
+
+        Raises:
+            ValueError: If end is before start.
+            requests.RequestException: If the service can not be reached and fallback is disabled or the service
+                responded with an error.
+        """
+        start = convert_dt_to_utc(start)
+        end = convert_dt_to_utc(end)
+        key = (self.engine, start, end, generate_timestamp_clause)
+        if self._cache is not None:
+            query = self._cache.get(key)
+            if query is not None:
+                return query
+        if self.local:
+            query = generate_timerange_query(start, end, generate_timestamp_clause)
+        else:
+            try:
+                query = self._request(start, end, generate_timestamp_clause)
+            except (requests.ConnectionError, requests.Timeout):
+                if not self.fallback:
+                    raise
+                query = generate_timerange_query(start, end, generate_timestamp_clause)
+        if self._cache is not None:
+            self._cache.put(key, query)
+        return query
+
+    def query_many(self, ranges: Iterable[Tuple[datetime, datetime]], generate_timestamp_clause: bool = True) \
+            -> List[str]:
+        """Get the partition queries for several time ranges, requesting up to pool_size of them in parallel.
+
+        Args:
+            ranges: Tuples of start and end date.
+            generate_timestamp_clause: If True also generate a timestamp BETWEEN clause.
+
+        Returns:
+            The queries in the order of the ranges.
+        """
+        ranges = list(ranges)
+        if self.local or len(ranges) <= 1:
+            return [self.query(start, end, generate_timestamp_clause) for start, end in ranges]
+        with ThreadPoolExecutor(max_workers=self._pool_size) as executor:
+            return list(executor.map(lambda r: self.query(r[0], r[1], generate_timestamp_clause), ranges))
+
+
+class AsyncPartitioningClient(object):
+    """
+    asyncio interface for the PartitioningClient.
+
+    The requests are run by the pooled session of a PartitioningClient in a thread pool, so they do not block the
+    event loop. All arguments are passed on to PartitioningClient.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._client = PartitioningClient(*args, **kwargs)
+        self._executor = ThreadPoolExecutor(max_workers=self._client._pool_size)
+
+    async def close(self):
+        self._executor.shutdown(wait=False)
+        self._client.close()
+
+    async def __aenter__(self) -> 'AsyncPartitioningClient':
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def query(self, start: datetime, end: datetime, generate_timestamp_clause: bool = True) -> str:
+        """Get the partition query for a time range, see PartitioningClient.query."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, self._client.query, start, end, generate_timestamp_clause)
+
+    async def query_many(self, ranges: Iterable[Tuple[datetime, datetime]], generate_timestamp_clause: bool = True) \
+            -> List[str]:
+        """Get the partition queries for several time ranges concurrently, see PartitioningClient.query_many."""
+        return list(await asyncio.gather(*(self.query(start, end, generate_timestamp_clause)
+                                           for start, end in ranges)))
@@ -1,13 +1,15 @@
+import asyncio
 import logging
 import os
 from typing import List, Dict, Union
 
 from fastapi import FastAPI
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, Response
 from fastapi.logger import logger
 from prometheus_fastapi_instrumentator import Instrumentator
 
-from .routers import metrics, partition_range
+from . import binary_protocol, openapi_schema, profiler
+from .routers import metrics, partition_range, profiling
 
 
 APP_NAME = 'Partitioning Service'
@@ -52,20 +54,34 @@ tags_metadata: List[Dict[str, Union[str, Dict[str, str]]]] = [
     {
         'name': 'queries',
         'description': 'Generates queries for impala / hive'
-     }
+     },
+    {
+        'name': 'admin',
+        'description': 'Profiling of the running service, only available if ENABLE_PROFILING is true'
+    }
 ]
 
+# the lean profile is meant for internal callers only: it has no docs, serves a pre-generated OpenAPI schema and
+# records metrics with the built-in stage metrics instead of the prometheus-fastapi-instrumentator middleware
+lean_profile: bool = os.environ.get('APP_PROFILE', 'default').lower() == 'lean'
+
 app = FastAPI(title=APP_NAME,
               version=version,
               description=description,
               openapi_tags=tags_metadata,
+              docs_url=None if lean_profile else '/docs',
+              redoc_url=None if lean_profile else '/redoc',
+              openapi_url=None if lean_profile else '/openapi.json',
 )
 
-# create an instrumentator to expose metrics to prometheus
-instrumentator = Instrumentator(
-    excluded_handlers=["/metrics"],
-)
-instrumentator.instrument(app)
+if lean_profile:
+    app.add_middleware(profiler.StageMetricsMiddleware)
+else:
+    # create an instrumentator to expose metrics to prometheus
+    instrumentator = Instrumentator(
+        excluded_handlers=["/metrics"],
+    )
+    instrumentator.instrument(app)
 
 # add routers
 app.include_router(
@@ -76,8 +92,61 @@ app.include_router(
 
 app.include_router(partition_range.router, tags=['queries'])
 
+# profiling is opt-in, if it is disabled neither the endpoint nor the middleware for the stage timings exist
+if os.environ.get('ENABLE_PROFILING', 'false').lower() == 'true':
+    app.include_router(
+        profiling.router,
+        prefix='/admin',
+        tags=['admin']
+    )
+    app.add_middleware(profiler.StageTimingMiddleware)
+
+
+# load the partition statistics of the cost estimation before serving, so that a missing or invalid file stops the
+# worker instead of failing every estimate (with PRELOAD_APP they have already been loaded by the gunicorn master)
+@app.on_event('startup')
+def preload_partition_statistics():
+    partition_range.load_partition_statistics()
+
+
+# refresh the pre-rendered rolling windows on every hour boundary in the background
+@app.on_event('startup')
+async def start_rolling_window_refresh():
+    app.state.rolling_window_refresh = asyncio.ensure_future(partition_range.rolling_window_cache.run_refresh_loop())
+
 
-# Show the docs under /
-@app.get("/", include_in_schema=False)
-def root():
-    return RedirectResponse('/docs')
+@app.on_event('shutdown')
+async def stop_rolling_window_refresh():
+    app.state.rolling_window_refresh.cancel()
+
+
+# serve the binary protocol next to the HTTP endpoints if a port is configured
+@app.on_event('startup')
+async def start_binary_protocol_server():
+    port = os.environ.get('BINARY_PROTOCOL_PORT')
+    app.state.binary_protocol_server = None
+    if port:
+        app.state.binary_protocol_server = await binary_protocol.start_server(
+            host=os.environ.get('BINARY_PROTOCOL_HOST', '0.0.0.0'), port=int(port), reuse_port=True)
+
+
+@app.on_event('shutdown')
+async def stop_binary_protocol_server():
+    if app.state.binary_protocol_server is not None:
+        app.state.binary_protocol_server.close()
+        await app.state.binary_protocol_server.wait_closed()
+
+
+if lean_profile:
+    # rendered once on startup (in the gunicorn master with PRELOAD_APP) from the app as it is configured, e.g. with
+    # or without the profiling endpoints, instead of on the first request
+    openapi_json: bytes = openapi_schema.render(app)
+
+    @app.get('/openapi.json', include_in_schema=False)
+    def openapi():
+        return Response(openapi_json, media_type='application/json')
+else:
+    # Show the docs under /
+    @app.get("/", include_in_schema=False)
+    def root():
+        return RedirectResponse('/docs')
@@ -1,3 +1,5 @@
+from typing import Dict, List, Optional
+
 from pydantic import BaseModel, Field
 
 
@@ -16,3 +18,90 @@ class QueryStringResponse(BaseModel):
                          'AND `hour` BETWEEN 0 AND 17))'
             }
         }
+
+
+class MultiDialectQueryResponse(BaseModel):
+    """This response contains the query string to be used in a WHERE clause for every requested SQL dialect.
+    """
+    queries: Dict[str, str] = Field(...,
+                                    title='Queries',
+                                    description='The query string per SQL dialect')
+
+    class Config:
+        schema_extra = {
+            'example': {
+                'queries': {
+                    'impala': '((`year` = 2020 AND `month` = 11 AND `day` = 24 AND `hour` BETWEEN 15 AND 23) OR '
+                              '(`year` = 2020 AND `month` = 11 AND `day` = 25 AND `hour` BETWEEN 0 AND 17))',
+                    'trino': '(("year" = 2020 AND "month" = 11 AND "day" = 24 AND "hour" BETWEEN 15 AND 23) OR '
+                             '("year" = 2020 AND "month" = 11 AND "day" = 25 AND "hour" BETWEEN 0 AND 17))',
+                }
+            }
+        }
+
+
+class SegmentCostEstimate(BaseModel):
+    """The estimated cost of reading the partitions of one segment of the partition filter.
+    """
+    partition_filter: str = Field(...,
+                                  title='Partition Filter',
+                                  description='The partition filter of the segment')
+    partitions: int = Field(...,
+                            title='Partitions',
+                            description='The number of hour partitions of the segment')
+    partitions_with_statistics: Optional[int] = Field(None,
+                                                      title='Partitions with Statistics',
+                                                      description='The number of partitions of the segment with size '
+                                                                  'statistics, the size of the others is estimated '
+                                                                  'with the mean partition size')
+    estimated_bytes: Optional[int] = Field(None,
+                                           title='Estimated Bytes',
+                                           description='The estimated size of the partitions of the segment')
+    estimated_files: Optional[int] = Field(None,
+                                           title='Estimated Files',
+                                           description='The estimated number of files of the partitions of the '
+                                                       'segment')
+
+    class Config:
+        orm_mode = True
+
+
+class CostEstimateResponse(BaseModel):
+    """This response contains the number of partitions of a time range and, if partition statistics are configured,
+    the estimated number of bytes and files to read. The estimates are null if no statistics are configured.
+    """
+    partitions: int = Field(...,
+                            title='Partitions',
+                            description='The number of hour partitions of the time range')
+    partitions_with_statistics: Optional[int] = Field(None,
+                                                      title='Partitions with Statistics',
+                                                      description='The number of partitions with size statistics')
+    estimated_bytes: Optional[int] = Field(None,
+                                           title='Estimated Bytes',
+                                           description='The estimated size of the partitions')
+    estimated_files: Optional[int] = Field(None,
+                                           title='Estimated Files',
+                                           description='The estimated number of files of the partitions')
+    segments: List[SegmentCostEstimate] = Field(...,
+                                                title='Segments',
+                                                description='The estimates per segment of the partition filter')
+
+    class Config:
+        schema_extra = {
+            'example': {
+                'partitions': 27,
+                'partitions_with_statistics': 27,
+                'estimated_bytes': 58325123072,
+                'estimated_files': 432,
+                'segments': [
+                    {'partition_filter': '(`year` = 2020 AND `month` = 11 AND `day` = 24 AND `hour` BETWEEN 15 AND '
+                                         '23)',
+                     'partitions': 9, 'partitions_with_statistics': 9, 'estimated_bytes': 19441707690,
+                     'estimated_files': 144},
+                    {'partition_filter': '(`year` = 2020 AND `month` = 11 AND `day` = 25 AND `hour` BETWEEN 0 AND '
+                                         '17)',
+                     'partitions': 18, 'partitions_with_statistics': 18, 'estimated_bytes': 38883415382,
+                     'estimated_files': 288},
+                ]
+            }
+        }
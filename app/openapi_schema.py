@@ -0,0 +1,32 @@
+"""Generate the OpenAPI schema of the app.
+
+The lean profile of the app (APP_PROFILE=lean, see main) renders the schema on startup instead of on the first
+request. The schema of the app (with the configuration of the environment) can be written to a file with:
+
+    python -m app.openapi_schema openapi.json
+"""
+
+import argparse
+import json
+
+from fastapi import FastAPI
+
+
+def render(app: FastAPI) -> bytes:
+    """Render the OpenAPI schema of the app as JSON, like FastAPI serves it."""
+    return json.dumps(app.openapi(), ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('output', help='The file to write the schema to')
+    args = parser.parse_args()
+
+    from .main import app
+    with open(args.output, 'wb') as f:
+        f.write(render(app))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""Low overhead profiling of a running worker.
+
+SamplingProfiler samples the stacks of all threads of the process in a background thread, so nothing is added to
+the code that is profiled. The profile can be exported in the collapsed stack format (for flamegraph.pl and most
+flame graph tools) or in the speedscope format (https://www.speedscope.app).
+
+`stage` measures the duration of the stages of a request (e.g. generating the query). The timings are only recorded
+if the request asked for them (see StageTimingMiddleware), otherwise `stage` does nothing but a context variable
+lookup.
+
+Both are only available if the environment variable ENABLE_PROFILING is true, see app/routers/profiling.py. The
+lean profile of the app (APP_PROFILE=lean, see main) records the stage timings of every request in prometheus metrics
+with StageMetricsMiddleware instead.
+"""
+
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from prometheus_client import Counter as PrometheusCounter, Histogram
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# the header a request has to set to get the stage timings in the Server-Timing header of the response
+DEBUG_TIMINGS_HEADER = 'X-Debug-Timings'
+_DEBUG_TIMINGS_HEADER_NAME = DEBUG_TIMINGS_HEADER.lower().encode('latin-1')
+
+_stage_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar('stage_timings', default=None)
+
+_Frame = Tuple[str, str, int]
+
+_DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+REQUESTS = PrometheusCounter('partitioning_service_requests_total', 'Number of HTTP requests by status code',
+                             ['status'])
+REQUEST_DURATION = Histogram('partitioning_service_request_duration_seconds', 'Duration of the HTTP requests',
+                             buckets=_DURATION_BUCKETS)
+STAGE_DURATION = Histogram('partitioning_service_stage_duration_seconds', 'Duration of the stages of the requests',
+                           ['stage'], buckets=_DURATION_BUCKETS)
+
+
+class stage(object):
+    """
+    Context manager that records the duration of a stage of the current request, if it asked for stage timings.
+    """
+
+    __slots__ = ('_name', '_timings', '_started')
+
+    def __init__(self, name: str):
+        self._name = name
+        self._timings = _stage_timings.get()
+
+    def __enter__(self):
+        if self._timings is not None:
+            self._started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self._timings is not None:
+            self._timings.append((self._name, time.perf_counter() - self._started))
+
+
+class StageTimingMiddleware(object):
+    """
+    ASGI middleware that returns the stage timings of a request in the Server-Timing header of the response, if the
+    request set the X-Debug-Timings header.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http' or all(name != _DEBUG_TIMINGS_HEADER_NAME for name, _ in scope['headers']):
+            await self.app(scope, receive, send)
+            return
+        timings: List[Tuple[str, float]] = []
+        started = time.perf_counter()
+
+        async def send_with_timings(message: Message):
+            if message['type'] == 'http.response.start':
+                timings.append(('total', time.perf_counter() - started))
+                value = ', '.join('{0};dur={1:.3f}'.format(name, 1000 * duration) for name, duration in timings)
+                message['headers'] = list(message.get('headers', [])) + [(b'server-timing', value.encode('latin-1'))]
+            await send(message)
+
+        token = _stage_timings.set(timings)
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            _stage_timings.reset(token)
+
+
+class StageMetricsMiddleware(object):
+    """
+    ASGI middleware that records the number and the duration of the requests and the durations of their stages in
+    prometheus metrics.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        # the stage timings might already be recorded for the Server-Timing header
+        timings = _stage_timings.get()
+        token = None
+        if timings is None:
+            timings = []
+            token = _stage_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_DURATION.observe(time.perf_counter() - started)
+            REQUESTS.labels(str(status)).inc()
+            for name, duration in timings:
+                if name != 'total':
+                    STAGE_DURATION.labels(name).observe(duration)
+            if token is not None:
+                _stage_timings.reset(token)
+
+
+class SamplingProfiler(object):
+    """
+    Samples the stacks of all other threads of the process in a fixed interval.
+
+    Attributes:
+        interval: The sampling interval in seconds.
+        samples: The number of times each stack (tuple of frames from the outermost to the innermost) was sampled.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        """
+        Args:
+            interval: The sampling interval in seconds.
+        """
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                if thread_id not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack.append(('thread ' + names.get(thread_id, str(thread_id)), '', 0))
+                self.samples[tuple(reversed(stack))] += 1
+
+    @staticmethod
+    def _frame_name(frame: _Frame) -> str:
+        name, filename, line = frame
+        if not filename:
+            return name
+        return '{0} ({1}:{2})'.format(name, filename.rsplit('/', 1)[-1], line)
+
+    def collapsed(self) -> str:
+        """The profile in the collapsed stack format, one "frame;frame;frame count" line per stack."""
+        return ''.join('{0} {1}\n'.format(';'.join(self._frame_name(frame).replace(';', ',') for frame in stack),
+                                          count)
+                       for stack, count in self.samples.most_common())
+
+    def speedscope(self, name: str = 'partitioning-service') -> Dict:
+        """The profile in the speedscope file format, the weights are seconds."""
+        frame_indices: Dict[_Frame, int] = {}
+        frames = []
+        samples = []
+        weights = []
+        for stack, count in self.samples.items():
+            indices = []
+            for frame in stack:
+                if frame not in frame_indices:
+                    frame_indices[frame] = len(frames)
+                    frames.append({'name': frame[0], 'file': frame[1], 'line': frame[2]})
+                indices.append(frame_indices[frame])
+            samples.append(indices)
+            weights.append(count * self.interval)
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'partitioning-service',
+            'shared': {'frames': frames},
+            'profiles': [{'type': 'sampled', 'name': name, 'unit': 'seconds', 'startValue': 0,
+                          'endValue': sum(weights), 'samples': samples, 'weights': weights}],
+        }
@@ -0,0 +1,185 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, FrozenSet, Iterable, Optional, Tuple
+
+HOURS_PER_YEAR = 24 * 365
+
+
+class TokenBucket(object):
+    """
+    A token bucket that refills with a constant rate up to its capacity.
+
+    Requests reserve their cost in tokens. A reservation can take the bucket into debt, the request then has to wait
+    until the bucket refilled the debt, which queues the requests of a client in the order of their reservations.
+
+    Attributes:
+        tokens: The tokens in the bucket at the time of the last update, negative if in debt.
+        updated: The time of the last update.
+    """
+
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, capacity: float, now: float):
+        self.tokens = capacity
+        self.updated = now
+
+    def reserve(self, cost: float, rate: float, capacity: float, max_wait: float, now: float) -> Tuple[bool, float]:
+        """Reserve cost tokens if the request has to wait at most max_wait seconds for them.
+
+        Args:
+            cost: The cost of the request in tokens, at most capacity.
+            rate: The tokens added per second.
+            capacity: The maximum number of tokens in the bucket.
+            max_wait: The maximum time in seconds a request may wait for its tokens.
+            now: The current time in seconds.
+
+        Returns:
+            A tuple (admitted, wait). If admitted the tokens are reserved and the request has to wait `wait` seconds
+            before it runs, otherwise nothing is reserved and `wait` is the time until the request would be admitted.
+        """
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        wait = (cost - self.tokens) / rate if self.tokens < cost else 0.0
+        if wait > max_wait:
+            return False, wait - max_wait
+        self.tokens -= cost
+        return True, wait
+
+
+class AdmissionController(object):
+    """
+    Limits the work every client can request from a worker with a token bucket per client.
+
+    The cost of a request grows with the span of its time range and the number of results it asks for, so that a
+    client requesting multi-decade ranges or large batches exhausts its bucket faster than a client requesting a few
+    hours. The buckets are kept in memory per worker for the most recently seen clients.
+
+    Clients are identified by their address. A client identifier sent by the client itself is only used for requests
+    from the trusted proxies, which are expected to set (or overwrite) it, since any other client could use it to
+    escape its limit or to exhaust the buckets of other clients.
+
+    Attributes:
+        rate: The tokens added to the bucket of every client per second.
+        capacity: The maximum number of tokens in a bucket, the burst a client can request at once.
+        max_wait: The maximum time in seconds a request is queued waiting for tokens before it is rejected.
+        hours_per_token: The span of the time range in hours that costs one token in addition to the base cost.
+        max_clients: The maximum number of buckets, the least recently used are dropped.
+        trusted_proxies: The addresses of the proxies whose client identifiers are used.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, max_wait: float = 0.0,
+                 hours_per_token: float = HOURS_PER_YEAR, max_clients: int = 10000,
+                 trusted_proxies: Iterable[str] = (), clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            rate: The tokens added to the bucket of every client per second.
+            capacity: The maximum number of tokens in a bucket, ten times the rate if None.
+            max_wait: The maximum time in seconds a request is queued waiting for tokens before it is rejected.
+            hours_per_token: The span of the time range in hours that costs one token in addition to the base cost.
+            max_clients: The maximum number of buckets, the least recently used are dropped.
+            trusted_proxies: The addresses of the proxies whose client identifiers are used.
+            clock: The clock in seconds, for tests.
+
+        Raises:
+            ValueError: If a value is not positive (max_wait: negative).
+        """
+        if capacity is None:
+            capacity = 10 * rate
+        if rate <= 0 or capacity <= 0 or hours_per_token <= 0 or max_clients <= 0 or max_wait < 0:
+            raise ValueError('rate, capacity, hours_per_token and max_clients must be positive, max_wait must not be '
+                             'negative')
+        self.rate = rate
+        self.capacity = capacity
+        self.max_wait = max_wait
+        self.hours_per_token = hours_per_token
+        self.max_clients = max_clients
+        self.trusted_proxies: FrozenSet[str] = frozenset(trusted_proxies)
+        self._clock = clock
+        self._buckets: 'OrderedDict[str, TokenBucket]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional['AdmissionController']:
+        """Create the admission controller from the environment variables.
+
+        ADMISSION_RATE sets the rate, ADMISSION_BURST the capacity, ADMISSION_MAX_QUEUE_MS the maximum wait in
+        milliseconds, ADMISSION_HOURS_PER_TOKEN the hours per token, ADMISSION_MAX_CLIENTS the maximum number of
+        buckets and ADMISSION_TRUSTED_PROXIES the comma separated addresses of the trusted proxies.
+
+        Returns:
+            The admission controller or None if ADMISSION_RATE is not set.
+        """
+        rate = os.environ.get('ADMISSION_RATE')
+        if not rate:
+            return None
+        burst = os.environ.get('ADMISSION_BURST')
+        return cls(rate=float(rate),
+                   capacity=float(burst) if burst else None,
+                   max_wait=float(os.environ.get('ADMISSION_MAX_QUEUE_MS', '0')) / 1000,
+                   hours_per_token=float(os.environ.get('ADMISSION_HOURS_PER_TOKEN', str(HOURS_PER_YEAR))),
+                   max_clients=int(os.environ.get('ADMISSION_MAX_CLIENTS', '10000')),
+                   trusted_proxies=[address.strip()
+                                    for address in os.environ.get('ADMISSION_TRUSTED_PROXIES', '').split(',')
+                                    if address.strip()])
+
+    def client(self, address: str, client_id: Optional[str] = None) -> str:
+        """The key of the bucket of a request.
+
+        Args:
+            address: The address the request came from.
+            client_id: The client identifier sent with the request, if any.
+
+        Returns:
+            The client identifier if the request came from a trusted proxy, otherwise the address.
+        """
+        if client_id and address in self.trusted_proxies:
+            return client_id
+        return address
+
+    def cost(self, start: datetime, end: datetime, batch_size: int = 1) -> float:
+        """The cost of a request in tokens.
+
+        Every result of the request costs one token plus one token per hours_per_token hours of the time range. The
+        cost is capped at the capacity, so that every request can be admitted with a full bucket.
+
+        Args:
+            start: The start date of the time range.
+            end: The end date of the time range.
+            batch_size: The number of results the request asks for, e.g. the number of dialects.
+
+        Returns:
+            The cost in tokens.
+        """
+        hours = max(end - start, timedelta(0)) / timedelta(hours=1)
+        return min(self.capacity, batch_size * (1.0 + hours / self.hours_per_token))
+
+    def reserve(self, client: str, cost: float) -> Tuple[bool, float]:
+        """Reserve the tokens of a request in the bucket of the client.
+
+        Args:
+            client: The identifier of the client.
+            cost: The cost of the request in tokens, see `cost`.
+
+        Returns:
+            A tuple (admitted, wait). If admitted the request has to wait `wait` seconds before it runs, otherwise it
+            is rejected and `wait` is the time after which it would be admitted.
+        """
+        with self._lock:
+            now = self._clock()
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = TokenBucket(self.capacity, now)
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+            return bucket.reserve(cost, self.rate, self.capacity, self.max_wait, now)
+
+    @staticmethod
+    def retry_after(wait: float) -> str:
+        """Format the time until a rejected request would be admitted for the Retry-After header (whole seconds)."""
+        return str(max(1, math.ceil(wait)))
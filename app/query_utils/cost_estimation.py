@@ -0,0 +1,196 @@
+import bisect
+import csv
+import os
+from calendar import monthrange
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from app.query_utils.hive_impala_query_builder import PartitionQueryBuilder, validate_time_range
+from app.query_utils.partition_matcher import partition_key
+from app.query_utils.time_range_container import TimeRangeContainer
+
+
+def _leap_years_until(year: int) -> int:
+    """The number of leap years from year 1 to year (included)."""
+    return year // 4 - year // 100 + year // 400
+
+
+def count_partitions(time_range: TimeRangeContainer) -> int:
+    """Count the hour partitions of a segment without enumerating them.
+
+    Args:
+        time_range: The TimeRangeContainer of the segment, the values of every column are consecutive.
+
+    Returns:
+        The number of hour partitions covered by the segment.
+    """
+    if time_range.hours:
+        return len(time_range.hours)
+    if time_range.days:
+        return 24 * len(time_range.days)
+    if time_range.months:
+        year = time_range.years[0]
+        first = date(year=year, month=time_range.months[0], day=1)
+        last = date(year=year, month=time_range.months[-1], day=monthrange(year, time_range.months[-1])[1])
+        return 24 * ((last - first).days + 1)
+    first_year = time_range.years[0]
+    last_year = time_range.years[-1]
+    days = 365 * (last_year - first_year + 1) + _leap_years_until(last_year) - _leap_years_until(first_year - 1)
+    return 24 * days
+
+
+def partition_key_range(time_range: TimeRangeContainer) -> Tuple[int, int]:
+    """The keys (see `partition_key`) of the first and the last hour partition of a segment.
+
+    All partitions of a segment are consecutive, so a partition is in the segment if its key is in the range.
+    """
+    first = partition_key(time_range.years[0],
+                          time_range.months[0] if time_range.months else 1,
+                          time_range.days[0] if time_range.days else 1,
+                          time_range.hours[0] if time_range.hours else 0)
+    # day 31 is after the last day of every month, there are no partitions with larger keys in the month
+    last = partition_key(time_range.years[-1],
+                         time_range.months[-1] if time_range.months else 12,
+                         time_range.days[-1] if time_range.days else 31,
+                         time_range.hours[-1] if time_range.hours else 23)
+    return first, last
+
+
+class PartitionStatistics(object):
+    """
+    The size (bytes and number of files) of the hour partitions of a table.
+
+    The statistics are kept as cumulative sums ordered by partition key, so the sizes of all partitions in a key range
+    are summed with two binary searches. Several rows for the same partition (e.g. one per file or per location) are
+    summed.
+
+    Attributes:
+        partition_count: The number of partitions with statistics.
+        mean_bytes: The mean size of a partition in bytes.
+        mean_files: The mean number of files of a partition.
+    """
+
+    def __init__(self, partitions: List[Tuple[int, int, int, int, int, int]]):
+        """
+        Args:
+            partitions: The statistics of the partitions as tuples (year, month, day, hour, bytes, files).
+        """
+        totals: Dict[int, Tuple[int, int]] = {}
+        for year, month, day, hour, size, files in partitions:
+            key = partition_key(year, month, day, hour)
+            total_size, total_files = totals.get(key, (0, 0))
+            totals[key] = (total_size + size, total_files + files)
+        rows = sorted((key, size, files) for key, (size, files) in totals.items())
+        self._keys = [key for key, _, _ in rows]
+        self._cumulative_bytes = [0]
+        self._cumulative_files = [0]
+        for _, size, files in rows:
+            self._cumulative_bytes.append(self._cumulative_bytes[-1] + size)
+            self._cumulative_files.append(self._cumulative_files[-1] + files)
+        self.partition_count = len(rows)
+        self.mean_bytes = self._cumulative_bytes[-1] / len(rows) if rows else 0.0
+        self.mean_files = self._cumulative_files[-1] / len(rows) if rows else 0.0
+
+    @classmethod
+    def load(cls, path: str) -> 'PartitionStatistics':
+        """Load the statistics from a CSV file with the columns year, month, day, hour, bytes and files.
+
+        Raises:
+            ValueError: If a column is missing or a value is not an integer.
+        """
+        with open(path, newline='') as f:
+            reader = csv.DictReader(f)
+            try:
+                partitions = [(int(row['year']), int(row['month']), int(row['day']), int(row['hour']),
+                               int(row['bytes']), int(row['files']))
+                              for row in reader]
+            except KeyError as e:
+                raise ValueError('Partition statistics "{0}" have no column {1}'.format(path, e))
+        return cls(partitions)
+
+    @classmethod
+    def from_env(cls) -> Optional['PartitionStatistics']:
+        """Load the statistics from the file in the environment variable PARTITION_STATS_PATH.
+
+        Returns:
+            The statistics or None if the environment variable is not set.
+        """
+        path = os.environ.get('PARTITION_STATS_PATH')
+        return cls.load(path) if path else None
+
+    def sum_range(self, first_key: int, last_key: int) -> Tuple[int, int, int]:
+        """Sum the statistics of all partitions with keys from first_key to last_key (both included).
+
+        Returns:
+            The number of partitions with statistics, their bytes and their files.
+        """
+        first = bisect.bisect_left(self._keys, first_key)
+        last = bisect.bisect_right(self._keys, last_key)
+        return (last - first, self._cumulative_bytes[last] - self._cumulative_bytes[first],
+                self._cumulative_files[last] - self._cumulative_files[first])
+
+
+class SegmentCostEstimate(object):
+    """
+    The estimated cost of reading one segment of the partition filter.
+
+    Attributes:
+        partition_filter: The partition filter of the segment.
+        partitions: The number of hour partitions of the segment.
+        partitions_with_statistics: The number of those partitions with statistics, `None` without statistics.
+        estimated_bytes: The estimated size of the partitions, `None` without statistics.
+        estimated_files: The estimated number of files of the partitions, `None` without statistics.
+    """
+
+    def __init__(self, partition_filter: str, partitions: int, partitions_with_statistics: Optional[int] = None,
+                 estimated_bytes: Optional[int] = None, estimated_files: Optional[int] = None):
+        self.partition_filter = partition_filter
+        self.partitions = partitions
+        self.partitions_with_statistics = partitions_with_statistics
+        self.estimated_bytes = estimated_bytes
+        self.estimated_files = estimated_files
+
+
+def estimate_cost(start: datetime, end: datetime, statistics: Optional[PartitionStatistics] = None) \
+        -> List[SegmentCostEstimate]:
+    """
+    Estimates the cost of reading the partitions of a time range per segment of its partition filter.
+
+    The partitions are counted per segment arithmetically and the statistics are summed per key range, so the cost of
+    the estimation does not depend on the length of the time range. Partitions without statistics are estimated with
+    the mean size of the partitions with statistics.
+
+    Args:
+        start: The start date in UTC.
+        end: The end date in UTC.
+        statistics: The partition statistics of the table or `None` to count the partitions only.
+
+    Raises:
+        ValueError: If start date or end date is not in UTC or if start date is after end date.
+
+    Returns:
+        The estimate for every segment of the partition filter, in the order of the filter.
+    """
+    validate_time_range(start, end)
+    builder = PartitionQueryBuilder(start_date=start, end_date=end)
+    estimates = []
+    seen_filters = set()
+    for segment in PartitionQueryBuilder.SEGMENTS:
+        time_range = builder.build_segment(segment)
+        if time_range is None:
+            continue
+        partition_filter = builder.build_segment_filter(segment)
+        # the partition filter contains identical segments only once
+        if partition_filter in seen_filters:
+            continue
+        seen_filters.add(partition_filter)
+        estimate = SegmentCostEstimate(partition_filter, count_partitions(time_range))
+        if statistics is not None:
+            known, size, files = statistics.sum_range(*partition_key_range(time_range))
+            # partitions outside of the calendar (e.g. day 31 of a shorter month) might be in the statistics
+            unknown = max(estimate.partitions - known, 0)
+            estimate.partitions_with_statistics = known
+            estimate.estimated_bytes = size + round(unknown * statistics.mean_bytes)
+            estimate.estimated_files = files + round(unknown * statistics.mean_files)
+        estimates.append(estimate)
+    return estimates
@@ -1,26 +1,226 @@
 from calendar import monthrange
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from dateutil.relativedelta import relativedelta
 from collections import OrderedDict
+from typing import Callable, Iterable, Tuple
 
+from app.query_utils.partition_matcher import PartitionMatcher
 from app.query_utils.time_range_container import *
 
 
-def generate_timerange_query(start: datetime, end: datetime, generate_timestamp_clause: bool = True) -> str:
+# the types the timestamp column can have: an integer timestamp in seconds, milliseconds, microseconds or nanoseconds
+# since the epoch or a native TIMESTAMP
+TIMESTAMP_TYPES = ('s', 'ms', 'us', 'ns', 'timestamp')
+
+_EPOCH = datetime(year=1970, month=1, day=1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def timestamp_value(d: datetime, timestamp_type: str = 's') -> int:
+    """Convert a datetime to an integer timestamp in the unit of timestamp_type.
+
+    Fractions of the unit are truncated, so a filter with the values of a start and an end date covers all rows of
+    the time range if the column has the same unit.
+
+    Args:
+        d: The datetime in UTC.
+        timestamp_type: One of 's', 'ms', 'us' or 'ns'.
+
+    Returns:
+        The timestamp since the epoch in the unit.
+
+    Raises:
+        ValueError: If timestamp_type is not an integer unit.
     """
-    Generates the timerange query for partitioning that suits both hive and impala queries.
+    if timestamp_type == 's':
+        return int(d.timestamp())
+    microseconds = (d - _EPOCH) // _MICROSECOND
+    if timestamp_type == 'ms':
+        return microseconds // 1000
+    if timestamp_type == 'us':
+        return microseconds
+    if timestamp_type == 'ns':
+        return microseconds * 1000
+    raise ValueError("Timestamp type has to be one of s, ms, us or ns. Instead we have %s" % timestamp_type)
+
+
+def timestamp_literal_value(d: datetime) -> str:
+    """Format a datetime in UTC as the value of a TIMESTAMP literal, e.g. "2020-11-24 15:00:00" (with fractional
+    seconds only if there are any)."""
+    return d.replace(tzinfo=None).isoformat(sep=' ')
+
+
+def _truncate_to_hour(d: datetime) -> datetime:
+    return d.replace(minute=0, second=0, microsecond=0)
+
+
+def _is_first_instant_of_hour(d: datetime, timestamp_type: str) -> bool:
+    """Check if there can be no timestamp of the type in the hour of d before d."""
+    if timestamp_type == 'timestamp':
+        return d == _truncate_to_hour(d)
+    return timestamp_value(d, timestamp_type) <= timestamp_value(_truncate_to_hour(d), timestamp_type)
+
+
+def _is_last_instant_of_hour(d: datetime, timestamp_type: str) -> bool:
+    """Check if there can be no timestamp of the type in the hour of d after d."""
+    next_hour = _truncate_to_hour(d) + timedelta(hours=1)
+    if timestamp_type == 'timestamp':
+        return d >= next_hour - _MICROSECOND
+    return timestamp_value(d, timestamp_type) >= timestamp_value(next_hour, timestamp_type) - 1
+
+
+def split_boundary_hours(time_range: TimeRangeContainer, start: datetime, end: datetime, timestamp_type: str = 's') \
+        -> List[Tuple[TimeRangeContainer, Optional[datetime], Optional[datetime]]]:
+    """
+    Splits the hour of the start date and the hour of the end date off a segment, if the time range only covers a
+    part of them.
+
+    The split off hours get a lower (start date) or upper (end date) bound for the timestamp, so that only the part
+    of the partition that is in the time range is read. All other hours of the segment (and segments without hours)
+    are returned unchanged without bounds.
 
     Args:
+        time_range: The TimeRangeContainer of the segment.
         start: The start date in UTC.
         end: The end date in UTC.
-        generate_timestamp_clause: If True append a timestamp BETWEEN clause to the query (with the corresponding
-            start and end timestamps).
+        timestamp_type: The type of the timestamp column, one of TIMESTAMP_TYPES. A boundary hour is only split off
+            if there can be timestamps of the type in it that are outside of the time range.
+
+    Returns:
+        The parts of the segment as tuples of the TimeRangeContainer, the lower bound and the upper bound of the
+        timestamp (`None` if not bounded).
+    """
+    if not time_range.hours:
+        return [(time_range, None, None)]
+    day = (time_range.years[0], time_range.months[0], time_range.days[0])
+    hours = time_range.hours
+    bound_start = (day == (start.year, start.month, start.day) and hours[0] == start.hour
+                   and not _is_first_instant_of_hour(start, timestamp_type))
+    bound_end = (day == (end.year, end.month, end.day) and hours[-1] == end.hour
+                 and not _is_last_instant_of_hour(end, timestamp_type))
+    if len(hours) == 1:
+        return [(time_range, start if bound_start else None, end if bound_end else None)]
+
+    def part(part_hours: List[int]) -> TimeRangeContainer:
+        return TimeRangeContainer(years=time_range.years, months=time_range.months, days=time_range.days,
+                                  hours=part_hours)
+
+    parts = []
+    first = 0
+    last = len(hours)
+    if bound_start:
+        parts.append((part(hours[:1]), start, None))
+        first = 1
+    if bound_end:
+        last -= 1
+    if first < last:
+        parts.append((part(hours[first:last]), None, None))
+    if bound_end:
+        parts.append((part(hours[-1:]), None, end))
+    return parts
+
+
+# the TIMESTAMP literal of impala and hive, "{0}" is replaced by the value in UTC
+TIMESTAMP_LITERAL_TEMPLATE = "CAST('{0}' AS TIMESTAMP)"
+
+
+def build_timestamp_literal(d: datetime, timestamp_type: str,
+                            timestamp_literal_template: str = TIMESTAMP_LITERAL_TEMPLATE) -> str:
+    """Build the literal of a datetime in UTC for a timestamp column of the type, one of TIMESTAMP_TYPES."""
+    if timestamp_type == 'timestamp':
+        return timestamp_literal_template.format(timestamp_literal_value(d))
+    return str(timestamp_value(d, timestamp_type))
+
+
+def build_timestamp_bounds(lower: Optional[datetime], upper: Optional[datetime], timestamp_type: str,
+                           timestamp_column: str = '`timestamp`',
+                           timestamp_literal_template: str = TIMESTAMP_LITERAL_TEMPLATE) -> str:
+    """
+    Builds a filter for the timestamp between lower and upper (both included).
+
+    Args:
+        lower: The lower bound or `None`.
+        upper: The upper bound or `None`.
+        timestamp_type: The type of the timestamp column, one of TIMESTAMP_TYPES.
+        timestamp_column: The quoted timestamp column.
+        timestamp_literal_template: The template of a TIMESTAMP literal, "{0}" is replaced by the value in UTC.
+
+    Returns:
+        The timestamp filter clause.
 
     Raises:
-        ValueError: If start date or end date is not in UTC or if start date is after end date.
+        ValueError: If the timestamp type is unknown.
+    """
+    if upper is None:
+        return "{0} >= {1}".format(timestamp_column,
+                                   build_timestamp_literal(lower, timestamp_type, timestamp_literal_template))
+    if lower is None:
+        return "{0} <= {1}".format(timestamp_column,
+                                   build_timestamp_literal(upper, timestamp_type, timestamp_literal_template))
+    return "{0} BETWEEN {1} AND {2}".format(timestamp_column,
+                                            build_timestamp_literal(lower, timestamp_type, timestamp_literal_template),
+                                            build_timestamp_literal(upper, timestamp_type, timestamp_literal_template))
+
+
+def build_sub_hour_segment_filter(time_range: Optional[TimeRangeContainer], start: datetime, end: datetime,
+                                  timestamp_type: str, render_segment: Callable[[TimeRangeContainer], str],
+                                  render_bounds: Callable[[Optional[datetime], Optional[datetime], str], str]) \
+        -> Optional[str]:
+    """
+    Builds the partition filter of a segment with timestamp bounds for the hour of the start date and the hour of the
+    end date (see `split_boundary_hours`).
+
+    Args:
+        time_range: The TimeRangeContainer of the segment.
+        start: The start date in UTC.
+        end: The end date in UTC.
+        timestamp_type: The type of the timestamp column, one of TIMESTAMP_TYPES.
+        render_segment: Renders the partition filter of a part of the segment, in parentheses.
+        render_bounds: Renders the timestamp bounds (lower, upper, timestamp_type), see `build_timestamp_bounds`.
 
     Returns:
-        The partition query string.
+        The partition filter as a string or `None` if the time_range was `None`.
+    """
+    if time_range is None:
+        return None
+    filters = []
+    for part, lower, upper in split_boundary_hours(time_range, start, end, timestamp_type):
+        partition_filter = render_segment(part)
+        if lower is not None or upper is not None:
+            partition_filter = "{0} AND {1})".format(partition_filter[:-1], render_bounds(lower, upper, timestamp_type))
+        filters.append(partition_filter)
+    return " OR ".join(filters)
+
+
+def convert_dt_to_utc(d: datetime) -> datetime:
+    """Convert a datetime object to a datetime with timezone set to timezone.utc.
+
+    If the datetime object is a naive object (no tzinfo set) it will be interpreted as being in UTC.
+    For example "2020-11-25 17:00:00" will be interpreted as this time in UTC.
+    "2020-11-25T17:00:00+01:00" will be interpreted as "2020-11-25 16:00:00+00:00 UTC".
+
+    Args:
+        d: The datetime to convert to utc.
+
+    Returns:
+        The datetime with tzinfo set to timezone.utc.
+    """
+    if d.tzinfo is None:
+        return d.replace(tzinfo=timezone.utc)
+    else:
+        return d.astimezone(timezone.utc)
+
+
+def validate_time_range(start: datetime, end: datetime):
+    """
+    Checks that start and end are in UTC and that start is not after end.
+
+    Args:
+        start: The start date.
+        end: The end date.
+
+    Raises:
+        ValueError: If start date or end date is not in UTC or if start date is after end date.
     """
     if start.tzinfo != timezone.utc:
         raise ValueError("Start date has to be in UTC. Instead we have %s" % str(start.tzinfo))
@@ -29,15 +229,66 @@ def generate_timerange_query(start: datetime, end: datetime, generate_timestamp_
     if start > end:
         raise ValueError("Start date has to be before the end date. You have start:%s \tend:%s" % (start, end))
 
+
+def generate_timerange_query(start: datetime, end: datetime, generate_timestamp_clause: bool = True,
+                             timestamp_type: str = 's', sub_hour_precision: bool = False) -> str:
+    """
+    Generates the timerange query for partitioning that suits both hive and impala queries.
+
+    Args:
+        start: The start date in UTC.
+        end: The end date in UTC.
+        generate_timestamp_clause: If True append a timestamp BETWEEN clause to the query (with the corresponding
+            start and end timestamps).
+        timestamp_type: The type of the timestamp column, one of TIMESTAMP_TYPES.
+        sub_hour_precision: If True restrict the partitions of the start and the end hour with timestamp bounds (see
+            PartitionQueryBuilder.build_partition_filter).
+
+    Raises:
+        ValueError: If start date or end date is not in UTC, if start date is after end date or if the timestamp type
+            is unknown.
+
+    Returns:
+        The partition query string.
+    """
+    validate_time_range(start, end)
+
     partition_query_builder = PartitionQueryBuilder(start_date=start, end_date=end)
-    partition_filter = partition_query_builder.build_partition_filter()
+    partition_filter = partition_query_builder.build_partition_filter(sub_hour_precision, timestamp_type)
     if generate_timestamp_clause:
-        time_filter = partition_query_builder.build_timestamp_filter()
+        time_filter = partition_query_builder.build_timestamp_filter(timestamp_type)
         return "{0} AND {1}".format(time_filter, partition_filter)
     else:
         return partition_filter
 
 
+def generate_timerange_query_with_matcher(start: datetime, end: datetime, generate_timestamp_clause: bool = True,
+                                          timestamp_type: str = 's', sub_hour_precision: bool = False) \
+        -> Tuple[str, PartitionMatcher]:
+    """
+    Generates the timerange query like `generate_timerange_query` together with a PartitionMatcher that decides for
+    single partitions (or partition paths) if they are covered by the query.
+
+    Args:
+        start: The start date in UTC.
+        end: The end date in UTC.
+        generate_timestamp_clause: If True append a timestamp BETWEEN clause to the query (with the corresponding
+            start and end timestamps).
+        timestamp_type: The type of the timestamp column, one of TIMESTAMP_TYPES.
+        sub_hour_precision: If True restrict the partitions of the start and the end hour with timestamp bounds. The
+            matcher still matches these partitions, only the rows read from them are restricted.
+
+    Raises:
+        ValueError: If start date or end date is not in UTC, if start date is after end date or if the timestamp type
+            is unknown.
+
+    Returns:
+        The partition query string and the matcher.
+    """
+    query = generate_timerange_query(start, end, generate_timestamp_clause, timestamp_type, sub_hour_precision)
+    return query, PartitionQueryBuilder(start_date=start, end_date=end).build_partition_matcher()
+
+
 class PartitionQueryBuilder(object):
     """
     Generates the partition string for the given start and end dates.
@@ -197,7 +448,7 @@ class PartitionQueryBuilder(object):
         last_day_of_year = datetime(year=self.start_date.year, month=12, day=31, hour=23, minute=59, second=59,
                                     tzinfo=timezone.utc)
 
-        if last_day_of_year > self.end_date:
+        if self.start_date.year == self.end_date.year:
             date_for_diff = self.end_date
             add_compare_month = False
         else:
@@ -307,22 +558,56 @@ class PartitionQueryBuilder(object):
 
         return "({0})".format(" AND ".join(filter_clauses))
 
-    def build_partition_filter(self) -> str:
+    # the segments of the partition filter in the order in which they appear in it
+    SEGMENTS = ('start_date_hours', 'start_date_month_days', 'start_date_year_months', 'gap_years',
+                'end_date_year_months', 'end_date_month_days', 'end_date_hours')
+
+    _SEGMENT_METHODS = {
+        'start_date_hours': _get_relevant_hours_of_start_date,
+        'start_date_month_days': _get_relevant_days_in_start_date_month,
+        'start_date_year_months': _get_relevant_months_in_start_date_year,
+        'gap_years': _get_gap_years,
+        'end_date_year_months': _get_relevant_months_in_end_date_year,
+        'end_date_month_days': _get_relevant_days_in_end_date_month,
+        'end_date_hours': _get_relevant_hours_of_end_date,
+    }
+
+    def build_segment(self, segment: str) -> Optional[TimeRangeContainer]:
         """
-        Builds the complete partition filter.
+        Calculates a single segment of the partition filter.
+
+        Args:
+            segment: The name of the segment, one of SEGMENTS.
+
+        Returns:
+            The TimeRangeContainer of the segment or `None` if the segment is empty for the time range.
+        """
+        return self._SEGMENT_METHODS[segment](self)
+
+    def build_segment_filter(self, segment: str) -> Optional[str]:
+        """
+        Builds the partition filter of a single segment.
+
+        Args:
+            segment: The name of the segment, one of SEGMENTS.
+
+        Returns:
+            The partition filter of the segment or `None` if the segment is empty for the time range.
+        """
+        return self._build_partition_filter_for_timerange(self.build_segment(segment))
+
+    @staticmethod
+    def join_partition_filters(partition_filters: Iterable[Optional[str]]) -> str:
+        """
+        Joins the partition filters of the segments to the complete partition filter.
+
+        Args:
+            partition_filters: The partition filters of the segments in the order of SEGMENTS, `None` for empty
+                segments.
 
         Returns:
             The complete partition filter clause for the query.
         """
-        partition_filters = [
-            self._build_partition_filter_for_timerange(self._get_relevant_hours_of_start_date()),
-            self._build_partition_filter_for_timerange(self._get_relevant_days_in_start_date_month()),
-            self._build_partition_filter_for_timerange(self._get_relevant_months_in_start_date_year()),
-            self._build_partition_filter_for_timerange(self._get_gap_years()),
-            self._build_partition_filter_for_timerange(self._get_relevant_months_in_end_date_year()),
-            self._build_partition_filter_for_timerange(self._get_relevant_days_in_end_date_month()),
-            self._build_partition_filter_for_timerange(self._get_relevant_hours_of_end_date())
-        ]
         # filter out `None` values
         partition_filters = filter(lambda x: x is not None, partition_filters)
 
@@ -332,14 +617,49 @@ class PartitionQueryBuilder(object):
 
         return "({0})".format(" OR ".join(partition_filters_deduplicated))
 
-    def build_timestamp_filter(self) -> str:
+    def build_partition_filter(self, sub_hour_precision: bool = False, timestamp_type: str = 's') -> str:
+        """
+        Builds the complete partition filter.
+
+        Args:
+            sub_hour_precision: If True the partitions of the start date hour and the end date hour are restricted to
+                the time range with a timestamp bound, e.g. `(... AND `hour` = 10 AND `timestamp` >= 1606230900)`, if
+                the time range does not cover them completely.
+            timestamp_type: The type of the timestamp column for the bounds, one of TIMESTAMP_TYPES.
+
+        Returns:
+            The complete partition filter clause for the query.
+        """
+        if sub_hour_precision:
+            return self.join_partition_filters(
+                build_sub_hour_segment_filter(self.build_segment(segment), self.start_date, self.end_date,
+                                              timestamp_type, self._build_partition_filter_for_timerange,
+                                              build_timestamp_bounds)
+                for segment in self.SEGMENTS)
+        return self.join_partition_filters(self.build_segment_filter(segment) for segment in self.SEGMENTS)
+
+    def build_partition_matcher(self) -> PartitionMatcher:
+        """
+        Builds a matcher for the partitions covered by the partition filter.
+
+        Returns:
+            The PartitionMatcher for the time range.
+        """
+        return PartitionMatcher(self.start_date, self.end_date)
+
+    def build_timestamp_filter(self, timestamp_type: str = 's') -> str:
         """
         Builds the timestamp filter.
 
+        Args:
+            timestamp_type: The type of the timestamp column, one of TIMESTAMP_TYPES. For integer timestamps the
+                values are in the unit of the column, for native TIMESTAMP columns they are TIMESTAMP values in UTC.
+                Either way the filter can be pushed down to the min / max statistics of the files as it is.
+
         Returns:
             The timestamp filter clause for the query.
-        """
-        start_date_timestamp = int(self.start_date.timestamp())
-        end_date_timestamp = int(self.end_date.timestamp())
 
-        return "`timestamp` BETWEEN {0} AND {1}".format(start_date_timestamp, end_date_timestamp)
+        Raises:
+            ValueError: If the timestamp type is unknown.
+        """
+        return build_timestamp_bounds(self.start_date, self.end_date, timestamp_type)
@@ -0,0 +1,157 @@
+from datetime import datetime, timedelta
+from typing import Hashable, List, Optional, Tuple
+
+from app.query_utils.hive_impala_query_builder import PartitionQueryBuilder, validate_time_range
+
+# a partition as (year, month, day, hour)
+Partition = Tuple[int, int, int, int]
+
+_HOUR = timedelta(hours=1)
+
+
+def _segment_keys(start: datetime, end: datetime) -> Tuple[Hashable, ...]:
+    """
+    Calculates for every segment (in the order of PartitionQueryBuilder.SEGMENTS) a key of the parts of start and end
+    the segment depends on. If the key of a segment did not change, the segment did not change.
+
+    The segments on the start side only depend on the start date (down to the hour for the hours, the day for the
+    days and the month for the months) as long as the end date is not in the same day, month or year, the segments on
+    the end side vice versa.
+    """
+    same_year = start.year == end.year
+    same_month = same_year and start.month == end.month
+    same_day = same_month and start.day == end.day
+    return (
+        (start.year, start.month, start.day, start.hour, same_day),
+        (start.year, start.month, start.day, end.day if same_month else None),
+        (start.year, start.month, end.month if same_year else None),
+        (start.year, end.year),
+        (end.year, end.month, start.month if same_year else None),
+        (end.year, end.month, end.day, start.day if same_month else None),
+        (end.year, end.month, end.day, end.hour, start.hour if same_day else None),
+    )
+
+
+def _truncate_to_hour(d: datetime) -> datetime:
+    return d.replace(minute=0, second=0, microsecond=0)
+
+
+def _hours(first: datetime, last: datetime) -> List[Partition]:
+    """All partitions from the hour first to the hour last (both included), empty if last < first."""
+    partitions = []
+    while first <= last:
+        partitions.append((first.year, first.month, first.day, first.hour))
+        first += _HOUR
+    return partitions
+
+
+class PartitionFilterSegmentation(object):
+    """
+    The partition filter of a time range, split into its segments (see PartitionQueryBuilder.SEGMENTS).
+
+    Instances are created and updated with `extend_segmentation`.
+
+    Attributes:
+        start_date: The start date in UTC.
+        end_date: The end date in UTC.
+        segment_filters: The partition filter of every segment, `None` for empty segments.
+    """
+
+    def __init__(self, start_date: datetime, end_date: datetime, segment_keys: Tuple[Hashable, ...],
+                 segment_filters: Tuple[Optional[str], ...]):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.segment_filters = segment_filters
+        self._segment_keys = segment_keys
+
+    @property
+    def partition_filter(self) -> str:
+        """The complete partition filter, identical to the one of PartitionQueryBuilder."""
+        return PartitionQueryBuilder.join_partition_filters(self.segment_filters)
+
+    def query(self, generate_timestamp_clause: bool = True, timestamp_type: str = 's') -> str:
+        """
+        The query for the time range, identical to the one of `generate_timerange_query`.
+
+        Args:
+            generate_timestamp_clause: If True prepend the timestamp BETWEEN clause.
+            timestamp_type: The type of the timestamp column, one of TIMESTAMP_TYPES.
+
+        Returns:
+            The partition query string.
+        """
+        if generate_timestamp_clause:
+            time_filter = PartitionQueryBuilder(self.start_date, self.end_date).build_timestamp_filter(timestamp_type)
+            return "{0} AND {1}".format(time_filter, self.partition_filter)
+        return self.partition_filter
+
+
+class PartitionDelta(object):
+    """
+    The partitions a time range covers in addition to and no longer compared to the previous time range.
+
+    Attributes:
+        added: The partitions that are covered now but were not before, ordered by time.
+        removed: The partitions that were covered before but are not now, ordered by time.
+        changed_segments: The names of the segments whose partition filter was recalculated.
+    """
+
+    def __init__(self, added: List[Partition], removed: List[Partition], changed_segments: List[str]):
+        self.added = added
+        self.removed = removed
+        self.changed_segments = changed_segments
+
+
+def _partition_delta(previous: Optional[PartitionFilterSegmentation], start: datetime, end: datetime) \
+        -> Tuple[List[Partition], List[Partition]]:
+    first = _truncate_to_hour(start)
+    last = _truncate_to_hour(end)
+    if previous is None:
+        return _hours(first, last), []
+    previous_first = _truncate_to_hour(previous.start_date)
+    previous_last = _truncate_to_hour(previous.end_date)
+    # the covered hours before the other first hour and after the other last hour
+    added = (_hours(first, min(last, previous_first - _HOUR))
+             + _hours(max(first, previous_last + _HOUR), last))
+    removed = (_hours(previous_first, min(previous_last, first - _HOUR))
+               + _hours(max(previous_first, last + _HOUR), previous_last))
+    return added, removed
+
+
+def extend_segmentation(previous: Optional[PartitionFilterSegmentation], start: datetime, end: datetime) \
+        -> Tuple[PartitionFilterSegmentation, PartitionDelta]:
+    """
+    Calculates the segmentation of the partition filter for a new time range, recalculating only the segments that
+    changed compared to the previous time range.
+
+    This is meant for consumers of sliding windows: moving the window by an hour only changes the hour segments (and
+    the day or month segments when crossing a day or month boundary), so the cost of a step is proportional to the
+    change and not to the length of the window. The partition delta is calculated from the hours that were added and
+    removed at both ends of the range.
+
+    Args:
+        previous: The segmentation of the previous time range or `None` to calculate all segments.
+        start: The start date in UTC.
+        end: The end date in UTC.
+
+    Raises:
+        ValueError: If start date or end date is not in UTC or if start date is after end date.
+
+    Returns:
+        The segmentation of the new time range and the partition delta to the previous one (if previous is `None`
+        all partitions of the range are added).
+    """
+    validate_time_range(start, end)
+    segment_keys = _segment_keys(start, end)
+    builder = PartitionQueryBuilder(start_date=start, end_date=end)
+    segment_filters = []
+    changed_segments = []
+    for index, segment in enumerate(PartitionQueryBuilder.SEGMENTS):
+        if previous is not None and previous._segment_keys[index] == segment_keys[index]:
+            segment_filters.append(previous.segment_filters[index])
+        else:
+            segment_filters.append(builder.build_segment_filter(segment))
+            changed_segments.append(segment)
+    added, removed = _partition_delta(previous, start, end)
+    return (PartitionFilterSegmentation(start, end, segment_keys, tuple(segment_filters)),
+            PartitionDelta(added, removed, changed_segments))
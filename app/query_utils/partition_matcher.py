@@ -0,0 +1,80 @@
+import re
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+# the partition directories have to be complete path segments, e.g. not fiscal_year=2017 or year=2017_old
+_PARTITION_PATH_PATTERN = re.compile(r'(?:^|/)year=(\d+)(?:/month=(\d+)(?:/day=(\d+)(?:/hour=(\d+))?)?)?(?=/|$)')
+
+
+def partition_key(year, month, day, hour):
+    """Encode a partition as an integer that is ordered like the partitions, e.g. 2017051322 for 2017-05-13 hour 22.
+
+    Only arithmetic is used, so the arguments can also be numpy arrays or pandas series of the same length.
+    """
+    return year * 1000000 + month * 10000 + day * 100 + hour
+
+
+class PartitionMatcher(object):
+    """
+    Decides if a partition is covered by the partition filter of a time range without parsing any SQL.
+
+    The partition filter always covers all hours from the hour of the start date to the hour of the end date, so
+    matching a partition is comparing its key (see `partition_key`) with the keys of the first and the last hour.
+
+    Attributes:
+        first_key: The key of the first covered partition (the hour of the start date).
+        last_key: The key of the last covered partition (the hour of the end date).
+    """
+
+    def __init__(self, start_date: datetime, end_date: datetime):
+        """
+        Args:
+            start_date: The start date in UTC.
+            end_date: The end date in UTC.
+        """
+        self.first_key = partition_key(start_date.year, start_date.month, start_date.day, start_date.hour)
+        self.last_key = partition_key(end_date.year, end_date.month, end_date.day, end_date.hour)
+
+    def matches(self, year: int, month: int, day: int, hour: int) -> bool:
+        """Check if the partition of the given hour is covered."""
+        return self.first_key <= partition_key(year, month, day, hour) <= self.last_key
+
+    def overlaps(self, year: int, month: Optional[int] = None, day: Optional[int] = None) -> bool:
+        """Check if at least one hour of the given year, month or day is covered.
+
+        This is used to prune whole directories (e.g. "year=2017/month=5") while walking the partition tree.
+        """
+        first = partition_key(year, month or 1, day or 1, 0)
+        last = partition_key(year, month or 12, day or 31, 23)
+        return first <= self.last_key and last >= self.first_key
+
+    def matches_path(self, path: str) -> bool:
+        """Check if a partition directory (or a file in it) is covered.
+
+        The path has to contain Hive style partition directories, e.g. "/data/table/year=2017/month=05/day=13/hour=22"
+        or "s3://bucket/table/year=2017/month=5/day=13/hour=22/part-0000.parquet". For paths that stop above the
+        hour level (e.g. ".../year=2017/month=5") it checks if at least one hour below the path is covered.
+
+        Raises:
+            ValueError: If the path does not contain a year partition.
+        """
+        match = _PARTITION_PATH_PATTERN.search(path)
+        if match is None:
+            raise ValueError('"{0}" is not a partition path'.format(path))
+        year, month, day, hour = (None if g is None else int(g) for g in match.groups())
+        if hour is None:
+            return self.overlaps(year, month, day)
+        return self.matches(year, month, day, hour)
+
+    def filter_paths(self, paths: Iterable[str]) -> List[str]:
+        """Return the paths of a (large) directory listing that are covered, see `matches_path`."""
+        return [path for path in paths if self.matches_path(path)]
+
+    def matches_columns(self, years, months, days, hours):
+        """Vectorized form of `matches` for numpy arrays or pandas series of the partition columns.
+
+        Returns:
+            A boolean array (or series) that is True for the covered partitions.
+        """
+        keys = partition_key(years, months, days, hours)
+        return (keys >= self.first_key) & (keys <= self.last_key)
@@ -0,0 +1,152 @@
+import asyncio
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from fastapi.logger import logger
+
+from app.query_utils.hive_impala_query_builder import PartitionQueryBuilder, build_timestamp_bounds
+
+# the windows that are pre-rendered if the environment variable ROLLING_WINDOWS is not set
+DEFAULT_ROLLING_WINDOWS: str = '1h,6h,12h,24h,2d,7d,30d'
+
+_WINDOW_PATTERN = re.compile(r'^\s*(\d+)\s*([hd])\s*$')
+_WINDOW_UNITS: Dict[str, timedelta] = {'h': timedelta(hours=1), 'd': timedelta(days=1)}
+
+
+def parse_window(window: str) -> timedelta:
+    """Parse a rolling window string like "24h" or "7d" to a timedelta.
+
+    Only hours and days are supported: the partition part of a window that is a multiple of whole hours only changes
+    on the hour boundary, which is what makes pre-rendering possible.
+
+    Args:
+        window: The window string, a positive number followed by "h" (hours) or "d" (days).
+
+    Returns:
+        The length of the window.
+
+    Raises:
+        ValueError: If the window string is not valid.
+    """
+    match = _WINDOW_PATTERN.match(window)
+    if match is None or int(match.group(1)) == 0:
+        raise ValueError('Invalid window "%s", expected a positive number followed by "h" or "d"' % window)
+    return int(match.group(1)) * _WINDOW_UNITS[match.group(2)]
+
+
+def _truncate_to_hour(d: datetime) -> datetime:
+    return d.replace(minute=0, second=0, microsecond=0)
+
+
+class RollingWindowCache(object):
+    """
+    Holds pre-rendered partition filters for a set of rolling windows ("now minus N hours/days").
+
+    The partition filter of a window only depends on the hour of "now", so it is rendered once per hour by
+    `refresh` and requests are served with a dictionary lookup. The rendered filters are stored together with the
+    hour they were rendered for in a single tuple that is replaced as a whole on refresh, readers therefore never see
+    a partially refreshed state.
+
+    Attributes:
+        windows: Mapping of the configured window strings to their length.
+    """
+
+    def __init__(self, windows: List[str]):
+        """
+        Args:
+            windows: The window strings to pre-render, see `parse_window` for the format.
+
+        Raises:
+            ValueError: If one of the windows is not valid.
+        """
+        self.windows: Dict[str, timedelta] = {window.strip(): parse_window(window) for window in windows}
+        self._snapshot: Tuple[Optional[datetime], Dict[str, str]] = (None, {})
+
+    @classmethod
+    def from_env(cls) -> 'RollingWindowCache':
+        """Create a cache for the comma separated windows in the environment variable ROLLING_WINDOWS.
+
+        Returns:
+            The cache, not yet refreshed.
+        """
+        windows = os.environ.get('ROLLING_WINDOWS', DEFAULT_ROLLING_WINDOWS)
+        return cls([w for w in windows.split(',') if w.strip()])
+
+    @staticmethod
+    def _render(length: timedelta, hour: datetime) -> str:
+        """Render the partition filter of a window of the given length for a "now" within the given hour.
+
+        Args:
+            length: The length of the window.
+            hour: The current hour in UTC (truncated to the hour).
+
+        Returns:
+            The partition filter.
+        """
+        end = hour + timedelta(minutes=59, seconds=59)
+        return PartitionQueryBuilder(start_date=hour - length, end_date=end).build_partition_filter()
+
+    def refresh(self, now: Optional[datetime] = None):
+        """Render all windows for the hour of now and swap them in.
+
+        Args:
+            now: The current time in UTC, defaults to the current system time.
+        """
+        if now is None:
+            now = datetime.now(timezone.utc)
+        hour = _truncate_to_hour(now)
+        filters = {window: self._render(length, hour) for window, length in self.windows.items()}
+        self._snapshot = (hour, filters)
+
+    def get(self, window: str, generate_timestamp_clause: bool, now: Optional[datetime] = None,
+            timestamp_type: str = 's') -> str:
+        """Get the query for a rolling window ending now.
+
+        If the cache has not been refreshed for the current hour yet (for example directly after the hour boundary
+        before the background task ran, or if the task does not run at all) the partition filter is rendered on the
+        fly and stored, so that only the first request of the window in the hour renders it. The partition filters do
+        not depend on the timestamp type, only the timestamp clause does, which is rendered per request anyway.
+
+        Args:
+            window: The window string, must be one of the configured windows.
+            generate_timestamp_clause: If True prepend a timestamp BETWEEN clause for the exact window.
+            now: The current time in UTC, defaults to the current system time.
+            timestamp_type: The type of the timestamp column, one of TIMESTAMP_TYPES.
+
+        Returns:
+            The query string.
+
+        Raises:
+            KeyError: If the window is not one of the configured windows.
+            ValueError: If the timestamp type is unknown.
+        """
+        if now is None:
+            now = datetime.now(timezone.utc)
+        length = self.windows[window]
+        current_hour = _truncate_to_hour(now)
+        hour, filters = self._snapshot
+        partition_filter = filters.get(window) if hour == current_hour else None
+        if partition_filter is None:
+            partition_filter = self._render(length, current_hour)
+            # replace the snapshot as a whole, unless it is for a later hour already
+            if hour == current_hour:
+                self._snapshot = (hour, dict(filters, **{window: partition_filter}))
+            elif hour is None or hour < current_hour:
+                self._snapshot = (current_hour, {window: partition_filter})
+        if not generate_timestamp_clause:
+            return partition_filter
+        return "{0} AND {1}".format(build_timestamp_bounds(now - length, now, timestamp_type), partition_filter)
+
+    async def run_refresh_loop(self):
+        """Refresh the cache now and then on every hour boundary, until cancelled."""
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('Refreshing the rolling window cache failed')
+            now = datetime.now(timezone.utc)
+            next_hour = _truncate_to_hour(now) + timedelta(hours=1)
+            await asyncio.sleep((next_hour - now).total_seconds())
+
@@ -0,0 +1,176 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Optional
+
+# magic | slot count | slot size
+_FILE_HEADER = struct.Struct('<8sII')
+_FILE_HEADER_SIZE = 64
+_MAGIC = b'PQCACHE1'
+# sequence | key hash | key length | value length | last used (monotonic ns)
+_SLOT_HEADER = struct.Struct('<IIHIQ')
+_SEQUENCE = struct.Struct('<I')
+_LAST_USED = struct.Struct('<Q')
+_LAST_USED_OFFSET = 14
+
+# number of slots a key can be stored in
+WAYS = 4
+
+# the time in seconds after a failed attach before the file is looked for again
+ATTACH_RETRY_SECONDS = 1.0
+
+
+def _now_ns() -> int:
+    return time.monotonic_ns()
+
+
+class SharedQueryCache(object):
+    """
+    A cache for generated queries that is shared by all processes on a host.
+
+    The cache is a hash table in a memory mapped file (put it on a tmpfs like /dev/shm) with a fixed number of slots
+    of a fixed size. A key can be stored in one of WAYS neighbouring slots, if all of them are in use the least
+    recently used one is replaced. Entries that do not fit into a slot are not cached.
+
+    Reads do not take any lock: every slot has a sequence number that is odd while the slot is written and increased
+    after every write, a reader discards what it read if the sequence number changed in the meantime. Writes are
+    serialized with a file lock.
+
+    The file is created once with `create` (in the gunicorn master, see docker/gunicorn_extra_conf.py), processes
+    attach to it on first use. As long as the file does not exist every lookup is a miss and nothing is stored, the file
+is looked for again at most every ATTACH_RETRY_SECONDS seconds (e.g. under uvicorn without the gunicorn hook).
+
+    Attributes:
+        path: The path of the cache file.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: The path of the cache file.
+        """
+        self.path = path
+        self._map: Optional[mmap.mmap] = None
+        self._fd: Optional[int] = None
+        self._slot_count = 0
+        self._slot_size = 0
+        self._write_lock = threading.Lock()
+        self._next_attach = 0.0
+
+    @classmethod
+    def from_env(cls) -> Optional['SharedQueryCache']:
+        """Create the cache for the path in the environment variable SHARED_CACHE_PATH.
+
+        Returns:
+            The cache or None if the environment variable is not set.
+        """
+        path = os.environ.get('SHARED_CACHE_PATH')
+        return cls(path) if path else None
+
+    @staticmethod
+    def create(path: str, slot_count: int = 16384, slot_size: int = 1024):
+        """Create (or reset) the cache file.
+
+        Args:
+            path: The path of the cache file.
+            slot_count: The number of slots, rounded up to a multiple of WAYS.
+            slot_size: The size of a slot in bytes, it holds the slot header, the key and the value.
+        """
+        slot_count = -(-slot_count // WAYS) * WAYS
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.truncate(_FILE_HEADER_SIZE + slot_count * slot_size)
+            f.write(_FILE_HEADER.pack(_MAGIC, slot_count, slot_size))
+        # processes that already attached to an old file keep using it, new ones see the complete new file
+        os.replace(tmp_path, path)
+
+    def _attach(self) -> bool:
+        if self._map is not None:
+            return True
+        if time.monotonic() < self._next_attach:
+            return False
+        with self._write_lock:
+            if self._map is not None:
+                return True
+            try:
+                fd = os.open(self.path, os.O_RDWR)
+            except FileNotFoundError:
+                self._next_attach = time.monotonic() + ATTACH_RETRY_SECONDS
+                return False
+            mapped = mmap.mmap(fd, 0)
+            magic, self._slot_count, self._slot_size = _FILE_HEADER.unpack_from(mapped, 0)
+            if magic != _MAGIC:
+                mapped.close()
+                os.close(fd)
+                raise ValueError('"{0}" is not a shared query cache file'.format(self.path))
+            self._fd = fd
+            self._map = mapped
+            return True
+
+    def _slot_offsets(self, key_hash: int):
+        first = (key_hash % (self._slot_count // WAYS)) * WAYS
+        return [_FILE_HEADER_SIZE + (first + way) * self._slot_size for way in range(WAYS)]
+
+    def get(self, key: bytes) -> Optional[str]:
+        """Get the value stored for key.
+
+        Returns:
+            The value or None if the key is not in the cache.
+        """
+        if not self._attach():
+            return None
+        mapped = self._map
+        key_hash = zlib.crc32(key)
+        for offset in self._slot_offsets(key_hash):
+            sequence, slot_hash, key_length, value_length, _ = _SLOT_HEADER.unpack_from(mapped, offset)
+            if sequence & 1 or slot_hash != key_hash or key_length != len(key):
+                continue
+            data_offset = offset + _SLOT_HEADER.size
+            data = mapped[data_offset:data_offset + key_length + value_length]
+            if _SEQUENCE.unpack_from(mapped, offset)[0] != sequence:
+                # the slot has been written while reading it
+                return None
+            if data[:key_length] != key:
+                continue
+            _LAST_USED.pack_into(mapped, offset + _LAST_USED_OFFSET, _now_ns())
+            return data[key_length:].decode('utf-8')
+        return None
+
+    def put(self, key: bytes, value: str):
+        """Store value for key, replacing the least recently used entry of its slots if they are all in use."""
+        if not self._attach():
+            return
+        data = value.encode('utf-8')
+        if _SLOT_HEADER.size + len(key) + len(data) > self._slot_size:
+            return
+        mapped = self._map
+        key_hash = zlib.crc32(key)
+        with self._write_lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                target = None
+                oldest = None
+                for offset in self._slot_offsets(key_hash):
+                    _, slot_hash, key_length, _, last_used = _SLOT_HEADER.unpack_from(mapped, offset)
+                    data_offset = offset + _SLOT_HEADER.size
+                    if key_length == 0 or (slot_hash == key_hash and key_length == len(key)
+                                           and mapped[data_offset:data_offset + key_length] == key):
+                        target = offset
+                        break
+                    if oldest is None or last_used < oldest[1]:
+                        oldest = (offset, last_used)
+                if target is None:
+                    target = oldest[0]
+                # odd while writing, even if a writer was killed while writing the slot
+                writing = _SEQUENCE.unpack_from(mapped, target)[0] | 1
+                _SEQUENCE.pack_into(mapped, target, writing)
+                data_offset = target + _SLOT_HEADER.size
+                mapped[data_offset:data_offset + len(key) + len(data)] = key + data
+                _SLOT_HEADER.pack_into(mapped, target, writing, key_hash, len(key), len(data), _now_ns())
+                _SEQUENCE.pack_into(mapped, target, (writing + 1) & 0xFFFFFFFF)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
@@ -0,0 +1,208 @@
+from datetime import datetime
+from itertools import product
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.query_utils.hive_impala_query_builder import TIMESTAMP_LITERAL_TEMPLATE, PartitionQueryBuilder, \
+    build_sub_hour_segment_filter, build_timestamp_bounds, timestamp_literal_value, validate_time_range
+from app.query_utils.time_range_container import TimeRangeContainer
+
+# the partition columns in the order in which they appear in a segment
+PARTITION_COLUMNS = ('year', 'month', 'day', 'hour')
+TIMESTAMP_COLUMN = 'timestamp'
+
+
+class SqlDialect(object):
+    """
+    Renders the segments of a partition filter (see PartitionQueryBuilder.SEGMENTS) and the timestamp clause in the
+    SQL dialect of a query engine.
+
+    The templates for all shapes a segment can have (which columns it filters and whether it filters a single value
+    or a range of a column) are compiled when the dialect is created, rendering a segment only formats its values
+    into the template of its shape.
+
+    Attributes:
+        name: The name of the dialect.
+        identifier_quote: The character used to quote identifiers.
+        timestamp_literal_template: The template of a TIMESTAMP literal, "{0}" is replaced by the value in UTC.
+    """
+
+    def __init__(self, name: str, identifier_quote: str, timestamp_literal_template: str = "TIMESTAMP '{0}'"):
+        """
+        Args:
+            name: The name of the dialect.
+            identifier_quote: The character used to quote identifiers.
+            timestamp_literal_template: The template of a TIMESTAMP literal, "{0}" is replaced by the value in UTC.
+        """
+        self.name = name
+        self.identifier_quote = identifier_quote
+        self.timestamp_literal_template = timestamp_literal_template
+        # shape (tuple with one bool per filtered column, True for ranges) -> template
+        self._segment_templates: Dict[tuple, str] = {}
+        for column_count in range(1, len(PARTITION_COLUMNS) + 1):
+            for shape in product((False, True), repeat=column_count):
+                self._segment_templates[shape] = self._compile_segment_template(shape)
+        self._timestamp_column = self.quote_identifier(TIMESTAMP_COLUMN)
+
+    def quote_identifier(self, identifier: str) -> str:
+        """Quote an identifier, quote characters in it are doubled."""
+        quote = self.identifier_quote
+        return quote + identifier.replace(quote, quote + quote) + quote
+
+    def format_literal(self, value: int) -> str:
+        """Format an integer literal."""
+        return str(value)
+
+    def format_timestamp_literal(self, d: datetime) -> str:
+        """Format a TIMESTAMP literal for a datetime in UTC."""
+        return self.timestamp_literal_template.format(timestamp_literal_value(d))
+
+    def _render_timestamp_bounds(self, lower: Optional[datetime], upper: Optional[datetime],
+                                 timestamp_type: str) -> str:
+        return build_timestamp_bounds(lower, upper, timestamp_type, self._timestamp_column,
+                                      self.timestamp_literal_template)
+
+    def _compile_segment_template(self, shape: Sequence[bool]) -> str:
+        clauses = []
+        for column, is_range in zip(PARTITION_COLUMNS, shape):
+            if is_range:
+                clauses.append('{0} BETWEEN {{}} AND {{}}'.format(self.quote_identifier(column)))
+            else:
+                clauses.append('{0} = {{}}'.format(self.quote_identifier(column)))
+        return '({0})'.format(' AND '.join(clauses))
+
+    def render_segment(self, time_range: Optional[TimeRangeContainer]) -> Optional[str]:
+        """
+        Renders the partition filter of a segment.
+
+        Args:
+            time_range: The TimeRangeContainer of the segment, the values of every column are consecutive.
+
+        Returns:
+            The partition filter of the segment or `None` if time_range is `None`.
+        """
+        if time_range is None:
+            return None
+        shape = []
+        values = []
+        for column_values in (time_range.years, time_range.months, time_range.days, time_range.hours):
+            if not column_values:
+                break
+            if len(column_values) == 1:
+                shape.append(False)
+                values.append(self.format_literal(column_values[0]))
+            else:
+                shape.append(True)
+                values.append(self.format_literal(column_values[0]))
+                values.append(self.format_literal(column_values[-1]))
+        return self._segment_templates[tuple(shape)].format(*values)
+
+    def render_partition_filter(self, segments: Iterable[Optional[TimeRangeContainer]],
+                                sub_hour_bounds: Optional[Tuple[datetime, datetime]] = None,
+                                timestamp_type: str = 's') -> str:
+        """
+        Renders the complete partition filter.
+
+        Args:
+            segments: The segments in the order of PartitionQueryBuilder.SEGMENTS, `None` for empty segments.
+            sub_hour_bounds: The start and end date of the time range to restrict the partitions of the start date
+                hour and the end date hour with timestamp bounds (see PartitionQueryBuilder.build_partition_filter) or
+                `None` to render the partitions only.
+            timestamp_type: The type of the timestamp column for the bounds, one of TIMESTAMP_TYPES.
+
+        Returns:
+            The complete partition filter clause for the query.
+        """
+        if sub_hour_bounds is not None:
+            start, end = sub_hour_bounds
+            return PartitionQueryBuilder.join_partition_filters(
+                build_sub_hour_segment_filter(segment, start, end, timestamp_type, self.render_segment,
+                                              self._render_timestamp_bounds)
+                for segment in segments)
+        return PartitionQueryBuilder.join_partition_filters(self.render_segment(segment) for segment in segments)
+
+    def render_timestamp_filter(self, start: datetime, end: datetime, timestamp_type: str = 's') -> str:
+        """
+        Renders the timestamp filter.
+
+        Args:
+            start: The start date in UTC.
+            end: The end date in UTC.
+            timestamp_type: The type of the timestamp column, one of TIMESTAMP_TYPES.
+
+        Returns:
+            The timestamp filter clause for the query.
+
+        Raises:
+            ValueError: If the timestamp type is unknown.
+        """
+        return self._render_timestamp_bounds(start, end, timestamp_type)
+
+    def render_query(self, segments: Sequence[Optional[TimeRangeContainer]], start: datetime, end: datetime,
+                     generate_timestamp_clause: bool = True, timestamp_type: str = 's',
+                     sub_hour_precision: bool = False) -> str:
+        """
+        Renders the query for a time range.
+
+        Args:
+            segments: The segments of the time range in the order of PartitionQueryBuilder.SEGMENTS.
+            start: The start date in UTC.
+            end: The end date in UTC.
+            generate_timestamp_clause: If True prepend the timestamp BETWEEN clause.
+            timestamp_type: The type of the timestamp column, one of TIMESTAMP_TYPES.
+            sub_hour_precision: If True restrict the partitions of the start and the end hour with timestamp bounds.
+
+        Returns:
+            The partition query string.
+        """
+        partition_filter = self.render_partition_filter(segments, (start, end) if sub_hour_precision else None,
+                                                        timestamp_type)
+        if generate_timestamp_clause:
+            return "{0} AND {1}".format(self.render_timestamp_filter(start, end, timestamp_type), partition_filter)
+        return partition_filter
+
+
+# TIMESTAMP literals are in UTC without a time zone, Spark interprets them in the session time zone
+# (spark.sql.session.timeZone), which therefore has to be UTC
+DIALECTS: Dict[str, SqlDialect] = {
+    'impala': SqlDialect('impala', identifier_quote='`', timestamp_literal_template=TIMESTAMP_LITERAL_TEMPLATE),
+    'hive': SqlDialect('hive', identifier_quote='`', timestamp_literal_template=TIMESTAMP_LITERAL_TEMPLATE),
+    'spark': SqlDialect('spark', identifier_quote='`'),
+    'trino': SqlDialect('trino', identifier_quote='"'),
+    'bigquery': SqlDialect('bigquery', identifier_quote='`'),
+}
+
+
+def generate_timerange_queries(start: datetime, end: datetime, dialects: Sequence[str],
+                               generate_timestamp_clause: bool = True, timestamp_type: str = 's',
+                               sub_hour_precision: bool = False) -> Dict[str, str]:
+    """
+    Generates the timerange query for several SQL dialects. The segments of the partition filter are calculated once
+    and rendered for every dialect.
+
+    Args:
+        start: The start date in UTC.
+        end: The end date in UTC.
+        dialects: The names of the dialects, keys of DIALECTS.
+        generate_timestamp_clause: If True append a timestamp BETWEEN clause to the query (with the corresponding
+            start and end timestamps).
+        timestamp_type: The type of the timestamp column, one of TIMESTAMP_TYPES.
+        sub_hour_precision: If True restrict the partitions of the start and the end hour with timestamp bounds (see
+            PartitionQueryBuilder.build_partition_filter).
+
+    Raises:
+        ValueError: If start date or end date is not in UTC, if start date is after end date or if a dialect or the
+            timestamp type is unknown.
+
+    Returns:
+        The partition query string per dialect.
+    """
+    validate_time_range(start, end)
+    unknown: List[str] = [dialect for dialect in dialects if dialect not in DIALECTS]
+    if unknown:
+        raise ValueError('Unknown dialect(s) {0}, supported are: {1}'.format(', '.join(unknown),
+                                                                            ', '.join(DIALECTS)))
+    builder = PartitionQueryBuilder(start_date=start, end_date=end)
+    segments = [builder.build_segment(segment) for segment in PartitionQueryBuilder.SEGMENTS]
+    return {dialect: DIALECTS[dialect].render_query(segments, start, end, generate_timestamp_clause, timestamp_type,
+                                                    sub_hour_precision)
+            for dialect in dialects}
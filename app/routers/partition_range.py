@@ -1,63 +1,253 @@
-from datetime import datetime, timezone
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Callable, Dict, Hashable, List, Optional
 
-from fastapi import APIRouter, Query, HTTPException
+from fastapi import APIRouter, Query, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import ORJSONResponse
+from prometheus_client import Counter, Histogram
 
-from ..models.partition_range_models import QueryStringResponse
-from ..query_utils.hive_impala_query_builder import generate_timerange_query
+from ..models.partition_range_models import CostEstimateResponse, MultiDialectQueryResponse, QueryStringResponse, \
+    SegmentCostEstimate
+from ..profiler import stage
+from ..query_utils.admission_control import AdmissionController
+from ..query_utils.cost_estimation import PartitionStatistics, estimate_cost
+from ..query_utils.hive_impala_query_builder import TIMESTAMP_TYPES, convert_dt_to_utc, generate_timerange_query
+from ..query_utils.rolling_window_cache import RollingWindowCache
+from ..query_utils.shared_query_cache import SharedQueryCache
+from ..query_utils.sql_dialects import DIALECTS, generate_timerange_queries
 
 router = APIRouter()
 
+# pre-rendered partition filters for the rolling windows, refreshed by a background task started in main
+rolling_window_cache = RollingWindowCache.from_env()
 
-def _convert_dt_to_utc(d: datetime) -> datetime:
-    """Convert a datetime object to a datetime with timezone set to timezone.utc.
+# queries shared by all workers on the host, only used if SHARED_CACHE_PATH is set
+shared_query_cache = SharedQueryCache.from_env()
 
-    If the datetime object is a naive object (no tzinfo set) it will be interpreted as being in UTC.
-    For example "2020-11-25 17:00:00" will be interpreted as this time in UTC.
-    "2020-11-25T17:00:00+01:00" will be interpreted as "2020-11-25 16:00:00+00:00 UTC".
+
+@lru_cache(maxsize=None)
+def load_partition_statistics() -> Optional[PartitionStatistics]:
+    """The size of the partitions for the cost estimation, if PARTITION_STATS_PATH is set.
+
+    The file is loaded once, on the startup of the app (see main), not by the estimates on the event loop. With
+    PRELOAD_APP the gunicorn master loads it before forking the workers, which then share it (see
+    docker/gunicorn_extra_conf.py).
+
+    Raises:
+        OSError: If the file can not be read.
+        ValueError: If the file is not valid, see PartitionStatistics.load.
+    """
+    return PartitionStatistics.from_env()
+
+
+# token buckets per client limiting the work of the query endpoints, only used if ADMISSION_RATE is set
+admission_controller = AdmissionController.from_env()
+
+# the header identifying the client for the admission control, only used for requests from the trusted proxies
+CLIENT_ID_HEADER = 'X-Client-Id'
+
+PARTITION_QUERY_COMPUTATIONS = Counter('partition_query_computations_total',
+                                       'Number of partition queries computed for the impala / hive endpoints')
+PARTITION_QUERY_COALESCED = Counter('partition_query_coalesced_total',
+                                    'Number of impala / hive requests that were served by the computation of an '
+                                    'identical concurrent request')
+ADMISSION_DECISIONS = Counter('admission_control_decisions_total',
+                              'Number of requests admitted immediately, admitted after queueing or rejected by the '
+                              'admission control', ['decision'])
+ADMISSION_COST = Counter('admission_control_cost_tokens_total',
+                         'Tokens of the requests admitted or rejected by the admission control', ['decision'])
+ADMISSION_QUEUE_DURATION = Histogram('admission_control_queue_seconds',
+                                     'Time the queued requests waited for tokens of the admission control')
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls with the same key onto one computation.
+
+    A computation on the event loop can not overlap with another one, so identical calls can only be coalesced if the
+    computation runs in the thread pool. The thread pool hop costs more than most computations though, so a call
+    computes inline, unless its key is hot: computed less than window seconds ago, as during a refresh storm of
+    identical requests. The first call for a hot key runs the function in the thread pool as a task of its own, all
+    calls for the same key that arrive until it finished wait for its result instead of computing it again. Every
+    caller, the first one included, waits shielded, so a cancelled request (e.g. a client that disconnected) neither
+    cancels the computation nor the other requests waiting for it.
+
+    Attributes:
+        window: The time in seconds after a computation during which its key is hot.
+        max_keys: The maximum number of keys whose last computation is remembered, the least recent are dropped.
+    """
+
+    def __init__(self, window: float = 0.1, max_keys: int = 1024, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            window: The time in seconds after a computation during which its key is hot.
+            max_keys: The maximum number of keys whose last computation is remembered, the least recent are dropped.
+            clock: The clock in seconds, for tests.
+        """
+        self.window = window
+        self.max_keys = max_keys
+        self._clock = clock
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self._computed: 'OrderedDict[Hashable, float]' = OrderedDict()
+
+    async def do(self, key: Hashable, function: Callable[..., Any], *args) -> Any:
+        """Call function(*args), or wait for the result of a running call with the same key.
+
+        Args:
+            key: The key identifying identical calls.
+            function: The (blocking) function to call.
+            *args: The arguments for function.
+
+        Returns:
+            The result of the function.
+
+        Raises:
+            Exception: Whatever the function raised, for every coalesced call.
+        """
+        loop = asyncio.get_event_loop()
+        # tasks belong to a loop, only calls on the same loop can wait for each other
+        key = (loop, key)
+        task = self._in_flight.get(key)
+        if task is not None:
+            PARTITION_QUERY_COALESCED.inc()
+            return await asyncio.shield(task)
+        PARTITION_QUERY_COMPUTATIONS.inc()
+        computed = self._computed.get(key)
+        if computed is None or self._clock() - computed > self.window:
+            try:
+                return function(*args)
+            finally:
+                self._record(key)
+        task = asyncio.ensure_future(run_in_threadpool(function, *args))
+        self._in_flight[key] = task
+        task.add_done_callback(lambda done: self._done(key, done))
+        return await asyncio.shield(task)
+
+    def _record(self, key: Hashable):
+        """Remember the time of the last computation of a key."""
+        self._computed[key] = self._clock()
+        self._computed.move_to_end(key)
+        if len(self._computed) > self.max_keys:
+            self._computed.popitem(last=False)
+
+    def _done(self, key: Hashable, task: asyncio.Future):
+        """Remove a finished computation, so that the key is computed again by the next call."""
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        self._record(key)
+        # mark the exception as retrieved, all callers might have been cancelled
+        if not task.cancelled():
+            task.exception()
+
+
+single_flight = SingleFlight()
+
+
+async def _admit(request: Request, start: datetime, end: datetime, batch_size: int = 1):
+    """Reserve the cost of a request in the token bucket of its client, see AdmissionController.
+
+    Does nothing if the admission control is disabled. A request that has to wait at most the configured maximum
+    queue time for its tokens is delayed, otherwise it is rejected.
 
     Args:
-        d: The datetime to convert to utc.
+        request: The request, the client is identified by its address or, behind a trusted proxy, by the header
+            CLIENT_ID_HEADER.
+        start: The start date of the time range in UTC.
+        end: The end date of the time range in UTC.
+        batch_size: The number of results the request asks for.
 
-    Returns:
-        The datetime with tzinfo set to timezone.utc.
+    Raises:
+        HTTPException: With status code 429 and a Retry-After header if the client exceeded its rate.
     """
-    if d.tzinfo is None:
-        return d.replace(tzinfo=timezone.utc)
-    else:
-        return d.astimezone(timezone.utc)
+    if admission_controller is None:
+        return
+    with stage('admission'):
+        client = admission_controller.client(request.client.host if request.client else '',
+                                             request.headers.get(CLIENT_ID_HEADER))
+        cost = admission_controller.cost(start, end, batch_size)
+        admitted, wait = admission_controller.reserve(client, cost)
+        if not admitted:
+            ADMISSION_DECISIONS.labels(decision='rejected').inc()
+            ADMISSION_COST.labels(decision='rejected').inc(cost)
+            raise HTTPException(429, detail='rate limit exceeded, the request costs {0:.1f} tokens'.format(cost),
+                                headers={'Retry-After': admission_controller.retry_after(wait)})
+        ADMISSION_COST.labels(decision='admitted').inc(cost)
+        if wait > 0:
+            ADMISSION_DECISIONS.labels(decision='queued').inc()
+            ADMISSION_QUEUE_DURATION.observe(wait)
+            await asyncio.sleep(wait)
+        else:
+            ADMISSION_DECISIONS.labels(decision='admitted').inc()
 
 
-def _process_impala_hive_partition_query(start: datetime, end: datetime, generate_timestamp_clause: bool)\
-        -> QueryStringResponse:
+def _generate_and_share_timerange_query(cache_key: bytes, start: datetime, end: datetime,
+                                        generate_timestamp_clause: bool, timestamp_type: str,
+                                        sub_hour_precision: bool) -> str:
+    """Call generate_timerange_query and store the result in the shared query cache."""
+    query = generate_timerange_query(start, end, generate_timestamp_clause, timestamp_type, sub_hour_precision)
+    shared_query_cache.put(cache_key, query)
+    return query
+
+
+async def _process_impala_hive_partition_query(request: Request, start: datetime, end: datetime,
+                                              generate_timestamp_clause: bool, timestamp_type: str = 's',
+                                              sub_hour_precision: bool = False) -> QueryStringResponse:
     """Process a call to the impala / hive endpoint.
 
     This function will call the function generate_timerange_query to generate the query string. It further checks if
-    end >= start, if not it will raise a HTTPException with status code 422.
+    end >= start, if not it will raise a HTTPException with status code 422, and admits the request (see _admit).
+    Concurrent identical requests are coalesced onto one call of generate_timerange_query and the result is stored in
+    the shared query cache, if one is configured.
 
     It will response with an instance of QueryStringResponse.
 
     Args:
+        request: The request, for the admission control.
         start: Start time of the generated time query.
         end: End time of the generated time query.
         generate_timestamp_clause: If true also generate a timestamp IN-clause for the given start and end.
+        timestamp_type: The type of the timestamp column, one of TIMESTAMP_TYPES.
+        sub_hour_precision: If true restrict the partitions of the start and the end hour with timestamp bounds.
 
     Returns:
         The QueryStringResponse containing the query partition range for the given start and end.
 
     Raises:
-        HTTPException: With status code 422 if end < start.
+        HTTPException: With status code 422 if end < start, with status code 429 if the client exceeded its rate.
     """
     # make sure to convert all to UTC
-    start = _convert_dt_to_utc(start)
-    end = _convert_dt_to_utc(end)
+    with stage('convert'):
+        start = convert_dt_to_utc(start)
+        end = convert_dt_to_utc(end)
     if end < start:
         raise HTTPException(422, detail='end date can not be before start date')
-    return QueryStringResponse(query=generate_timerange_query(start, end, generate_timestamp_clause))
+    await _admit(request, start, end)
+    if shared_query_cache is None:
+        with stage('generate'):
+            query = await single_flight.do((start, end, generate_timestamp_clause, timestamp_type, sub_hour_precision),
+                                           generate_timerange_query, start, end, generate_timestamp_clause,
+                                           timestamp_type, sub_hour_precision)
+        return QueryStringResponse(query=query)
+    cache_key = '{0}/{1}/{2:d}/{3}/{4:d}'.format(start.isoformat(), end.isoformat(), generate_timestamp_clause,
+                                                 timestamp_type, sub_hour_precision).encode()
+    with stage('shared_cache'):
+        query = shared_query_cache.get(cache_key)
+    if query is None:
+        with stage('generate'):
+            query = await single_flight.do((start, end, generate_timestamp_clause, timestamp_type, sub_hour_precision),
+                                           _generate_and_share_timerange_query,
+                                           cache_key, start, end, generate_timestamp_clause, timestamp_type,
+                                           sub_hour_precision)
+    return QueryStringResponse(query=query)
 
 
 @router.get('/impala', response_model=QueryStringResponse, response_class=ORJSONResponse)
 async def impala_partition_query(
+        request: Request,
         start: datetime = Query(...,
                                 title='start',
                                 description='The start date of the time range.'),
@@ -70,12 +260,25 @@ async def impala_partition_query(
                                                             'but also a timestamp clause based on the start and end '
                                                             'date. If False every part after hour (minute, '
                                                             'seconds) will not be covered by the partition (partitions '
-                                                            'are based on hours).')):
-    return _process_impala_hive_partition_query(start, end, generate_timestamp_clause)
+                                                            'are based on hours).'),
+        timestamp_type: str = Query('s',
+                                    regex='^({0})$'.format('|'.join(TIMESTAMP_TYPES)),
+                                    title='Timestamp Type',
+                                    description='The type of the timestamp column: an integer timestamp in seconds '
+                                                '(s), milliseconds (ms), microseconds (us) or nanoseconds (ns) since '
+                                                'the epoch or a native TIMESTAMP (timestamp).'),
+        sub_hour_precision: bool = Query(False,
+                                         title='Sub-hour Precision',
+                                         description='If true restrict the partitions of the start and the end hour '
+                                                     'with a timestamp bound, so that only the part of them in the '
+                                                     'time range is read.')):
+    return await _process_impala_hive_partition_query(request, start, end, generate_timestamp_clause, timestamp_type,
+                                                      sub_hour_precision)
 
 
 @router.get('/hive', response_model=QueryStringResponse, response_class=ORJSONResponse)
 async def hive_partition_query(
+        request: Request,
         start: datetime = Query(...,
                                 title='start',
                                 description='The start date of the time range.'),
@@ -88,5 +291,146 @@ async def hive_partition_query(
                                                             'but also a timestamp clause based on the start and end '
                                                             'date. If False every part after hour (minute, '
                                                             'seconds) will not be covered by the partition (partitions '
-                                                            'are based on hours).')):
-    return _process_impala_hive_partition_query(start, end, generate_timestamp_clause)
+                                                            'are based on hours).'),
+        timestamp_type: str = Query('s',
+                                    regex='^({0})$'.format('|'.join(TIMESTAMP_TYPES)),
+                                    title='Timestamp Type',
+                                    description='The type of the timestamp column: an integer timestamp in seconds '
+                                                '(s), milliseconds (ms), microseconds (us) or nanoseconds (ns) since '
+                                                'the epoch or a native TIMESTAMP (timestamp).'),
+        sub_hour_precision: bool = Query(False,
+                                         title='Sub-hour Precision',
+                                         description='If true restrict the partitions of the start and the end hour '
+                                                     'with a timestamp bound, so that only the part of them in the '
+                                                     'time range is read.')):
+    return await _process_impala_hive_partition_query(request, start, end, generate_timestamp_clause, timestamp_type,
+                                                      sub_hour_precision)
+
+
+@router.get('/query', response_model=MultiDialectQueryResponse, response_class=ORJSONResponse)
+async def multi_dialect_partition_query(
+        request: Request,
+        start: datetime = Query(...,
+                                title='start',
+                                description='The start date of the time range.'),
+        end: datetime = Query(...,
+                              title='end',
+                              description='The end date of the time range.'),
+        dialect: List[str] = Query(['impala'],
+                                   title='Dialect',
+                                   description='The SQL dialects to generate the query for, one or more of: '
+                                               '{0}. The partitions are calculated once for all dialects.'
+                                               .format(', '.join(DIALECTS))),
+        generate_timestamp_clause: bool = Query(False,
+                                                title='Timestamp Clause',
+                                                description='If true not only create the partition range in the query '
+                                                            'but also a timestamp clause based on the start and end '
+                                                            'date.'),
+        timestamp_type: str = Query('s',
+                                    regex='^({0})$'.format('|'.join(TIMESTAMP_TYPES)),
+                                    title='Timestamp Type',
+                                    description='The type of the timestamp column: an integer timestamp in seconds '
+                                                '(s), milliseconds (ms), microseconds (us) or nanoseconds (ns) since '
+                                                'the epoch or a native TIMESTAMP (timestamp).'),
+        sub_hour_precision: bool = Query(False,
+                                         title='Sub-hour Precision',
+                                         description='If true restrict the partitions of the start and the end hour '
+                                                     'with a timestamp bound, so that only the part of them in the '
+                                                     'time range is read.')):
+    start = convert_dt_to_utc(start)
+    end = convert_dt_to_utc(end)
+    if end < start:
+        raise HTTPException(422, detail='end date can not be before start date')
+    unknown = [name for name in dialect if name not in DIALECTS]
+    if unknown:
+        raise HTTPException(422, detail='dialect must be one of: {0}'.format(', '.join(DIALECTS)))
+    dialects = list(dict.fromkeys(dialect))
+    await _admit(request, start, end, len(dialects))
+    with stage('generate'):
+        queries = generate_timerange_queries(start, end, dialects, generate_timestamp_clause, timestamp_type,
+                                             sub_hour_precision)
+    return MultiDialectQueryResponse(queries=queries)
+
+
+@router.get('/estimate', response_model=CostEstimateResponse, response_class=ORJSONResponse)
+async def estimate_partition_query_cost(
+        start: datetime = Query(...,
+                                title='start',
+                                description='The start date of the time range.'),
+        end: datetime = Query(...,
+                              title='end',
+                              description='The end date of the time range.')):
+    """Estimate how many partitions, bytes and files a query for the time range reads."""
+    start = convert_dt_to_utc(start)
+    end = convert_dt_to_utc(end)
+    if end < start:
+        raise HTTPException(422, detail='end date can not be before start date')
+    partition_statistics = load_partition_statistics()
+    segments = estimate_cost(start, end, partition_statistics)
+    response = CostEstimateResponse(partitions=sum(segment.partitions for segment in segments),
+                                    segments=[SegmentCostEstimate.from_orm(segment) for segment in segments])
+    if partition_statistics is not None:
+        response.partitions_with_statistics = sum(segment.partitions_with_statistics for segment in segments)
+        response.estimated_bytes = sum(segment.estimated_bytes for segment in segments)
+        response.estimated_files = sum(segment.estimated_files for segment in segments)
+    return response
+
+
+def _process_rolling_window_query(window: str, generate_timestamp_clause: bool, timestamp_type: str = 's') \
+        -> QueryStringResponse:
+    """Process a call to the rolling impala / hive endpoint.
+
+    Args:
+        window: The rolling window, for example "24h" or "7d".
+        generate_timestamp_clause: If true also generate a timestamp BETWEEN-clause for the window.
+        timestamp_type: The type of the timestamp column, one of TIMESTAMP_TYPES.
+
+    Returns:
+        The QueryStringResponse containing the query partition range for the window ending now.
+
+    Raises:
+        HTTPException: With status code 422 if the window is not one of the configured rolling windows.
+    """
+    try:
+        query = rolling_window_cache.get(window, generate_timestamp_clause, timestamp_type=timestamp_type)
+    except KeyError:
+        raise HTTPException(422, detail='window must be one of: {0}'.format(', '.join(rolling_window_cache.windows)))
+    return QueryStringResponse(query=query)
+
+
+@router.get('/impala/rolling', response_model=QueryStringResponse, response_class=ORJSONResponse)
+async def impala_rolling_partition_query(
+        window: str = Query(...,
+                            title='window',
+                            description='The rolling window ending now, for example 24h or 7d. Must be one of the '
+                                        'configured windows.'),
+        generate_timestamp_clause: bool = Query(False,
+                                                title='Timestamp Clause',
+                                                description='If true not only create the partition range in the query '
+                                                            'but also a timestamp clause for the exact window.'),
+        timestamp_type: str = Query('s',
+                                    regex='^({0})$'.format('|'.join(TIMESTAMP_TYPES)),
+                                    title='Timestamp Type',
+                                    description='The type of the timestamp column: an integer timestamp in seconds '
+                                                '(s), milliseconds (ms), microseconds (us) or nanoseconds (ns) since '
+                                                'the epoch or a native TIMESTAMP (timestamp).')):
+    return _process_rolling_window_query(window, generate_timestamp_clause, timestamp_type)
+
+
+@router.get('/hive/rolling', response_model=QueryStringResponse, response_class=ORJSONResponse)
+async def hive_rolling_partition_query(
+        window: str = Query(...,
+                            title='window',
+                            description='The rolling window ending now, for example 24h or 7d. Must be one of the '
+                                        'configured windows.'),
+        generate_timestamp_clause: bool = Query(False,
+                                                title='Timestamp Clause',
+                                                description='If true not only create the partition range in the query '
+                                                            'but also a timestamp clause for the exact window.'),
+        timestamp_type: str = Query('s',
+                                    regex='^({0})$'.format('|'.join(TIMESTAMP_TYPES)),
+                                    title='Timestamp Type',
+                                    description='The type of the timestamp column: an integer timestamp in seconds '
+                                                '(s), milliseconds (ms), microseconds (us) or nanoseconds (ns) since '
+                                                'the epoch or a native TIMESTAMP (timestamp).')):
+    return _process_rolling_window_query(window, generate_timestamp_clause, timestamp_type)
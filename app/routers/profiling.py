@@ -0,0 +1,48 @@
+import asyncio
+import threading
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import ORJSONResponse, PlainTextResponse
+
+from ..profiler import SamplingProfiler
+
+router = APIRouter()
+
+# only one profile can run at a time in a worker
+_profile_lock = threading.Lock()
+
+
+# This endpoint is only added if the environment variable ENABLE_PROFILING is true, see main
+@router.get('/profile')
+async def profile(
+        duration: float = Query(10.0,
+                                gt=0,
+                                le=300,
+                                title='Duration',
+                                description='The duration of the profile in seconds.'),
+        interval_ms: float = Query(5.0,
+                                   ge=1,
+                                   le=1000,
+                                   title='Interval',
+                                   description='The sampling interval in milliseconds.'),
+        output_format: str = Query('collapsed',
+                                   alias='format',
+                                   regex='^(collapsed|speedscope)$',
+                                   title='Format',
+                                   description='"collapsed" for the collapsed stack format (flame graph tools) or '
+                                               '"speedscope" for the speedscope JSON format.')):
+    """Profile the worker that handles this request by sampling its stacks for the given duration."""
+    if not _profile_lock.acquire(blocking=False):
+        raise HTTPException(409, detail='a profile is already running in this worker')
+    try:
+        profiler = SamplingProfiler(interval=interval_ms / 1000)
+        profiler.start()
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            profiler.stop()
+    finally:
+        _profile_lock.release()
+    if output_format == 'speedscope':
+        return ORJSONResponse(profiler.speedscope())
+    return PlainTextResponse(profiler.collapsed())
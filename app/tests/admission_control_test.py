@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from ..query_utils.admission_control import AdmissionController
+from ..routers import partition_range
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _sample(name: str, labels=None) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_cost():
+    controller = AdmissionController(rate=1, capacity=100)
+    start = datetime(year=2020, month=1, day=1, tzinfo=timezone.utc)
+    assert controller.cost(start, start) == 1
+    assert controller.cost(start, start + timedelta(days=365)) == 2
+    assert controller.cost(start, start + timedelta(days=365 * 10), batch_size=3) == 33
+    # the cost is capped at the capacity
+    assert controller.cost(start, start + timedelta(days=365 * 1000)) == 100
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    controller = AdmissionController(rate=2, capacity=4, clock=clock)
+    assert [controller.reserve('a', 1) for _ in range(4)] == [(True, 0.0)] * 4
+    admitted, wait = controller.reserve('a', 1)
+    assert not admitted and wait == 0.5
+    # other clients have their own bucket
+    assert controller.reserve('b', 4) == (True, 0.0)
+
+    clock.now = 1.0
+    assert controller.reserve('a', 2) == (True, 0.0)
+    assert not controller.reserve('a', 1)[0]
+    # the bucket does not fill up beyond its capacity
+    clock.now = 100.0
+    assert controller.reserve('a', 4) == (True, 0.0)
+    assert not controller.reserve('a', 1)[0]
+
+
+def test_queueing():
+    clock = FakeClock()
+    controller = AdmissionController(rate=10, capacity=1, max_wait=0.25, clock=clock)
+    assert controller.reserve('a', 1) == (True, 0.0)
+    # the requests are queued in the order of their reservations
+    assert controller.reserve('a', 1) == (True, pytest.approx(0.1))
+    assert controller.reserve('a', 1) == (True, pytest.approx(0.2))
+    admitted, wait = controller.reserve('a', 1)
+    assert not admitted and wait == pytest.approx(0.05)
+    # the debt of 2 tokens is refilled after 0.2 seconds
+    clock.now = 0.3
+    assert controller.reserve('a', 1) == (True, 0.0)
+    assert controller.reserve('a', 1) == (True, pytest.approx(0.1))
+
+
+def test_max_clients():
+    clock = FakeClock()
+    controller = AdmissionController(rate=1, capacity=1, max_clients=2, clock=clock)
+    assert controller.reserve('a', 1)[0]
+    assert controller.reserve('b', 1)[0]
+    assert not controller.reserve('a', 1)[0]
+    # c drops the bucket of the least recently used client b
+    assert controller.reserve('c', 1)[0]
+    assert not controller.reserve('a', 1)[0]
+    assert controller.reserve('b', 1)[0]
+
+
+def test_invalid_configuration():
+    with pytest.raises(ValueError):
+        AdmissionController(rate=0)
+    with pytest.raises(ValueError):
+        AdmissionController(rate=1, max_wait=-1)
+
+
+def test_admission_control_endpoints(testing_client: TestClient, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(partition_range, 'admission_controller',
+                        AdmissionController(rate=1, capacity=5, hours_per_token=24 * 365,
+                                            trusted_proxies=['testclient'], clock=clock))
+    parameters = {'start': '2000-01-01T00:00:00', 'end': '2001-12-31T00:00:00'}
+    headers = {partition_range.CLIENT_ID_HEADER: 'test-client'}
+    rejected_before = _sample('admission_control_decisions_total', {'decision': 'rejected'})
+    admitted_before = _sample('admission_control_decisions_total', {'decision': 'admitted'})
+
+    # two years cost 3 tokens, one request fits into the bucket
+    assert testing_client.get('/impala', params=parameters, headers=headers).status_code == 200
+    response = testing_client.get('/hive', params=parameters, headers=headers)
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
+    # short ranges are still admitted
+    response = testing_client.get('/hive', params=dict(parameters, end='2000-01-01T05:00:00'), headers=headers)
+    assert response.status_code == 200
+    # every dialect is one result of the batch
+    response = testing_client.get('/query', params=dict(parameters, end='2000-01-01T05:00:00',
+                                                        dialect=['impala', 'hive']), headers=headers)
+    assert response.status_code == 429
+    # other clients are not affected
+    assert testing_client.get('/impala', params=parameters,
+                              headers={partition_range.CLIENT_ID_HEADER: 'other-client'}).status_code == 200
+
+    assert _sample('admission_control_decisions_total', {'decision': 'rejected'}) == rejected_before + 2
+    assert _sample('admission_control_decisions_total', {'decision': 'admitted'}) == admitted_before + 3
+
+    clock.now = 10.0
+    assert testing_client.get('/hive', params=parameters, headers=headers).status_code == 200
+
+
+def test_client_id_from_trusted_proxies_only(testing_client: TestClient, monkeypatch):
+    controller = AdmissionController(rate=1, capacity=5, trusted_proxies=['10.0.0.1'])
+    assert controller.client('10.0.0.1', 'a') == 'a'
+    assert controller.client('10.0.0.1') == '10.0.0.1'
+    assert controller.client('10.0.0.2', 'a') == '10.0.0.2'
+
+    # the test client is not a trusted proxy, new client identifiers do not escape the limit
+    monkeypatch.setattr(partition_range, 'admission_controller', controller)
+    parameters = {'start': '2000-01-01T00:00:00', 'end': '2001-12-31T00:00:00'}
+    assert testing_client.get('/impala', params=parameters,
+                              headers={partition_range.CLIENT_ID_HEADER: 'a'}).status_code == 200
+    assert testing_client.get('/impala', params=parameters,
+                              headers={partition_range.CLIENT_ID_HEADER: 'b'}).status_code == 429
+
+
+def test_admission_control_queueing(testing_client: TestClient, monkeypatch):
+    monkeypatch.setattr(partition_range, 'admission_controller',
+                        AdmissionController(rate=100, capacity=1, max_wait=0.5))
+    parameters = {'start': '2000-01-01T00:00:00', 'end': '2000-01-01T05:00:00'}
+    headers = {partition_range.CLIENT_ID_HEADER: 'queueing-client'}
+    queued_before = _sample('admission_control_decisions_total', {'decision': 'queued'})
+    for _ in range(3):
+        assert testing_client.get('/impala', params=parameters, headers=headers).status_code == 200
+    assert _sample('admission_control_decisions_total', {'decision': 'queued'}) > queued_before
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import socket
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from .. import binary_protocol
+from ..binary_protocol import BinaryProtocolClient, BinaryProtocolError, REQUEST_FORMAT, encode_flags, start_server, \
+    unix_seconds
+from ..query_utils.hive_impala_query_builder import generate_timerange_query
+
+
+@pytest.fixture(scope='module')
+def server_address():
+    """Run the binary protocol server on a free TCP port and a Unix socket in a background thread.
+    """
+    loop = asyncio.new_event_loop()
+    socket_dir = tempfile.mkdtemp()
+    unix_socket = os.path.join(socket_dir, 'partitioning.sock')
+    tcp_server = loop.run_until_complete(start_server(host='127.0.0.1', port=0))
+    unix_server = loop.run_until_complete(start_server(unix_socket=unix_socket))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield tcp_server.sockets[0].getsockname()[:2], unix_socket
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    tcp_server.close()
+    unix_server.close()
+    loop.close()
+
+
+def test_binary_protocol_pipelined(server_address):
+    """Pipelined requests on one connection return the same queries as generate_timerange_query in order.
+    """
+    ranges = [
+        (datetime(year=2017, month=5, day=13, hour=15, tzinfo=timezone.utc),
+         datetime(year=2019, month=7, day=8, hour=12, tzinfo=timezone.utc), True),
+        (datetime(year=2017, month=5, day=13, hour=22, tzinfo=timezone.utc),
+         datetime(year=2017, month=5, day=14, hour=21, minute=59, second=59, tzinfo=timezone.utc), False),
+    ] * 50
+    expected = [generate_timerange_query(start, end, clause) for start, end, clause in ranges]
+    for address in server_address:
+        with BinaryProtocolClient(address) as client:
+            assert client.query_many(ranges) == expected
+            assert client.query(*ranges[0]) == expected[0]
+
+
+def test_binary_protocol_invalid_start_end(server_address):
+    start = datetime(year=2017, month=5, day=14, hour=23, tzinfo=timezone.utc)
+    end = datetime(year=2017, month=5, day=14, hour=22, tzinfo=timezone.utc)
+    with BinaryProtocolClient(server_address[0]) as client:
+        with pytest.raises(BinaryProtocolError, match='end date can not be before start date'):
+            client.query(start, end)
+        # the connection can still be used after an error
+        assert client.query(end, start, False) == generate_timerange_query(end, start, False)
+
+
+def test_naive_dates_are_utc(server_address, monkeypatch):
+    monkeypatch.setenv('TZ', 'Europe/Berlin')
+    time.tzset()
+    try:
+        with BinaryProtocolClient(server_address[0]) as client:
+            query = client.query(datetime(2020, 11, 24, 10), datetime(2020, 11, 24, 12), False)
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+    assert query == generate_timerange_query(datetime(2020, 11, 24, 10, tzinfo=timezone.utc),
+                                             datetime(2020, 11, 24, 12, tzinfo=timezone.utc), False)
+
+
+def test_unix_seconds_before_epoch():
+    assert unix_seconds(datetime(1969, 12, 31, 23, 59, 59, 500000, tzinfo=timezone.utc)) == -1
+    assert unix_seconds(datetime(1970, 1, 1, 0, 0, 0, 500000)) == 0
+
+
+def test_timestamp_type_and_sub_hour_precision(server_address):
+    start = datetime(year=2017, month=5, day=13, hour=15, minute=20, tzinfo=timezone.utc)
+    end = datetime(year=2017, month=5, day=14, hour=21, minute=40, second=10, tzinfo=timezone.utc)
+    with BinaryProtocolClient(server_address[0]) as client:
+        for timestamp_type in ('ms', 'timestamp'):
+            assert client.query(start, end, True, timestamp_type, sub_hour_precision=True) == \
+                generate_timerange_query(start, end, True, timestamp_type, sub_hour_precision=True)
+        with pytest.raises(ValueError):
+            client.query(start, end, True, 'minutes')
+    assert encode_flags(False) == 0
+
+
+def test_generation_does_not_block_the_event_loop(monkeypatch):
+    def slow_generate_timerange_query(*args):
+        time.sleep(0.3)
+        return 'query'
+
+    monkeypatch.setattr(binary_protocol, 'generate_timerange_query', slow_generate_timerange_query)
+
+    async def run():
+        server = await start_server(host='127.0.0.1', port=0)
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+        writer.write(REQUEST_FORMAT.pack(1, 0, 3600, 0))
+        response = asyncio.ensure_future(reader.read(1024))
+        # the event loop keeps running while the query is generated
+        started = time.perf_counter()
+        await asyncio.sleep(0.05)
+        ticked = time.perf_counter() - started
+        assert (await response).endswith(b'query')
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return ticked
+
+    assert asyncio.run(run()) < 0.2
+
+
+def test_client_connection_closed_mid_frame():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+
+    def respond_partially():
+        connection, _ = listener.accept()
+        connection.recv(REQUEST_FORMAT.size)
+        connection.sendall(b'\x00\x00')
+        connection.close()
+
+    thread = threading.Thread(target=respond_partially, daemon=True)
+    thread.start()
+    try:
+        with BinaryProtocolClient(listener.getsockname()) as client:
+            with pytest.raises(ConnectionError):
+                client.query(datetime(2020, 1, 1, tzinfo=timezone.utc), datetime(2020, 1, 2, tzinfo=timezone.utc))
+    finally:
+        thread.join()
+        listener.close()
@@ -0,0 +1,72 @@
+import io
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from .. import cli
+from ..query_utils.hive_impala_query_builder import generate_timerange_query
+
+RANGES_CSV = """id,from,to
+1,2020-11-24T15:00:00,2020-11-25T17:59:59
+2,2017-05-13T15:00:00+02:00,2019-07-08T12:00:00+02:00
+3,2020-01-02T00:00:00,2020-01-01T00:00:00
+4,yesterday,2020-01-01T00:00:00
+"""
+
+
+def _expected_query(start: datetime, end: datetime) -> str:
+    return generate_timerange_query(start, end, generate_timestamp_clause=True, timestamp_type='ms')
+
+
+def _check_rows(rows):
+    assert [row['id'] for row in rows] == ['1', '2', '3', '4']
+    assert rows[0]['query'] == _expected_query(datetime(2020, 11, 24, 15, tzinfo=timezone.utc),
+                                               datetime(2020, 11, 25, 17, 59, 59, tzinfo=timezone.utc))
+    assert rows[1]['query'] == _expected_query(datetime(2017, 5, 13, 13, tzinfo=timezone.utc),
+                                               datetime(2019, 7, 8, 10, tzinfo=timezone.utc))
+    assert rows[0]['error'] == rows[1]['error'] == ''
+    assert rows[2]['query'] == rows[3]['query'] == ''
+    assert 'before the end date' in rows[2]['error']
+    assert rows[3]['error']
+
+
+@pytest.mark.parametrize('processes', [0, 2])
+def test_generate(processes):
+    output = io.StringIO()
+    report = cli.generate(cli.read_csv(io.StringIO(RANGES_CSV)), cli.CsvWriter(output),
+                          cli.GenerationOptions(generate_timestamp_clause=True, timestamp_type='ms'),
+                          start_column='from', end_column='to', processes=processes, chunk_size=1)
+    assert (report.ranges, report.errors, report.processes) == (4, 2, processes)
+    output.seek(0)
+    _check_rows(list(cli.read_csv(output)))
+
+
+def test_main(tmp_path, capsys):
+    input_path = tmp_path / 'ranges.csv'
+    input_path.write_text(RANGES_CSV)
+    output_path = tmp_path / 'queries.ndjson'
+    cli.main([str(input_path), '--output', str(output_path), '--start-column', 'from', '--end-column', 'to',
+              '--timestamp-clause', '--timestamp-type', 'ms', '--chunk-size', '3'])
+    with open(str(output_path)) as f:
+        _check_rows([json.loads(line) for line in f])
+    assert '4 ranges (2 errors)' in capsys.readouterr().err
+
+    # a missing column is reported before the output is opened, the existing output file is kept
+    output = output_path.read_text()
+    with pytest.raises(SystemExit):
+        cli.main([str(input_path), '--output', str(output_path), '--end-column', 'to'])
+    assert "no column 'start'" in capsys.readouterr().err
+    assert output_path.read_text() == output
+
+
+def test_parquet(tmp_path, capsys):
+    pyarrow = pytest.importorskip('pyarrow')
+    import pyarrow.parquet
+    table = pyarrow.table({'start': [datetime(2020, 11, 24, 15, tzinfo=timezone.utc)],
+                           'end': [datetime(2020, 11, 25, 17, 59, 59, tzinfo=timezone.utc)]})
+    input_path = str(tmp_path / 'ranges.parquet')
+    pyarrow.parquet.write_table(table, input_path)
+    cli.main([input_path])
+    [row] = list(cli.read_csv(io.StringIO(capsys.readouterr().out)))
+    assert row['query'] == generate_timerange_query(table['start'][0].as_py(), table['end'][0].as_py(), False)
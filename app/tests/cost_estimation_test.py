@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+from .. import main
+from ..query_utils.cost_estimation import PartitionStatistics, estimate_cost
+from ..routers import partition_range
+from .differential_harness import random_ranges
+
+
+def _hours(start: datetime, end: datetime) -> int:
+    return (end.replace(minute=0, second=0, microsecond=0)
+            - start.replace(minute=0, second=0, microsecond=0)) // timedelta(hours=1) + 1
+
+
+def test_partition_count_matches_range():
+    for start, end in random_ranges(0, 2000):
+        assert sum(segment.partitions for segment in estimate_cost(start, end)) == _hours(start, end)
+
+
+def test_segments():
+    start = datetime(year=2019, month=12, day=31, hour=22, tzinfo=timezone.utc)
+    end = datetime(year=2024, month=3, day=2, hour=1, tzinfo=timezone.utc)
+    segments = estimate_cost(start, end)
+    assert [(segment.partition_filter, segment.partitions) for segment in segments] == [
+        ('(`year` = 2019 AND `month` = 12 AND `day` = 31 AND `hour` BETWEEN 22 AND 23)', 2),
+        # 2020 is a leap year
+        ('(`year` BETWEEN 2020 AND 2023)', 24 * (366 + 3 * 365)),
+        ('(`year` = 2024 AND `month` BETWEEN 1 AND 2)', 24 * (31 + 29)),
+        ('(`year` = 2024 AND `month` = 3 AND `day` = 1)', 24),
+        ('(`year` = 2024 AND `month` = 3 AND `day` = 2 AND `hour` BETWEEN 0 AND 1)', 2),
+    ]
+    assert all(segment.estimated_bytes is None for segment in segments)
+
+
+def _write_statistics(tmp_path) -> str:
+    path = str(tmp_path / 'partition_stats.csv')
+    with open(path, 'w') as f:
+        f.write('year,month,day,hour,bytes,files\n')
+        # 2020-01-01 hours 0 to 23 with 100 bytes and 2 files each, hour 5 is larger
+        for hour in range(24):
+            f.write('2020,1,1,{0},{1},2\n'.format(hour, 1000 if hour == 5 else 100))
+        f.write('2020,1,2,0,200,4\n')
+    return path
+
+
+def test_estimate_with_statistics(tmp_path):
+    statistics = PartitionStatistics.load(_write_statistics(tmp_path))
+    assert statistics.partition_count == 25
+    assert statistics.mean_bytes == 3500 / 25
+
+    start = datetime(year=2020, month=1, day=1, hour=4, tzinfo=timezone.utc)
+    end = datetime(year=2020, month=1, day=1, hour=6, minute=30, tzinfo=timezone.utc)
+    [segment] = estimate_cost(start, end, statistics)
+    assert (segment.partitions, segment.partitions_with_statistics, segment.estimated_bytes,
+            segment.estimated_files) == (3, 3, 1200, 6)
+
+    # the partitions of 2020-01-02 hour 1 to 2020-01-03 hour 0 have no statistics
+    end = datetime(year=2020, month=1, day=3, hour=0, tzinfo=timezone.utc)
+    segments = estimate_cost(start, end, statistics)
+    assert [segment.partitions for segment in segments] == [20, 24, 1]
+    assert [segment.partitions_with_statistics for segment in segments] == [20, 1, 0]
+    assert segments[0].estimated_bytes == 1000 + 19 * 100
+    assert segments[1].estimated_bytes == 200 + 23 * 140
+    assert segments[2].estimated_files == round(52 / 25)
+
+
+def test_duplicate_partitions():
+    statistics = PartitionStatistics([(2020, 1, 1, 0, 100, 1), (2020, 1, 1, 0, 50, 2), (2020, 1, 1, 1, 10, 1)])
+    assert statistics.partition_count == 2
+    assert statistics.sum_range(2020010100, 2020010123) == (2, 160, 4)
+    start = datetime(year=2020, month=1, day=1, hour=0, tzinfo=timezone.utc)
+    [segment] = estimate_cost(start, start, statistics)
+    assert (segment.partitions_with_statistics, segment.estimated_bytes, segment.estimated_files) == (1, 150, 3)
+
+
+def test_invalid_statistics(tmp_path):
+    path = tmp_path / 'partition_stats.csv'
+    path.write_text('year,month,day,hour,bytes\n2020,1,1,0,100\n')
+    with pytest.raises(ValueError, match='no column'):
+        PartitionStatistics.load(str(path))
+
+
+def test_estimate_endpoint(testing_client: TestClient, tmp_path, monkeypatch):
+    parameters = {'start': '2020-01-01T04:00:00', 'end': '2020-01-01T06:30:00'}
+    response = testing_client.get('/estimate', params=parameters)
+    assert response.status_code == 200
+    assert response.json() == {
+        'partitions': 3, 'partitions_with_statistics': None, 'estimated_bytes': None, 'estimated_files': None,
+        'segments': [{'partition_filter': '(`year` = 2020 AND `month` = 1 AND `day` = 1 AND `hour` BETWEEN 4 AND 6)',
+                      'partitions': 3, 'partitions_with_statistics': None, 'estimated_bytes': None,
+                      'estimated_files': None}]
+    }
+
+    statistics = PartitionStatistics.load(_write_statistics(tmp_path))
+    monkeypatch.setattr(partition_range, 'load_partition_statistics', lambda: statistics)
+    response = testing_client.get('/estimate', params=dict(parameters, end='2020-01-03T00:00:00'))
+    assert response.status_code == 200
+    estimate = response.json()
+    assert estimate['partitions'] == 45
+    assert estimate['partitions_with_statistics'] == 21
+    assert estimate['estimated_bytes'] == sum(segment['estimated_bytes'] for segment in estimate['segments'])
+
+    response = testing_client.get('/estimate', params=dict(parameters, end='2020-01-01T03:00:00'))
+    assert response.status_code == 422
+
+
+def test_startup_fails_on_missing_statistics(tmp_path, monkeypatch):
+    monkeypatch.setenv('PARTITION_STATS_PATH', str(tmp_path / 'missing.csv'))
+    partition_range.load_partition_statistics.cache_clear()
+    try:
+        with pytest.raises(FileNotFoundError):
+            with TestClient(main.app):
+                pass
+    finally:
+        monkeypatch.undo()
+        partition_range.load_partition_statistics.cache_clear()
@@ -0,0 +1,298 @@
+"""Differential test harness for partition query builders.
+
+Every generated range is checked in two ways:
+
+* coverage: the partition predicate produced by the candidate is evaluated into the hours it covers. Every term of the
+  predicate covers a contiguous interval of hours, so the check is done on intervals instead of single hours: the
+  terms must reference existing partitions only, be in chronological order, must not overlap or leave gaps and must
+  cover exactly the hours from the hour of start to the hour of end. The timestamp clause must contain the unix
+  timestamps of start and end.
+* equality: the predicate must be identical to the one of an independent reference implementation, which computes
+  the segments arithmetically.
+
+The candidate is any function with the signature of generate_timerange_query, by default generate_timerange_query
+itself. Use this to check an optimised builder before replacing the current one:
+
+    python -m app.tests.differential_harness --ranges 1000000 --candidate my_module:my_generate_timerange_query
+
+The ranges are generated in parallel on all cores (see --processes). A small part of it runs with the normal tests in
+differential_test.py.
+"""
+
+import argparse
+import importlib
+import itertools
+import multiprocessing
+import random
+import re
+import sys
+import time
+from calendar import monthrange
+from datetime import date, datetime, timezone
+from typing import Callable, Iterator, List, Optional, Tuple
+
+DEFAULT_CANDIDATE = 'app.query_utils.hive_impala_query_builder:generate_timerange_query'
+
+PARTITION_KEYS = ('year', 'month', 'day', 'hour')
+
+_TIMESTAMP_PATTERN = re.compile(r'^`timestamp` BETWEEN (-?\d+) AND (-?\d+) AND (.*)$')
+_CONDITION_SEPARATOR = re.compile(r' AND (?=`)')
+_CONDITION_PATTERN = re.compile(r'^`(year|month|day|hour)` (?:= (\d+)|BETWEEN (\d+) AND (\d+))$')
+
+_MIN_SECONDS = int(datetime(year=1971, month=1, day=1, tzinfo=timezone.utc).timestamp())
+_MAX_SECONDS = int(datetime(year=2099, month=12, day=31, tzinfo=timezone.utc).timestamp())
+
+
+def _hour_index(year: int, month: int = 1, day: int = 1, hour: int = 0) -> int:
+    """The number of hours since 0001-01-01 of the given hour."""
+    return date(year, month, day).toordinal() * 24 + hour
+
+
+def _datetime_hour_index(d: datetime) -> int:
+    return _hour_index(d.year, d.month, d.day, d.hour)
+
+
+def _format_condition(key: str, first: int, last: int) -> str:
+    if first == last:
+        return '`{0}` = {1}'.format(key, first)
+    return '`{0}` BETWEEN {1} AND {2}'.format(key, first, last)
+
+
+def reference_partition_filter(start: datetime, end: datetime) -> str:
+    """Compute the partition filter for start and end the way PartitionQueryBuilder is specified to.
+
+    The range is split into the hours of the start day, the days of the start month, the months of the start year,
+    the years in between, the months of the end year, the days of the end month and the hours of the end day. Empty
+    segments are dropped. The hours of the start and the end day are always emitted as hour ranges, even if they cover
+    the whole day.
+
+    Args:
+        start: The start date in UTC.
+        end: The end date in UTC, not before start.
+
+    Returns:
+        The expected partition filter.
+    """
+    segments: List[Tuple[Tuple[int, int], ...]] = []
+    same_year = start.year == end.year
+    same_month = same_year and start.month == end.month
+    same_day = same_month and start.day == end.day
+    if not same_day:
+        segments.append(((start.year, start.year), (start.month, start.month), (start.day, start.day),
+                         (start.hour, 23)))
+        last_day = end.day - 1 if same_month else monthrange(start.year, start.month)[1]
+        segments.append(((start.year, start.year), (start.month, start.month), (start.day + 1, last_day)))
+        if not same_month:
+            last_month = end.month - 1 if same_year else 12
+            segments.append(((start.year, start.year), (start.month + 1, last_month)))
+            if not same_year:
+                segments.append(((start.year + 1, end.year - 1),))
+                segments.append(((end.year, end.year), (1, end.month - 1)))
+            segments.append(((end.year, end.year), (end.month, end.month), (1, end.day - 1)))
+        segments.append(((end.year, end.year), (end.month, end.month), (end.day, end.day), (0, end.hour)))
+    else:
+        segments.append(((start.year, start.year), (start.month, start.month), (start.day, start.day),
+                         (start.hour, end.hour)))
+    terms = ['({0})'.format(' AND '.join(_format_condition(key, first, last)
+                                         for key, (first, last) in zip(PARTITION_KEYS, segment)))
+             for segment in segments if segment[-1][0] <= segment[-1][1]]
+    return '({0})'.format(' OR '.join(terms))
+
+
+def _term_interval(term: str) -> Tuple[int, int]:
+    """Evaluate a single term of a partition filter into the interval of hours [first, last) it covers.
+
+    Raises:
+        ValueError: If the term is not a valid conjunction of partition conditions or references partitions that do
+            not exist (for example day 31 in April).
+    """
+    conditions = _CONDITION_SEPARATOR.split(term)
+    if len(conditions) > len(PARTITION_KEYS):
+        raise ValueError('too many conditions in term "{0}"'.format(term))
+    bounds = []
+    for key, condition in zip(PARTITION_KEYS, conditions):
+        match = _CONDITION_PATTERN.match(condition)
+        if match is None or match.group(1) != key:
+            raise ValueError('expected a condition on `{0}` in term "{1}"'.format(key, term))
+        if match.group(2) is not None:
+            first = last = int(match.group(2))
+        else:
+            first, last = int(match.group(3)), int(match.group(4))
+            if first >= last:
+                raise ValueError('empty or single valued BETWEEN in term "{0}"'.format(term))
+        bounds.append((first, last))
+    if any(first != last for first, last in bounds[:-1]):
+        raise ValueError('only the last condition may be a range in term "{0}"'.format(term))
+    fixed = [first for first, _ in bounds[:-1]]
+    first, last = bounds[-1]
+    level = len(bounds)
+    if level == 2 and not 1 <= first <= last <= 12:
+        raise ValueError('invalid month in term "{0}"'.format(term))
+    if level == 3 and not (1 <= fixed[1] <= 12 and 1 <= first <= last <= monthrange(fixed[0], fixed[1])[1]):
+        raise ValueError('invalid day in term "{0}"'.format(term))
+    if level == 4 and not (1 <= fixed[1] <= 12 and 1 <= fixed[2] <= monthrange(fixed[0], fixed[1])[1]
+                           and 0 <= first <= last <= 23):
+        raise ValueError('invalid hour in term "{0}"'.format(term))
+    try:
+        interval_start = _hour_index(*fixed, first)
+        if level == 1:
+            interval_end = _hour_index(last + 1)
+        elif level == 2:
+            interval_end = _hour_index(fixed[0] + 1) if last == 12 else _hour_index(fixed[0], last + 1)
+        elif level == 3:
+            interval_end = _hour_index(*fixed, last) + 24
+        else:
+            interval_end = _hour_index(*fixed, last) + 1
+    except ValueError:
+        raise ValueError('invalid partition in term "{0}"'.format(term))
+    return interval_start, interval_end
+
+
+def evaluate_partition_filter(partition_filter: str) -> List[Tuple[int, int]]:
+    """Evaluate a partition filter into the intervals of hours [first, last) covered by its terms, in order.
+
+    Raises:
+        ValueError: If the filter is not a disjunction of valid terms.
+    """
+    if not (partition_filter.startswith('((') and partition_filter.endswith('))')):
+        raise ValueError('partition filter has to be a parenthesised disjunction: "{0}"'.format(partition_filter))
+    return [_term_interval(term) for term in partition_filter[2:-2].split(') OR (')]
+
+
+def check_query(query: str, start: datetime, end: datetime, generate_timestamp_clause: bool) -> Optional[str]:
+    """Check a generated query for start and end.
+
+    Returns:
+        None if the query is correct, otherwise a description of the first problem found.
+    """
+    partition_filter = query
+    if generate_timestamp_clause:
+        match = _TIMESTAMP_PATTERN.match(query)
+        if match is None:
+            return 'missing timestamp clause'
+        if (int(match.group(1)), int(match.group(2))) != (int(start.timestamp()), int(end.timestamp())):
+            return 'wrong timestamp clause'
+        partition_filter = match.group(3)
+    try:
+        intervals = evaluate_partition_filter(partition_filter)
+    except ValueError as e:
+        return str(e)
+    expected_start = _datetime_hour_index(start)
+    for interval_start, interval_end in intervals:
+        if interval_start < expected_start:
+            return 'terms overlap or are not in chronological order'
+        if interval_start > expected_start:
+            return 'hours between terms are not covered'
+        expected_start = interval_end
+    if expected_start != _datetime_hour_index(end) + 1:
+        return 'covered hours do not end at the hour of the end date'
+    if partition_filter != reference_partition_filter(start, end):
+        return 'differs from the reference implementation'
+    return None
+
+
+def edge_case_ranges() -> Iterator[Tuple[datetime, datetime]]:
+    """Generate ranges between instants around month ends, year ends and leap days."""
+    instants = []
+    for year in (1999, 2000, 2019, 2020, 2021, 2023, 2024):
+        for month in (1, 2, 3, 11, 12):
+            last_day = monthrange(year, month)[1]
+            for day in (1, 2, last_day - 1, last_day):
+                for hour, minute, second in ((0, 0, 0), (0, 0, 1), (22, 59, 59), (23, 0, 0), (23, 59, 59)):
+                    instants.append(datetime(year=year, month=month, day=day, hour=hour, minute=minute,
+                                             second=second, tzinfo=timezone.utc))
+    for start in instants:
+        for end in instants:
+            if start <= end:
+                yield start, end
+
+
+def random_ranges(seed: int, count: int) -> Iterator[Tuple[datetime, datetime]]:
+    """Generate random ranges with lengths from a second to several decades."""
+    rng = random.Random(seed)
+    spans = (1, 60, 3600, 86400, 31 * 86400, 366 * 86400, 40 * 366 * 86400)
+    for _ in range(count):
+        start = rng.randint(_MIN_SECONDS, _MAX_SECONDS)
+        # snap the start to an hour boundary in some cases, these are common in practice
+        if rng.random() < 0.3:
+            start -= start % 3600
+        end = min(start + rng.randint(0, rng.choice(spans)), _MAX_SECONDS)
+        # fractional seconds must not make a difference to the partitions
+        if rng.random() < 0.1:
+            yield (datetime.fromtimestamp(start + 0.25, timezone.utc),
+                   datetime.fromtimestamp(end + 0.75, timezone.utc))
+        else:
+            yield datetime.fromtimestamp(start, timezone.utc), datetime.fromtimestamp(end, timezone.utc)
+
+
+def load_candidate(path: str) -> Callable[[datetime, datetime, bool], str]:
+    """Load a candidate function from a "module:function" path."""
+    module, function = path.split(':')
+    return getattr(importlib.import_module(module), function)
+
+
+def run_checks(candidate: Callable[[datetime, datetime, bool], str], ranges: Iterator[Tuple[datetime, datetime]],
+               max_failures: int = 10) -> Tuple[int, List[str]]:
+    """Run the candidate on all ranges (alternately with and without timestamp clause) and check the results.
+
+    Returns:
+        The number of checked ranges and descriptions of up to max_failures failures.
+    """
+    failures = []
+    checked = 0
+    for checked, (start, end) in enumerate(ranges, 1):
+        generate_timestamp_clause = bool(checked % 2)
+        try:
+            problem = check_query(candidate(start, end, generate_timestamp_clause), start, end,
+                                  generate_timestamp_clause)
+        except Exception as e:
+            problem = 'raised {0!r}'.format(e)
+        if problem is not None:
+            failures.append('{0} - {1}: {2}'.format(start.isoformat(), end.isoformat(), problem))
+            if len(failures) >= max_failures:
+                break
+    return checked, failures
+
+
+def _run_random_chunk(arguments: Tuple[str, int, int]) -> Tuple[int, List[str]]:
+    candidate, seed, count = arguments
+    return run_checks(load_candidate(candidate), random_ranges(seed, count))
+
+
+def _run_edge_case_chunk(arguments: Tuple[str, int, int]) -> Tuple[int, List[str]]:
+    candidate, offset, step = arguments
+    return run_checks(load_candidate(candidate), itertools.islice(edge_case_ranges(), offset, None, step))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ranges', type=int, default=1000000, help='Number of random ranges to check')
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--candidate', default=DEFAULT_CANDIDATE, help='The function to check, module:function')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    chunk_size = 10000
+    random_chunks = [(args.candidate, args.seed * 1000003 + i, min(chunk_size, args.ranges - offset))
+                     for i, offset in enumerate(range(0, args.ranges, chunk_size))]
+    edge_case_step = args.processes * 4
+    edge_case_chunks = [(args.candidate, offset, edge_case_step) for offset in range(edge_case_step)]
+    checked = 0
+    failures = []
+    with multiprocessing.Pool(args.processes) as pool:
+        results = itertools.chain(pool.imap_unordered(_run_edge_case_chunk, edge_case_chunks),
+                                  pool.imap_unordered(_run_random_chunk, random_chunks))
+        for chunk_checked, chunk_failures in results:
+            checked += chunk_checked
+            failures.extend(chunk_failures)
+    duration = time.perf_counter() - started
+
+    for failure in failures:
+        print(failure)
+    print('checked {0} ranges in {1:.1f}s, {2} failures'.format(checked, duration, len(failures)))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
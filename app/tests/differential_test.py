@@ -0,0 +1,38 @@
+import itertools
+from datetime import datetime, timezone
+
+from ..query_utils.hive_impala_query_builder import generate_timerange_query
+from .differential_harness import check_query, edge_case_ranges, random_ranges, run_checks
+
+
+def test_builder_edge_cases():
+    """Check a sample of the edge cases of the differential harness, the harness itself checks all of them.
+    """
+    checked, failures = run_checks(generate_timerange_query, itertools.islice(edge_case_ranges(), 0, None, 97))
+    assert checked > 2000
+    assert failures == []
+
+
+def test_builder_random_ranges():
+    checked, failures = run_checks(generate_timerange_query, random_ranges(seed=42, count=2000))
+    assert checked == 2000
+    assert failures == []
+
+
+def test_check_query_detects_errors():
+    start = datetime(year=2017, month=5, day=13, hour=22, tzinfo=timezone.utc)
+    end = datetime(year=2017, month=6, day=14, hour=21, minute=59, second=59, tzinfo=timezone.utc)
+    query = generate_timerange_query(start, end)
+    assert check_query(query, start, end, True) is None
+
+    # a missing term leaves a gap
+    terms = query.split(' OR ')
+    assert check_query(' OR '.join(terms[:1] + terms[2:]), start, end, True) == \
+        'hours between terms are not covered'
+    # a duplicated term overlaps
+    assert check_query(' OR '.join(terms[:2] + terms[1:]), start, end, True) == \
+        'terms overlap or are not in chronological order'
+    # a day that does not exist
+    assert check_query(query.replace('BETWEEN 14 AND 31', 'BETWEEN 14 AND 32'), start, end, True).startswith(
+        'invalid day')
+    assert check_query(query.replace('1494712800', '1494712801'), start, end, True) == 'wrong timestamp clause'
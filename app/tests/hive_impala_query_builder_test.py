@@ -1,3 +1,5 @@
+import random
+import re
 from datetime import datetime, timezone, timedelta
 import pytest
 
@@ -308,3 +310,116 @@ def test_several_years():
                "(`year` = 2020 AND `month` = 12 AND `day` = 31 AND `hour` BETWEEN 0 AND 23)" \
                ")"
     assert query_builder.build_partition_filter() == expected
+
+
+def test_end_date_last_second_of_start_year():
+    """
+    Test that December is not added as full month if the end date is the last second of the start date year.
+    """
+    query_builder = PartitionQueryBuilder(
+        datetime(year=1999, month=2, day=1, hour=0, tzinfo=timezone.utc),
+        datetime(year=1999, month=12, day=31, hour=23, minute=59, second=59, tzinfo=timezone.utc)
+    )
+
+    expected = "(" \
+               "(`year` = 1999 AND `month` = 2 AND `day` = 1 AND `hour` BETWEEN 0 AND 23)" \
+               " OR " \
+               "(`year` = 1999 AND `month` = 2 AND `day` BETWEEN 2 AND 28)" \
+               " OR " \
+               "(`year` = 1999 AND `month` BETWEEN 3 AND 11)" \
+               " OR " \
+               "(`year` = 1999 AND `month` = 12 AND `day` BETWEEN 1 AND 30)" \
+               " OR " \
+               "(`year` = 1999 AND `month` = 12 AND `day` = 31 AND `hour` BETWEEN 0 AND 23)" \
+               ")"
+    assert query_builder.build_partition_filter() == expected
+
+
+def test_timestamp_filter_units():
+    query_builder = PartitionQueryBuilder(
+        datetime(year=2020, month=11, day=24, hour=15, microsecond=250000, tzinfo=timezone.utc),
+        datetime(year=2020, month=11, day=25, hour=17, minute=59, second=59, microsecond=999999, tzinfo=timezone.utc)
+    )
+    assert query_builder.build_timestamp_filter() == "`timestamp` BETWEEN 1606230000 AND 1606327199"
+    assert query_builder.build_timestamp_filter('ms') == "`timestamp` BETWEEN 1606230000250 AND 1606327199999"
+    assert query_builder.build_timestamp_filter('us') == "`timestamp` BETWEEN 1606230000250000 AND 1606327199999999"
+    assert query_builder.build_timestamp_filter('ns') == \
+        "`timestamp` BETWEEN 1606230000250000000 AND 1606327199999999000"
+    assert query_builder.build_timestamp_filter('timestamp') == \
+        "`timestamp` BETWEEN CAST('2020-11-24 15:00:00.250000' AS TIMESTAMP) " \
+        "AND CAST('2020-11-25 17:59:59.999999' AS TIMESTAMP)"
+    with pytest.raises(ValueError, match='Timestamp type'):
+        query_builder.build_timestamp_filter('minutes')
+
+
+def test_generate_timerange_query_with_timestamp_type():
+    start = datetime(year=2020, month=11, day=24, hour=15, tzinfo=timezone.utc)
+    end = datetime(year=2020, month=11, day=24, hour=16, tzinfo=timezone.utc)
+    assert generate_timerange_query(start, end, True, 'timestamp') == \
+        "`timestamp` BETWEEN CAST('2020-11-24 15:00:00' AS TIMESTAMP) AND CAST('2020-11-24 16:00:00' AS TIMESTAMP) " \
+        "AND ((`year` = 2020 AND `month` = 11 AND `day` = 24 AND `hour` BETWEEN 15 AND 16))"
+
+
+def test_sub_hour_precision():
+    query_builder = PartitionQueryBuilder(
+        datetime(year=2020, month=11, day=24, hour=10, minute=59, tzinfo=timezone.utc),
+        datetime(year=2020, month=11, day=24, hour=11, minute=1, tzinfo=timezone.utc)
+    )
+    assert query_builder.build_partition_filter(sub_hour_precision=True) == \
+        "(" \
+        "(`year` = 2020 AND `month` = 11 AND `day` = 24 AND `hour` = 10 AND `timestamp` >= 1606215540)" \
+        " OR " \
+        "(`year` = 2020 AND `month` = 11 AND `day` = 24 AND `hour` = 11 AND `timestamp` <= 1606215660)" \
+        ")"
+
+    # only the boundary hours get a bound, full boundary hours none
+    query_builder = PartitionQueryBuilder(
+        datetime(year=2020, month=11, day=24, hour=10, minute=30, tzinfo=timezone.utc),
+        datetime(year=2020, month=11, day=25, hour=17, minute=59, second=59, tzinfo=timezone.utc)
+    )
+    assert query_builder.build_partition_filter(sub_hour_precision=True) == \
+        "(" \
+        "(`year` = 2020 AND `month` = 11 AND `day` = 24 AND `hour` = 10 AND `timestamp` >= 1606213800)" \
+        " OR " \
+        "(`year` = 2020 AND `month` = 11 AND `day` = 24 AND `hour` BETWEEN 11 AND 23)" \
+        " OR " \
+        "(`year` = 2020 AND `month` = 11 AND `day` = 25 AND `hour` BETWEEN 0 AND 17)" \
+        ")"
+    # with milliseconds the hour does not end with the last second
+    assert query_builder.build_partition_filter(sub_hour_precision=True, timestamp_type='ms').endswith(
+        "(`year` = 2020 AND `month` = 11 AND `day` = 25 AND `hour` BETWEEN 0 AND 16)"
+        " OR "
+        "(`year` = 2020 AND `month` = 11 AND `day` = 25 AND `hour` = 17 AND `timestamp` <= 1606327199000)"
+        ")")
+
+    query_builder = PartitionQueryBuilder(
+        datetime(year=2020, month=11, day=24, hour=10, minute=15, tzinfo=timezone.utc),
+        datetime(year=2020, month=11, day=24, hour=10, minute=45, tzinfo=timezone.utc)
+    )
+    assert query_builder.build_partition_filter(sub_hour_precision=True, timestamp_type='timestamp') == \
+        "((`year` = 2020 AND `month` = 11 AND `day` = 24 AND `hour` = 10 AND `timestamp` BETWEEN " \
+        "CAST('2020-11-24 10:15:00' AS TIMESTAMP) AND CAST('2020-11-24 10:45:00' AS TIMESTAMP)))"
+
+
+def _evaluate_filter(partition_filter: str, timestamp: datetime) -> bool:
+    """Evaluate a partition filter with timestamp bounds in seconds for a row with the given timestamp."""
+    expression = re.sub(r'`(\w+)` BETWEEN (\d+) AND (\d+)', r'(\2 <= \1 <= \3)', partition_filter)
+    expression = re.sub(r'`(\w+)` = ', r'\1 == ', expression)
+    expression = re.sub(r'`(\w+)` ', r'\1 ', expression).replace(' AND ', ' and ').replace(' OR ', ' or ')
+    variables = {'year': timestamp.year, 'month': timestamp.month, 'day': timestamp.day, 'hour': timestamp.hour,
+                 'timestamp': int(timestamp.timestamp())}
+    return eval(expression, {}, variables)
+
+
+def test_sub_hour_precision_covers_exactly_the_range():
+    rng = random.Random(0)
+    first = datetime(year=2020, month=12, day=30, tzinfo=timezone.utc)
+    for _ in range(300):
+        start = first + timedelta(seconds=rng.randint(0, 4 * 86400))
+        end = start + timedelta(seconds=rng.choice([rng.randint(0, 7200), rng.randint(0, 3 * 86400)]))
+        partition_filter = PartitionQueryBuilder(start, end).build_partition_filter(sub_hour_precision=True)
+        for row in [start, end, start - timedelta(seconds=1), end + timedelta(seconds=1),
+                    start.replace(minute=0, second=0), end.replace(minute=59, second=59)] + \
+                   [start + (end - start) * rng.random() for _ in range(5)]:
+            row = row.replace(microsecond=0)
+            assert _evaluate_filter(partition_filter, row) == (start <= row <= end), (start, end, row)
@@ -0,0 +1,76 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from ..query_utils.hive_impala_query_builder import generate_timerange_query
+from ..query_utils.incremental_partition_filter import extend_segmentation
+
+
+def test_sliding_window_updates_only_hour_segments():
+    start = datetime(year=2020, month=3, day=1, hour=10, minute=15, tzinfo=timezone.utc)
+    end = start + timedelta(days=7)
+    segmentation, delta = extend_segmentation(None, start, end)
+    assert len(delta.added) == 7 * 24 + 1
+    assert delta.removed == []
+
+    segmentation, delta = extend_segmentation(segmentation, start + timedelta(hours=1), end + timedelta(hours=1))
+    assert delta.changed_segments == ['start_date_hours', 'end_date_hours']
+    assert delta.added == [(2020, 3, 8, 11)]
+    assert delta.removed == [(2020, 3, 1, 10)]
+    assert segmentation.query() == generate_timerange_query(start + timedelta(hours=1), end + timedelta(hours=1))
+    assert segmentation.query(False) == segmentation.partition_filter
+
+
+def test_sliding_window_across_month_boundary():
+    start = datetime(year=2020, month=2, day=28, hour=23, tzinfo=timezone.utc)
+    end = datetime(year=2020, month=3, day=31, hour=23, minute=30, tzinfo=timezone.utc)
+    segmentation, _ = extend_segmentation(None, start, end)
+    segmentation, delta = extend_segmentation(segmentation, start + timedelta(hours=1), end + timedelta(hours=1))
+    assert 'gap_years' not in delta.changed_segments
+    assert delta.added == [(2020, 4, 1, 0)]
+    assert delta.removed == [(2020, 2, 28, 23)]
+    assert segmentation.partition_filter == generate_timerange_query(start + timedelta(hours=1),
+                                                                     end + timedelta(hours=1), False)
+
+
+def test_non_overlapping_ranges():
+    start = datetime(year=2020, month=1, day=1, tzinfo=timezone.utc)
+    segmentation, _ = extend_segmentation(None, start, start + timedelta(hours=1))
+    segmentation, delta = extend_segmentation(segmentation, start + timedelta(hours=5), start + timedelta(hours=5))
+    assert delta.added == [(2020, 1, 1, 5)]
+    assert delta.removed == [(2020, 1, 1, 0), (2020, 1, 1, 1)]
+
+
+def test_incremental_matches_builder():
+    """Any sequence of ranges must give the same filters as generating them from scratch."""
+    rng = random.Random(0)
+    first = datetime(year=2018, month=1, day=1, tzinfo=timezone.utc)
+    segmentation = None
+    previous_hours = set()
+    for _ in range(500):
+        if segmentation is not None and rng.random() < 0.5:
+            # slide the previous range
+            shift = timedelta(hours=rng.randint(1, 48))
+            start, end = segmentation.start_date + shift, segmentation.end_date + shift
+        else:
+            start = first + timedelta(seconds=rng.randint(0, 3 * 366 * 86400))
+            end = start + timedelta(seconds=rng.randint(0, rng.choice([3600, 3 * 86400, 100 * 86400, 400 * 86400])))
+        segmentation, delta = extend_segmentation(segmentation, start, end)
+        assert segmentation.partition_filter == generate_timerange_query(start, end, False)
+        hours = set()
+        hour = start.replace(minute=0, second=0, microsecond=0)
+        while hour <= end:
+            hours.add((hour.year, hour.month, hour.day, hour.hour))
+            hour += timedelta(hours=1)
+        assert set(delta.added) == hours - previous_hours
+        assert set(delta.removed) == previous_hours - hours
+        previous_hours = hours
+
+
+def test_invalid_range():
+    start = datetime(year=2020, month=1, day=2, tzinfo=timezone.utc)
+    with pytest.raises(ValueError, match='before the end date'):
+        extend_segmentation(None, start, start - timedelta(seconds=1))
+    with pytest.raises(ValueError, match='UTC'):
+        extend_segmentation(None, start.replace(tzinfo=None), start)
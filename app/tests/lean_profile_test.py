@@ -0,0 +1,76 @@
+import json
+import os
+import subprocess
+import sys
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from .. import main, openapi_schema, profiler
+from ..routers import partition_range
+
+_LEAN_APP_SNIPPET = """
+import json
+from fastapi.testclient import TestClient
+from app import main
+client = TestClient(main.app)
+print(json.dumps({
+    'lean_profile': main.lean_profile,
+    'status_codes': {path: client.get(path, allow_redirects=False).status_code
+                     for path in ['/', '/docs', '/redoc', '/openapi.json']},
+    'openapi': client.get('/openapi.json').json(),
+}))
+"""
+
+
+def _sample(name: str, labels=None) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_stage_metrics_middleware():
+    app = FastAPI()
+    app.include_router(partition_range.router)
+    app.add_middleware(profiler.StageMetricsMiddleware)
+    client = TestClient(app)
+
+    requests_before = _sample('partitioning_service_requests_total', {'status': '200'})
+    generate_before = _sample('partitioning_service_stage_duration_seconds_count', {'stage': 'generate'})
+    response = client.get('/impala', params={'start': '2020-01-01T10:00:00', 'end': '2020-01-03T12:00:00'})
+    assert response.status_code == 200
+    assert _sample('partitioning_service_requests_total', {'status': '200'}) == requests_before + 1
+    assert _sample('partitioning_service_stage_duration_seconds_count', {'stage': 'generate'}) == generate_before + 1
+
+    not_found_before = _sample('partitioning_service_requests_total', {'status': '404'})
+    assert client.get('/unknown').status_code == 404
+    assert _sample('partitioning_service_requests_total', {'status': '404'}) == not_found_before + 1
+
+
+def test_lean_profile(tmp_path):
+    environment = dict(os.environ, APP_PROFILE='lean', prometheus_multiproc_dir=str(tmp_path))
+    output = subprocess.run([sys.executable, '-c', _LEAN_APP_SNIPPET], env=environment, check=True,
+                            capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))).stdout
+    result = json.loads(output)
+    assert result['lean_profile']
+    assert result['status_codes'] == {'/': 404, '/docs': 404, '/redoc': 404, '/openapi.json': 200}
+    # the schema generated by the lean app is the schema of the default app
+    assert result['openapi'] == main.app.openapi()
+
+
+def test_render_openapi_schema():
+    assert not main.lean_profile
+    assert json.loads(openapi_schema.render(main.app)) == main.app.openapi()
+
+
+def test_lean_profile_schema_matches_configuration(tmp_path):
+    # a stale schema file in the app root is not served
+    (tmp_path / 'openapi.json').write_text('{"stale": true}')
+    project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    for name in ['VERSION', 'app_description.md']:
+        (tmp_path / name).write_text(open(os.path.join(project_root, name)).read())
+    environment = dict(os.environ, APP_PROFILE='lean', APP_ROOT=str(tmp_path), ENABLE_PROFILING='true',
+                       prometheus_multiproc_dir=str(tmp_path))
+    output = subprocess.run([sys.executable, '-c', _LEAN_APP_SNIPPET], env=environment, check=True,
+                            capture_output=True, text=True, cwd=project_root).stdout
+    assert '/admin/profile' in json.loads(output)['openapi']['paths']
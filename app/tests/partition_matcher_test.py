@@ -0,0 +1,90 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from ..query_utils.hive_impala_query_builder import TIMESTAMP_TYPES, generate_timerange_query, \
+    generate_timerange_query_with_matcher
+from .differential_harness import evaluate_partition_filter, random_ranges
+
+
+def _matcher():
+    start = datetime(year=2017, month=5, day=13, hour=22, minute=30, tzinfo=timezone.utc)
+    end = datetime(year=2017, month=6, day=2, hour=3, minute=59, second=59, tzinfo=timezone.utc)
+    return generate_timerange_query_with_matcher(start, end, False)[1]
+
+
+def test_matches():
+    matcher = _matcher()
+    assert matcher.matches(2017, 5, 13, 22)
+    assert matcher.matches(2017, 5, 31, 0)
+    assert matcher.matches(2017, 6, 2, 3)
+    assert not matcher.matches(2017, 5, 13, 21)
+    assert not matcher.matches(2017, 6, 2, 4)
+    assert not matcher.matches(2016, 5, 20, 0)
+
+
+def test_matches_path():
+    matcher = _matcher()
+    assert matcher.matches_path('/data/events/year=2017/month=05/day=13/hour=23')
+    assert matcher.matches_path('s3://bucket/events/year=2017/month=6/day=2/hour=3/part-0000.parquet')
+    assert not matcher.matches_path('/data/events/year=2017/month=6/day=2/hour=4')
+    # directories above the hour level match if at least one hour below them is covered
+    assert matcher.matches_path('/data/events/year=2017')
+    assert matcher.matches_path('/data/events/year=2017/month=6')
+    assert matcher.matches_path('/data/events/year=2017/month=5/day=13')
+    assert not matcher.matches_path('/data/events/year=2017/month=5/day=12')
+    assert not matcher.matches_path('/data/events/year=2017/month=7')
+    assert not matcher.matches_path('/data/events/year=2018')
+    # partition directories have to be complete path segments
+    assert matcher.matches_path('year=2017/month=5')
+    for path in ['/data/t/fiscal_year=2017/month=5', '/data/t/year=2017_old', '/data/t/xyear=2017']:
+        with pytest.raises(ValueError):
+            matcher.matches_path(path)
+    with pytest.raises(ValueError, match='is not a partition path'):
+        matcher.matches_path('/data/events/_SUCCESS')
+
+    paths = ['year=2017/month=5/day={0}/hour=0'.format(day) for day in range(1, 32)]
+    assert matcher.filter_paths(paths) == paths[13:]
+
+
+def test_matches_columns():
+    matcher = _matcher()
+    assert matcher.matches_columns(2017, 5, 13, 22)
+    assert not matcher.matches_columns(2017, 5, 13, 21)
+
+    np = pytest.importorskip('numpy')
+    result = matcher.matches_columns(np.array([2017, 2017, 2017]), np.array([5, 5, 6]), np.array([13, 13, 2]),
+                                     np.array([21, 22, 4]))
+    assert result.tolist() == [False, True, False]
+
+
+def test_matcher_consistent_with_query():
+    """The matcher covers exactly the hours of the generated partition filter.
+    """
+    for start, end in random_ranges(seed=7, count=300):
+        query, matcher = generate_timerange_query_with_matcher(start, end, False)
+        intervals = evaluate_partition_filter(query)
+        first_hour = datetime.fromordinal(intervals[0][0] // 24).replace(hour=intervals[0][0] % 24)
+        last_hour = datetime.fromordinal((intervals[-1][1] - 1) // 24).replace(hour=(intervals[-1][1] - 1) % 24)
+        assert matcher.matches(first_hour.year, first_hour.month, first_hour.day, first_hour.hour)
+        assert matcher.matches(last_hour.year, last_hour.month, last_hour.day, last_hour.hour)
+        before = datetime.fromordinal((intervals[0][0] - 1) // 24).replace(hour=(intervals[0][0] - 1) % 24)
+        after = datetime.fromordinal(intervals[-1][1] // 24).replace(hour=intervals[-1][1] % 24)
+        assert not matcher.matches(before.year, before.month, before.day, before.hour)
+        assert not matcher.matches(after.year, after.month, after.day, after.hour)
+
+
+def test_matcher_with_query_options():
+    """The options of generate_timerange_query are passed through, the matcher does not depend on them.
+    """
+    start = datetime(year=2017, month=5, day=13, hour=21, minute=30, tzinfo=timezone.utc)
+    end = datetime(year=2017, month=5, day=14, hour=2, minute=15, tzinfo=timezone.utc)
+    for timestamp_type in TIMESTAMP_TYPES:
+        for sub_hour_precision in (False, True):
+            query, matcher = generate_timerange_query_with_matcher(start, end, True, timestamp_type,
+                                                                   sub_hour_precision)
+            assert query == generate_timerange_query(start, end, True, timestamp_type, sub_hour_precision)
+            assert [matcher.matches(2017, 5, 13, hour) for hour in (20, 21)] == [False, True]
+            assert [matcher.matches(2017, 5, 14, hour) for hour in (2, 3)] == [True, False]
+    with pytest.raises(ValueError):
+        generate_timerange_query_with_matcher(start, end, True, 'minutes')
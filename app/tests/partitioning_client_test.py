@@ -0,0 +1,62 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+import pytest
+import requests
+from fastapi.testclient import TestClient
+
+from ..client import AsyncPartitioningClient, PartitioningClient
+from ..query_utils.hive_impala_query_builder import generate_timerange_query
+
+START = datetime(year=2017, month=5, day=13, hour=22, tzinfo=timezone.utc)
+END = datetime(year=2017, month=5, day=14, hour=21, minute=59, second=59, tzinfo=timezone.utc)
+EXPECTED = "`timestamp` BETWEEN 1494712800 AND 1494799199 AND " \
+           "(" \
+           "(`year` = 2017 AND `month` = 5 AND `day` = 13 AND `hour` BETWEEN 22 AND 23)" \
+           " OR " \
+           "(`year` = 2017 AND `month` = 5 AND `day` = 14 AND `hour` BETWEEN 0 AND 21)" \
+           ")"
+
+# nothing listens on port 1, so connecting fails immediately
+UNREACHABLE_URL = 'http://127.0.0.1:1'
+
+
+def test_client_service(testing_client: TestClient):
+    with PartitioningClient('http://testserver', engine='hive', fallback=False, session=testing_client) as client:
+        assert client.query(START, END) == EXPECTED
+        # offsets and naive datetimes are converted like in the service
+        assert client.query(START.astimezone(timezone(timedelta(hours=2))), END.replace(tzinfo=None)) == EXPECTED
+        assert client.query_many([(START, END)] * 3) == [EXPECTED] * 3
+        with pytest.raises(ValueError, match='end date can not be before start date'):
+            client.query(END, START)
+
+
+def test_client_local():
+    client = PartitioningClient(UNREACHABLE_URL, local=True)
+    assert client.query(START, END, False) == generate_timerange_query(START, END, False)
+
+
+def test_client_fallback():
+    assert PartitioningClient(UNREACHABLE_URL).query(START, END) == EXPECTED
+    with pytest.raises(requests.ConnectionError):
+        PartitioningClient(UNREACHABLE_URL, fallback=False).query(START, END)
+
+
+def test_client_cache():
+    """A cached query is returned without calling the service.
+    """
+    client = PartitioningClient(UNREACHABLE_URL, local=True)
+    client.query(START, END)
+    client.local = False
+    client.fallback = False
+    assert client.query(START, END) == EXPECTED
+    with pytest.raises(requests.ConnectionError):
+        client.query(START, END, False)
+
+
+def test_async_client(testing_client: TestClient):
+    async def run():
+        async with AsyncPartitioningClient('http://testserver', session=testing_client) as client:
+            return await client.query_many([(START, END)] * 3)
+
+    assert asyncio.run(run()) == [EXPECTED] * 3
@@ -0,0 +1,95 @@
+import threading
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pytest import fixture
+
+from .. import main, profiler
+from ..profiler import SamplingProfiler
+from ..routers import partition_range, profiling
+
+
+@fixture(scope='module')
+def profiling_client() -> TestClient:
+    # the app as main sets it up with ENABLE_PROFILING=true
+    app = FastAPI()
+    app.include_router(profiling.router, prefix='/admin')
+    app.include_router(partition_range.router)
+    app.add_middleware(profiler.StageTimingMiddleware)
+    return TestClient(app)
+
+
+def _busy_function(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampling_profiler_samples_other_threads():
+    stop = threading.Event()
+    thread = threading.Thread(target=_busy_function, args=(stop,), name='busy')
+    thread.start()
+    sampling_profiler = SamplingProfiler(interval=0.001)
+    sampling_profiler.start()
+    try:
+        stop.wait(0.2)
+    finally:
+        sampling_profiler.stop()
+        stop.set()
+        thread.join()
+
+    collapsed = sampling_profiler.collapsed()
+    busy_lines = [line for line in collapsed.splitlines() if line.startswith('thread busy;')]
+    assert busy_lines
+    assert any('_busy_function (profiling_test.py:' in line for line in busy_lines)
+    assert 'sampling-profiler' not in collapsed
+    for line in collapsed.splitlines():
+        stack, count = line.rsplit(' ', 1)
+        assert int(count) > 0
+
+    speedscope = sampling_profiler.speedscope()
+    profile = speedscope['profiles'][0]
+    assert profile['type'] == 'sampled'
+    assert len(profile['samples']) == len(profile['weights']) == len(sampling_profiler.samples)
+    frame_count = len(speedscope['shared']['frames'])
+    assert all(0 <= index < frame_count for sample in profile['samples'] for index in sample)
+    assert abs(profile['endValue'] - sum(sampling_profiler.samples.values()) * 0.001) < 1e-9
+
+
+def test_profile_endpoint(profiling_client):
+    response = profiling_client.get('/admin/profile', params={'duration': 0.1, 'interval_ms': 1})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    assert response.text
+
+    response = profiling_client.get('/admin/profile', params={'duration': 0.1, 'format': 'speedscope'})
+    assert response.status_code == 200
+    assert response.json()['profiles'][0]['type'] == 'sampled'
+
+    response = profiling_client.get('/admin/profile', params={'duration': 0.1, 'format': 'pprof'})
+    assert response.status_code == 422
+
+
+def test_profile_endpoint_rejects_concurrent_profiles(profiling_client):
+    with profiling._profile_lock:
+        response = profiling_client.get('/admin/profile', params={'duration': 0.1})
+    assert response.status_code == 409
+
+
+def test_stage_timings_only_on_request(profiling_client):
+    params = {'start': '2020-01-01T10:00:00', 'end': '2020-01-03T12:00:00'}
+    response = profiling_client.get('/impala', params=params)
+    assert response.status_code == 200
+    assert 'server-timing' not in response.headers
+
+    response = profiling_client.get('/impala', params=params, headers={profiler.DEBUG_TIMINGS_HEADER: '1'})
+    assert response.status_code == 200
+    stages = [entry.split(';dur=')[0] for entry in response.headers['server-timing'].split(', ')]
+    assert stages == ['convert', 'generate', 'total']
+
+
+def test_profiling_disabled_by_default(testing_client):
+    assert testing_client.get('/admin/profile', params={'duration': 0.1}).status_code == 404
+    response = testing_client.get('/impala', params={'start': '2020-01-01T10:00:00', 'end': '2020-01-01T12:00:00'},
+                                  headers={profiler.DEBUG_TIMINGS_HEADER: '1'})
+    assert 'server-timing' not in response.headers
+    assert all(route.path != '/admin/profile' for route in main.app.routes)
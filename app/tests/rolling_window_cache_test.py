@@ -0,0 +1,89 @@
+from datetime import datetime, timezone, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from freezegun import freeze_time
+
+from ..query_utils.hive_impala_query_builder import TIMESTAMP_TYPES, generate_timerange_query
+from ..query_utils.rolling_window_cache import RollingWindowCache, parse_window
+
+
+def test_parse_window():
+    assert parse_window('24h') == timedelta(hours=24)
+    assert parse_window('7d') == timedelta(days=7)
+    for invalid in ['', '0h', '24', '1w', '-1h', '1.5h']:
+        with pytest.raises(ValueError, match='Invalid window'):
+            parse_window(invalid)
+
+
+def test_rolling_window_matches_builder():
+    """The cached query must be the same as the query generated for the exact window.
+    """
+    cache = RollingWindowCache(['1h', '24h', '30d'])
+    cache.refresh(datetime(year=2020, month=3, day=1, hour=1, tzinfo=timezone.utc))
+    now = datetime(year=2020, month=3, day=1, hour=1, minute=42, second=7, tzinfo=timezone.utc)
+    for window, length in cache.windows.items():
+        assert cache.get(window, True, now) == generate_timerange_query(now - length, now)
+        assert cache.get(window, False, now) == generate_timerange_query(now - length, now, False)
+        for timestamp_type in TIMESTAMP_TYPES:
+            assert cache.get(window, True, now, timestamp_type) == \
+                generate_timerange_query(now - length, now, timestamp_type=timestamp_type)
+
+
+def test_rolling_window_stale_snapshot():
+    """If the cache has not been refreshed for the current hour the filter is rendered on the fly.
+    """
+    cache = RollingWindowCache(['2h'])
+    cache.refresh(datetime(year=2020, month=3, day=1, hour=1, tzinfo=timezone.utc))
+    now = datetime(year=2020, month=3, day=1, hour=2, minute=5, tzinfo=timezone.utc)
+    assert cache.get('2h', False, now) == \
+        "((`year` = 2020 AND `month` = 3 AND `day` = 1 AND `hour` BETWEEN 0 AND 2))"
+
+
+def test_rolling_window_stale_snapshot_is_stored(monkeypatch):
+    """Only the first request of a window in a new hour renders its filter.
+    """
+    cache = RollingWindowCache(['2h', '24h'])
+    cache.refresh(datetime(year=2020, month=3, day=1, hour=1, tzinfo=timezone.utc))
+    renders = []
+    render = RollingWindowCache._render
+    monkeypatch.setattr(RollingWindowCache, '_render',
+                        staticmethod(lambda length, hour: renders.append(length) or render(length, hour)))
+    now = datetime(year=2020, month=3, day=1, hour=2, minute=5, tzinfo=timezone.utc)
+    for _ in range(3):
+        for window in ['2h', '24h']:
+            assert cache.get(window, False, now) == generate_timerange_query(now - cache.windows[window], now, False)
+    assert renders == [timedelta(hours=2), timedelta(hours=24)]
+    # a request for an earlier hour does not replace the snapshot of the current hour
+    cache.get('2h', False, now - timedelta(hours=1))
+    cache.get('2h', False, now)
+    assert len(renders) == 3
+
+
+def test_rolling_window_unknown():
+    cache = RollingWindowCache(['2h'])
+    with pytest.raises(KeyError):
+        cache.get('3h', False)
+
+
+@freeze_time('2017-05-14 21:30:00')
+def test_rolling_endpoint(testing_client: TestClient):
+    expected = "`timestamp` BETWEEN 1494711000 AND 1494797400 AND " \
+               "(" \
+               "(`year` = 2017 AND `month` = 5 AND `day` = 13 AND `hour` BETWEEN 21 AND 23)" \
+               " OR " \
+               "(`year` = 2017 AND `month` = 5 AND `day` = 14 AND `hour` BETWEEN 0 AND 21)" \
+               ")"
+    for endpoint in ['/impala/rolling', '/hive/rolling']:
+        response = testing_client.get(endpoint, params={'window': '24h', 'generate_timestamp_clause': True})
+        assert response.status_code == 200
+        assert response.json() == {'query': expected}
+
+        response = testing_client.get(endpoint, params={'window': '5h'})
+        assert response.status_code == 422
+
+        response = testing_client.get(endpoint, params={'window': '24h', 'generate_timestamp_clause': True,
+                                                        'timestamp_type': 'ms'})
+        assert response.status_code == 200
+        assert response.json() == {'query': expected.replace('1494711000 AND 1494797400',
+                                                             '1494711000000 AND 1494797400000')}
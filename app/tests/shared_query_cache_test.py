@@ -0,0 +1,124 @@
+import multiprocessing
+import os
+import tempfile
+import zlib
+from datetime import datetime, timezone
+
+from fastapi.testclient import TestClient
+
+from ..query_utils import shared_query_cache
+from ..query_utils.shared_query_cache import _SEQUENCE, SharedQueryCache, WAYS
+from ..routers import partition_range
+
+
+def _cache_path() -> str:
+    return os.path.join(tempfile.mkdtemp(), 'query-cache')
+
+
+def test_get_put(monkeypatch):
+    monkeypatch.setattr(shared_query_cache, 'ATTACH_RETRY_SECONDS', 0.0)
+    path = _cache_path()
+    cache = SharedQueryCache(path)
+    # every lookup is a miss until the file has been created
+    cache.put(b'a', 'query a')
+    assert cache.get(b'a') is None
+
+    SharedQueryCache.create(path, slot_count=64, slot_size=128)
+    assert cache.get(b'a') is None
+    cache.put(b'a', 'query a')
+    cache.put(b'b', 'query b')
+    assert cache.get(b'a') == 'query a'
+    assert cache.get(b'b') == 'query b'
+    cache.put(b'a', 'query a2')
+    assert cache.get(b'a') == 'query a2'
+    # values that do not fit into a slot are not cached
+    cache.put(b'c', 'x' * 128)
+    assert cache.get(b'c') is None
+
+
+def test_missing_file_is_not_looked_for_on_every_lookup(monkeypatch):
+    opened = []
+    os_open = os.open
+
+    def counting_open(*args):
+        opened.append(args[0])
+        return os_open(*args)
+
+    monkeypatch.setattr(shared_query_cache.os, 'open', counting_open)
+    path = _cache_path()
+    cache = SharedQueryCache(path)
+    for _ in range(10):
+        cache.put(b'a', 'query a')
+        assert cache.get(b'a') is None
+    assert opened == [path]
+
+    # the file is attached once the retry interval passed
+    SharedQueryCache.create(path, slot_count=64, slot_size=128)
+    cache._next_attach = 0.0
+    cache.put(b'a', 'query a')
+    assert cache.get(b'a') == 'query a'
+
+
+def test_writer_crash():
+    """A slot left odd by a writer killed while writing it is usable again after the next write.
+    """
+    path = _cache_path()
+    SharedQueryCache.create(path, slot_count=WAYS, slot_size=64)
+    cache = SharedQueryCache(path)
+    cache.put(b'a', 'query a')
+    assert cache.get(b'a') == 'query a'
+    offset = next(offset for offset in cache._slot_offsets(zlib.crc32(b'a'))
+                  if _SEQUENCE.unpack_from(cache._map, offset)[0] != 0)
+    _SEQUENCE.pack_into(cache._map, offset, 3)
+    assert cache.get(b'a') is None
+    cache.put(b'a', 'query a2')
+    assert _SEQUENCE.unpack_from(cache._map, offset)[0] == 4
+    assert cache.get(b'a') == 'query a2'
+
+
+def test_eviction():
+    """With a single bucket the least recently used key is replaced.
+    """
+    path = _cache_path()
+    SharedQueryCache.create(path, slot_count=WAYS, slot_size=64)
+    cache = SharedQueryCache(path)
+    keys = [str(i).encode() for i in range(WAYS)]
+    for key in keys:
+        cache.put(key, 'value')
+    assert cache.get(keys[0]) == 'value'
+    cache.put(b'new', 'value')
+    assert cache.get(b'new') == 'value'
+    assert cache.get(keys[0]) == 'value'
+    assert cache.get(keys[1]) is None
+
+
+def _put_in_other_process(path: str):
+    SharedQueryCache(path).put(b'from child', 'child query')
+
+
+def test_shared_between_processes():
+    path = _cache_path()
+    SharedQueryCache.create(path)
+    process = multiprocessing.get_context('spawn').Process(target=_put_in_other_process, args=(path,))
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    assert SharedQueryCache(path).get(b'from child') == 'child query'
+
+
+def test_endpoint_uses_shared_cache(testing_client: TestClient, monkeypatch):
+    path = _cache_path()
+    SharedQueryCache.create(path)
+    cache = SharedQueryCache(path)
+    monkeypatch.setattr(partition_range, 'shared_query_cache', cache)
+    start = datetime(year=2017, month=5, day=13, hour=22, tzinfo=timezone.utc)
+    end = datetime(year=2017, month=5, day=14, hour=21, tzinfo=timezone.utc)
+    parameters = {'start': start, 'end': end, 'generate_timestamp_clause': False}
+    response = testing_client.get('/impala', params=parameters)
+    assert response.status_code == 200
+    key = '{0}/{1}/0/s/0'.format(start.isoformat(), end.isoformat()).encode()
+    assert cache.get(key) == response.json()['query']
+
+    # a query in the cache is returned without computing it
+    cache.put(key, 'cached')
+    assert testing_client.get('/hive', params=parameters).json() == {'query': 'cached'}
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from ..routers.partition_range import SingleFlight
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_single_flight_coalesces_identical_calls():
+    calls = []
+    lock = threading.Lock()
+
+    def compute(value):
+        with lock:
+            calls.append(value)
+        time.sleep(0.05)
+        return value * 2
+
+    async def run():
+        single_flight = SingleFlight(window=10)
+        # the first calls compute inline and make the keys hot
+        assert await single_flight.do('a', compute, 1) == 2
+        assert await single_flight.do('b', compute, 2) == 4
+        return await asyncio.gather(*([single_flight.do('a', compute, 1) for _ in range(20)] +
+                                      [single_flight.do('b', compute, 2) for _ in range(20)]))
+
+    results = asyncio.run(run())
+    assert results == [2] * 20 + [4] * 20
+    assert sorted(calls) == [1, 1, 2, 2]
+
+
+def test_single_flight_computes_cold_keys_inline():
+    clock = FakeClock()
+    threads = []
+
+    def compute():
+        threads.append(threading.get_ident())
+        return 'result'
+
+    async def run():
+        single_flight = SingleFlight(window=1, clock=clock)
+        assert await single_flight.do('a', compute) == 'result'
+        # a hot key is computed in the thread pool
+        assert await single_flight.do('a', compute) == 'result'
+        clock.now = 2.0
+        assert await single_flight.do('a', compute) == 'result'
+        assert await single_flight.do('b', compute) == 'result'
+
+    asyncio.run(run())
+    loop_thread = threading.get_ident()
+    assert [thread == loop_thread for thread in threads] == [True, False, True, True]
+
+
+def test_single_flight_propagates_errors():
+    def compute():
+        time.sleep(0.05)
+        raise ValueError('failed')
+
+    async def run():
+        single_flight = SingleFlight()
+        results = await asyncio.gather(*[single_flight.do('a', compute) for _ in range(5)], return_exceptions=True)
+        # once the computation finished the key is computed again
+        with pytest.raises(ValueError, match='failed'):
+            await single_flight.do('a', compute)
+        return results
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_single_flight_cancelled_caller():
+    """Cancelling the caller that started the computation does not cancel the other callers.
+    """
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.1)
+        return 'result'
+
+    async def run():
+        single_flight = SingleFlight(window=10)
+        await single_flight.do('a', compute)
+        first = asyncio.ensure_future(single_flight.do('a', compute))
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(single_flight.do('a', compute))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == 'result'
+    assert calls == [1, 1]
@@ -0,0 +1,98 @@
+from datetime import datetime, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+from ..query_utils.hive_impala_query_builder import generate_timerange_query
+from ..query_utils.sql_dialects import DIALECTS, generate_timerange_queries
+from .differential_harness import random_ranges
+
+
+def test_backtick_dialects_match_builder():
+    for start, end in random_ranges(0, 2000):
+        queries = generate_timerange_queries(start, end, list(DIALECTS), True)
+        expected = generate_timerange_query(start, end, True)
+        for dialect in ['impala', 'hive', 'spark', 'bigquery']:
+            assert queries[dialect] == expected
+        assert queries['trino'] == expected.replace('`', '"')
+
+
+def test_trino():
+    start = datetime(year=2017, month=5, day=13, hour=22, tzinfo=timezone.utc)
+    end = datetime(year=2017, month=5, day=14, hour=21, minute=59, second=59, tzinfo=timezone.utc)
+    assert generate_timerange_queries(start, end, ['trino'])['trino'] == \
+        '"timestamp" BETWEEN 1494712800 AND 1494799199 AND ' \
+        '(("year" = 2017 AND "month" = 5 AND "day" = 13 AND "hour" BETWEEN 22 AND 23) OR ' \
+        '("year" = 2017 AND "month" = 5 AND "day" = 14 AND "hour" BETWEEN 0 AND 21))'
+
+
+def test_quote_identifier():
+    assert DIALECTS['trino'].quote_identifier('a"b') == '"a""b"'
+    assert DIALECTS['spark'].quote_identifier('a`b') == '`a``b`'
+
+
+def test_unknown_dialect():
+    start = datetime(year=2017, month=5, day=13, tzinfo=timezone.utc)
+    with pytest.raises(ValueError, match='Unknown dialect'):
+        generate_timerange_queries(start, start, ['impala', 'mysql'])
+
+
+def test_query_endpoint(testing_client: TestClient):
+    parameters = {'start': '2017-05-13T22:00:00', 'end': '2017-05-14T21:59:59', 'dialect': ['trino', 'hive'],
+                  'generate_timestamp_clause': True}
+    response = testing_client.get('/query', params=parameters)
+    assert response.status_code == 200
+    queries = response.json()['queries']
+    assert list(queries) == ['trino', 'hive']
+    assert queries['hive'] == testing_client.get('/hive', params=parameters).json()['query']
+    assert queries['trino'] == queries['hive'].replace('`', '"')
+
+    response = testing_client.get('/query', params={'start': '2017-05-13T22:00:00', 'end': '2017-05-14T21:59:59'})
+    assert list(response.json()['queries']) == ['impala']
+
+    response = testing_client.get('/query', params=dict(parameters, dialect=['mysql']))
+    assert response.status_code == 422
+    response = testing_client.get('/query', params=dict(parameters, end='2017-05-13T21:00:00'))
+    assert response.status_code == 422
+
+    response = testing_client.get('/query', params=dict(parameters, timestamp_type='ms'))
+    assert response.json()['queries']['trino'].startswith('"timestamp" BETWEEN 1494712800000 AND 1494799199000 AND ')
+    response = testing_client.get('/hive', params=dict(parameters, timestamp_type='timestamp'))
+    assert response.json()['query'].startswith("`timestamp` BETWEEN CAST('2017-05-13 22:00:00' AS TIMESTAMP) AND ")
+    response = testing_client.get('/impala', params=dict(parameters, timestamp_type='minutes'))
+    assert response.status_code == 422
+
+    parameters = {'start': '2017-05-13T22:59:00', 'end': '2017-05-13T23:01:00', 'sub_hour_precision': True}
+    response = testing_client.get('/impala', params=parameters)
+    assert response.json()['query'] == \
+        '((`year` = 2017 AND `month` = 5 AND `day` = 13 AND `hour` = 22 AND `timestamp` >= 1494716340) OR ' \
+        '(`year` = 2017 AND `month` = 5 AND `day` = 13 AND `hour` = 23 AND `timestamp` <= 1494716460))'
+    response = testing_client.get('/query', params=dict(parameters, dialect='trino'))
+    assert response.json()['queries']['trino'] == testing_client.get('/hive', params=parameters).json()['query'] \
+        .replace('`', '"')
+
+
+def test_timestamp_types():
+    start = datetime(year=2020, month=11, day=24, hour=15, tzinfo=timezone.utc)
+    end = datetime(year=2020, month=11, day=24, hour=16, second=1, tzinfo=timezone.utc)
+    for timestamp_type in ['s', 'ms', 'us', 'ns', 'timestamp']:
+        queries = generate_timerange_queries(start, end, list(DIALECTS), True, timestamp_type)
+        assert queries['impala'] == queries['hive'] == generate_timerange_query(start, end, True, timestamp_type)
+    queries = generate_timerange_queries(start, end, ['trino', 'spark', 'bigquery'], True, 'timestamp')
+    assert queries['trino'].startswith(
+        '"timestamp" BETWEEN TIMESTAMP \'2020-11-24 15:00:00\' AND TIMESTAMP \'2020-11-24 16:00:01\' AND ')
+    assert queries['spark'].startswith(
+        "`timestamp` BETWEEN TIMESTAMP '2020-11-24 15:00:00' AND TIMESTAMP '2020-11-24 16:00:01' AND ")
+    assert queries['bigquery'] == queries['spark']
+    queries = generate_timerange_queries(start, end, ['trino'], True, 'ms')
+    assert queries['trino'].startswith('"timestamp" BETWEEN 1606230000000 AND 1606233601000 AND ')
+
+
+def test_sub_hour_precision():
+    for start, end in random_ranges(1, 500):
+        for timestamp_type in ['s', 'ms', 'timestamp']:
+            queries = generate_timerange_queries(start, end, ['impala', 'trino'], False, timestamp_type, True)
+            expected = generate_timerange_query(start, end, False, timestamp_type, True)
+            assert queries['impala'] == expected
+            assert queries['trino'] == expected.replace('`', '"').replace('CAST(\'', 'TIMESTAMP \'') \
+                .replace("' AS TIMESTAMP)", "'")
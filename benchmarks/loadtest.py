@@ -0,0 +1,227 @@
+"""Load test the service and report its capacity.
+
+Starts the app with uvicorn or gunicorn (as in the docker image, not in requirements.txt, install it separately) with
+the given number of workers, drives a mix of realistic requests (mostly short ranges, some ranges over months and
+years, with and without timestamp clause, on /impala and /hive) over keep-alive connections for a fixed duration and
+prints a JSON report with requests per second, latency percentiles and CPU usage and memory per worker. Use --url to
+test an already running instance (e.g. the docker image started with `make docker_serve`), the per worker statistics
+are then not available.
+
+Usage (from the project root):
+
+    python benchmarks/loadtest.py --workers 4 --connections 64 --duration 30 --output loadtest_report.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+from process_stats import children, free_port, read_cpu_seconds, read_memory
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def generate_request_paths(count: int, seed: int) -> List[str]:
+    """Generate the paths of a realistic request mix.
+
+    70% of the ranges are up to two days long, 20% up to three months and 10% up to five years. Half of them ask for
+    the timestamp clause.
+    """
+    rng = random.Random(seed)
+    first = datetime(year=2015, month=1, day=1, tzinfo=timezone.utc)
+    paths = []
+    for _ in range(count):
+        start = first + timedelta(seconds=rng.randint(0, 10 * 365 * 86400))
+        kind = rng.random()
+        if kind < 0.7:
+            length = timedelta(seconds=rng.randint(0, 2 * 86400))
+        elif kind < 0.9:
+            length = timedelta(seconds=rng.randint(0, 92 * 86400))
+        else:
+            length = timedelta(seconds=rng.randint(0, 5 * 365 * 86400))
+        parameters = {'start': start.isoformat(), 'end': (start + length).isoformat(),
+                      'generate_timestamp_clause': rng.choice(['true', 'false'])}
+        paths.append('/{0}?{1}'.format(rng.choice(['impala', 'hive']), urlencode(parameters)))
+    return paths
+
+
+async def _connection(host: str, port: int, paths: List[str], deadline: float, latencies: List[float],
+                      statuses: Dict[int, int], rng: random.Random):
+    """Send requests on one keep-alive connection until the deadline and record their latencies."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            request = 'GET {0} HTTP/1.1\r\nHost: {1}\r\n\r\n'.format(rng.choice(paths), host).encode()
+            started = time.perf_counter()
+            writer.write(request)
+            header = await reader.readuntil(b'\r\n\r\n')
+            status = int(header.split(b' ', 2)[1])
+            length = 0
+            for line in header.split(b'\r\n')[1:]:
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':', 1)[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def drive_load(url: str, paths: List[str], connections: int, duration: float, seed: int) \
+        -> Tuple[List[float], Dict[int, int], float]:
+    """Drive the load with the given number of concurrent connections.
+
+    Returns:
+        The latencies of all requests, the number of responses per status code and the actual duration.
+    """
+    address = urlsplit(url)
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(_connection(address.hostname, address.port or 80, paths, deadline, latencies, statuses,
+                                       random.Random(seed + i))
+                           for i in range(connections)))
+    return latencies, statuses, time.perf_counter() - started
+
+
+def _percentile(sorted_values: List[float], percentile: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percentile / 100))]
+
+
+def start_server(server: str, workers: int, worker_class: str, port: int, environment: Dict[str, str]) \
+        -> subprocess.Popen:
+    """Start the app and wait until all workers answer requests."""
+    if server == 'gunicorn':
+        command = ['gunicorn', 'app.main:app', '-k', worker_class, '-w', str(workers),
+                   '-b', '127.0.0.1:{0}'.format(port),
+                   '-c', os.path.join(PROJECT_ROOT, 'docker', 'gunicorn_extra_conf.py')]
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'app.main:app', '--workers', str(workers), '--port', str(port),
+                   '--log-level', 'warning']
+    # in its own session, so that stop_server can signal all processes (the uvicorn supervisor does not forward the
+    # signal to its workers)
+    process = subprocess.Popen(command, cwd=PROJECT_ROOT, env=environment, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL, start_new_session=True)
+    deadline = time.perf_counter() + 60
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError('{0} exited with code {1}'.format(server, process.returncode))
+        if time.perf_counter() > deadline:
+            stop_server(process)
+            raise TimeoutError('{0} did not start within 60 seconds'.format(server))
+        try:
+            if server == 'uvicorn' and workers == 1 or len(children(process.pid)) >= workers:
+                urllib.request.urlopen('http://127.0.0.1:{0}/openapi.json'.format(port), timeout=1).read()
+                return process
+        except OSError:
+            pass
+        time.sleep(0.05)
+
+
+def stop_server(process: subprocess.Popen):
+    os.killpg(process.pid, signal.SIGTERM)
+    process.wait()
+
+
+def _worker_pids(process: subprocess.Popen, server: str, workers: int) -> List[int]:
+    if server == 'uvicorn' and workers == 1:
+        return [process.pid]
+    # the uvicorn supervisor may also start a helper process (multiprocessing resource tracker)
+    return children(process.pid)[-workers:]
+
+
+def run(args) -> Dict:
+    paths = generate_request_paths(args.distinct_requests, args.seed)
+    process: Optional[subprocess.Popen] = None
+    multiproc_dir = None
+    url = args.url
+    try:
+        if url is None:
+            port = free_port()
+            multiproc_dir = tempfile.mkdtemp(prefix='prometheus-tmp-')
+            environment = dict(os.environ, prometheus_multiproc_dir=multiproc_dir)
+            process = start_server(args.server, args.workers, args.worker_class, port, environment)
+            url = 'http://127.0.0.1:{0}'.format(port)
+        worker_pids = [] if process is None else _worker_pids(process, args.server, args.workers)
+        cpu_before = {pid: read_cpu_seconds(pid) for pid in worker_pids}
+        client_cpu_before = time.process_time()
+        latencies, statuses, duration = asyncio.run(drive_load(url, paths, args.connections, args.duration,
+                                                               args.seed))
+        client_cpu = time.process_time() - client_cpu_before
+        worker_stats = [dict(pid=pid, cpu_percent=100 * (read_cpu_seconds(pid) - cpu_before[pid]) / duration,
+                             **read_memory(pid))
+                        for pid in worker_pids]
+    finally:
+        if process is not None:
+            stop_server(process)
+        if multiproc_dir is not None:
+            shutil.rmtree(multiproc_dir, ignore_errors=True)
+
+    if not latencies:
+        raise RuntimeError('no request completed within {0} seconds, status codes: {1}'.format(args.duration,
+                                                                                             statuses))
+    latencies.sort()
+    with open(os.path.join(PROJECT_ROOT, 'VERSION')) as version_file:
+        version = version_file.readline().strip()
+    return {
+        'version': version,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'config': {'server': args.server if args.url is None else None, 'url': args.url, 'workers': args.workers,
+                   'connections': args.connections, 'duration_seconds': args.duration,
+                   'distinct_requests': args.distinct_requests},
+        'requests': len(latencies),
+        'status_codes': {str(status): count for status, count in sorted(statuses.items())},
+        'requests_per_second': len(latencies) / duration,
+        'latency_ms': {'mean': 1000 * sum(latencies) / len(latencies),
+                       'p50': 1000 * _percentile(latencies, 50),
+                       'p95': 1000 * _percentile(latencies, 95),
+                       'p99': 1000 * _percentile(latencies, 99),
+                       'max': 1000 * latencies[-1]},
+        # if the client is close to 100% the client, not the service, limits the throughput
+        'client_cpu_percent': 100 * client_cpu / duration,
+        'workers': worker_stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=['gunicorn', 'uvicorn'], default='uvicorn',
+                        help='The server to start the app with, gunicorn has to be installed separately')
+    parser.add_argument('--worker-class', default='uvicorn.workers.UvicornWorker', help='gunicorn worker class')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--url', default=None, help='Test this running instance instead of starting the app')
+    parser.add_argument('--connections', type=int, default=64, help='Number of concurrent keep-alive connections')
+    parser.add_argument('--duration', type=float, default=30, help='Duration of the test in seconds')
+    parser.add_argument('--distinct-requests', type=int, default=10000,
+                        help='Number of distinct requests the traffic is drawn from')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='Also write the report to this file')
+    args = parser.parse_args()
+    if args.url is None and args.server == 'gunicorn' and shutil.which('gunicorn') is None:
+        parser.error('gunicorn is not installed, install it with pip install gunicorn or use --server uvicorn')
+
+    try:
+        report = json.dumps(run(args), indent=2)
+    except (RuntimeError, OSError) as e:
+        parser.exit(1, '{0}: error: {1}\n'.format(parser.prog, e))
+    print(report)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
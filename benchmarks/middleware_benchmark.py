@@ -0,0 +1,107 @@
+"""Benchmark the per-request cost of the app in the default and in the lean profile.
+
+For each profile (APP_PROFILE, see app/main.py) the app is imported in a fresh interpreter and requests are sent
+directly to the ASGI app, without a server and a network in between, so the difference between the profiles is the
+cost of the middleware (prometheus-fastapi-instrumentator in the default profile, the built-in stage metrics in the
+lean profile). It prints a JSON report with the mean time per request of every profile and path.
+
+Usage (from the project root):
+
+    python benchmarks/middleware_benchmark.py --requests 20000 --runs 3
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PATHS = [
+    '/impala?start=2020-11-24T15:00:00&end=2020-11-25T17:59:59',
+    '/impala?start=2017-05-13T15:00:00&end=2019-07-08T12:00:00&generate_timestamp_clause=true',
+    '/estimate?start=2020-11-24T15:00:00&end=2020-11-25T17:59:59',
+]
+
+_BENCHMARK_SNIPPET = """
+import asyncio, json, sys, time
+from app.main import app
+
+async def call(path, query):
+    scope = {'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http', 'path': path,
+             'raw_path': path.encode(), 'root_path': '', 'query_string': query, 'headers': [(b'host', b'localhost')],
+             'server': ('127.0.0.1', 80), 'client': ('127.0.0.1', 12345)}
+    status = None
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await app(scope, receive, send)
+    assert status == 200, status
+
+async def benchmark(paths, requests):
+    results = {}
+    for path in paths:
+        path, query = path.split('?')
+        query = query.encode()
+        for _ in range(requests // 10):
+            await call(path, query)
+        start = time.perf_counter()
+        for _ in range(requests):
+            await call(path, query)
+        results[path + '?' + query.decode()] = (time.perf_counter() - start) / requests * 1e6
+    return results
+
+print(json.dumps(asyncio.get_event_loop().run_until_complete(benchmark(json.loads(sys.argv[1]), int(sys.argv[2])))))
+"""
+
+
+def benchmark_profile(profile: str, paths: List[str], requests: int) -> Dict[str, float]:
+    """Run the benchmark in a fresh interpreter with the given app profile.
+
+    Returns:
+        The mean time per request in microseconds per path.
+    """
+    multiproc_dir = tempfile.mkdtemp(prefix='prometheus-tmp-')
+    try:
+        environment = dict(os.environ, APP_PROFILE=profile, prometheus_multiproc_dir=multiproc_dir)
+        output = subprocess.run([sys.executable, '-c', _BENCHMARK_SNIPPET, json.dumps(paths), str(requests)],
+                                cwd=PROJECT_ROOT, env=environment, check=True, capture_output=True, text=True).stdout
+        return json.loads(output)
+    finally:
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20000, help='Number of requests per path and run')
+    parser.add_argument('--runs', type=int, default=3, help='Number of runs per profile, the median is reported')
+    args = parser.parse_args()
+
+    profiles = ['default', 'lean']
+    runs = {profile: [] for profile in profiles}
+    # the profiles alternate, so a change of the load of the machine affects all profiles alike
+    for _ in range(args.runs):
+        for profile in profiles:
+            runs[profile].append(benchmark_profile(profile, PATHS, args.requests))
+    report = {'requests': args.requests, 'runs': args.runs, 'microseconds_per_request': {
+        profile: {path: statistics.median(run[path] for run in runs[profile]) for path in PATHS}
+        for profile in profiles}}
+    report['lean_saving_microseconds_per_request'] = {
+        path: report['microseconds_per_request']['default'][path] - report['microseconds_per_request']['lean'][path]
+        for path in PATHS}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
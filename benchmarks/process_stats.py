@@ -0,0 +1,41 @@
+"""Helpers for the benchmarks to inspect processes via /proc (Linux only)."""
+
+import os
+import socket
+from typing import Dict, List
+
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def read_memory(pid: int) -> Dict[str, int]:
+    """Read the RSS, PSS and private memory of a process in kB from /proc/<pid>/smaps_rollup."""
+    memory = {}
+    with open('/proc/{0}/smaps_rollup'.format(pid)) as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ('Rss:', 'Pss:', 'Private_Clean:', 'Private_Dirty:'):
+                memory[parts[0][:-1].lower()] = int(parts[1])
+    return {'rss_kb': memory['rss'],
+            'pss_kb': memory['pss'],
+            'private_kb': memory['private_clean'] + memory['private_dirty']}
+
+
+def read_cpu_seconds(pid: int) -> float:
+    """Read the CPU time (user and system) a process used so far from /proc/<pid>/stat."""
+    with open('/proc/{0}/stat'.format(pid)) as f:
+        # the command name may contain spaces, the fields after it are space separated
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+
+
+def children(pid: int) -> List[int]:
+    """The pids of the direct children of a process."""
+    with open('/proc/{0}/task/{0}/children'.format(pid)) as f:
+        return [int(child) for child in f.read().split()]
+
+
+def free_port() -> int:
+    """A free TCP port on localhost."""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
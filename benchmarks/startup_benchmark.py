@@ -0,0 +1,109 @@
+"""Benchmark the startup of the service.
+
+It measures two things and prints them as JSON:
+
+* import: the time it takes to import the app (app.main) in a fresh interpreter and the RSS afterwards.
+* gunicorn: the time it takes until gunicorn with the given number of uvicorn workers answers requests, and the RSS,
+  PSS and private memory of each worker. This is run once without and once with the app preloaded in the master
+  (see docker/gunicorn_extra_conf.py). It requires gunicorn to be installed (it is part of the docker image).
+
+Usage (from the project root):
+
+    python benchmarks/startup_benchmark.py --workers 4 --runs 5
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Dict
+
+from process_stats import children, free_port, read_memory
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORT_SNIPPET = """
+import json, time
+start = time.perf_counter()
+import app.main
+duration = time.perf_counter() - start
+with open('/proc/self/status') as f:
+    rss = [int(line.split()[1]) for line in f if line.startswith('VmRSS')][0]
+print(json.dumps({'import_seconds': duration, 'rss_kb': rss}))
+"""
+
+
+def benchmark_import(runs: int) -> Dict[str, float]:
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', _IMPORT_SNIPPET], cwd=PROJECT_ROOT, check=True,
+                                capture_output=True, text=True).stdout
+        results.append(json.loads(output))
+    return {'runs': runs,
+            'import_seconds_median': statistics.median(r['import_seconds'] for r in results),
+            'rss_kb_median': statistics.median(r['rss_kb'] for r in results)}
+
+
+def benchmark_gunicorn(workers: int, preload: bool, worker_class: str, timeout: float = 60.0) -> Dict:
+    port = free_port()
+    multiproc_dir = tempfile.mkdtemp(prefix='prometheus-tmp-')
+    env = dict(os.environ, prometheus_multiproc_dir=multiproc_dir, PRELOAD_APP=str(preload).lower())
+    command = ['gunicorn', 'app.main:app', '-k', worker_class, '-w', str(workers),
+               '-b', '127.0.0.1:{0}'.format(port), '-c', os.path.join(PROJECT_ROOT, 'docker', 'gunicorn_extra_conf.py')]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=PROJECT_ROOT, env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    try:
+        url = 'http://127.0.0.1:{0}/openapi.json'.format(port)
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError('gunicorn exited with code {0}'.format(process.returncode))
+            if time.perf_counter() - start > timeout:
+                raise TimeoutError('gunicorn did not start within {0} seconds'.format(timeout))
+            try:
+                if len(children(process.pid)) == workers:
+                    urllib.request.urlopen(url, timeout=1).read()
+                    break
+            except OSError:
+                pass
+            time.sleep(0.01)
+        boot_seconds = time.perf_counter() - start
+        # make sure every worker has served a request, the first request also builds the openapi schema
+        for _ in range(workers * 4):
+            urllib.request.urlopen(url, timeout=1).read()
+        worker_memory = [read_memory(pid) for pid in children(process.pid)]
+        return {'workers': workers,
+                'preload': preload,
+                'boot_seconds': boot_seconds,
+                'master': read_memory(process.pid),
+                'worker_rss_kb_mean': statistics.mean(m['rss_kb'] for m in worker_memory),
+                'worker_pss_kb_mean': statistics.mean(m['pss_kb'] for m in worker_memory),
+                'worker_private_kb_mean': statistics.mean(m['private_kb'] for m in worker_memory)}
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4, help='Number of gunicorn workers')
+    parser.add_argument('--worker-class', default='uvicorn.workers.UvicornWorker', help='gunicorn worker class')
+    parser.add_argument('--runs', type=int, default=5, help='Number of runs for the import benchmark')
+    args = parser.parse_args()
+
+    report = {'import': benchmark_import(args.runs)}
+    if shutil.which('gunicorn') is not None:
+        report['gunicorn'] = [benchmark_gunicorn(args.workers, preload, args.worker_class)
+                              for preload in (False, True)]
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,47 @@
 """This file contains additional configuration required for gunicorn.
 
-At the moment it only contains logic for prometheus-client multi process mode, i.e. it adds a child_exit method
-that notifies prometheus_client about the exit to remove the files etc.
+It contains logic for prometheus-client multi process mode, i.e. it adds a child_exit method that notifies
+prometheus_client about the exit to remove the files etc.
+
+It also allows to preload the app in the gunicorn master (environment variable PRELOAD_APP=true). The app is then
+imported once and the workers are forked from the master, sharing the imported modules copy-on-write. This makes
+booting a worker much faster and reduces the memory used per worker. Before forking the objects of the master are
+moved to the permanent generation of the garbage collector, so that collections in the workers do not touch (and thus
+copy) the shared pages.
+
+With PRELOAD_APP the master also loads the partition statistics of the cost estimation (PARTITION_STATS_PATH), which
+the workers would otherwise load on their startup. A missing or invalid file stops gunicorn from starting.
+
+If the environment variable SHARED_CACHE_PATH is set the master creates the query cache file shared by all workers
+(see app/query_utils/shared_query_cache.py) on start. Its size can be set with SHARED_CACHE_SLOTS.
 
 It is appended to the file /gunicorn_conf_extension.py (the configuration file used by the docker image).
 """
 
+import gc
+import os
+
 from prometheus_client import multiprocess
 
+preload_app = os.environ.get('PRELOAD_APP', 'false').lower() == 'true'
+
+
+def on_starting(server):
+    if os.environ.get('SHARED_CACHE_PATH'):
+        # imported here, the app directory is only on the path once gunicorn is starting
+        from app.query_utils.shared_query_cache import SharedQueryCache
+        SharedQueryCache.create(os.environ['SHARED_CACHE_PATH'],
+                                slot_count=int(os.environ.get('SHARED_CACHE_SLOTS', '16384')))
+
+
+def when_ready(server):
+    if preload_app:
+        # load the partition statistics (PARTITION_STATS_PATH) once, shared by all workers
+        from app.routers.partition_range import load_partition_statistics
+        load_partition_statistics()
+        gc.collect()
+        gc.freeze()
+
 
 def child_exit(server, worker):
     multiprocess.mark_process_dead(worker.pid)
@@ -1,4 +1,4 @@
-from setuptools import setup
+from setuptools import find_packages, setup
 
 with open("README.md", "r") as fh:
     long_description = fh.read()
@@ -10,7 +10,7 @@ with open('VERSION', 'r') as version_file:
 setup(
     name='partitioning-service',
     version=version,
-    packages=['app'],
+    packages=find_packages(exclude=['app.tests']),
     keywords='hdfs partitioning service impala hive spark api fastapi',
     url='https://git.rz.adition.net/reporting/partitioning-service',
     author='ADITION technologies AG',
@@ -18,5 +18,20 @@ setup(
     description='The partitioning service generates queries WHERE-clauses for hdfs partitioning.',
     long_description=long_description,
     long_description_content_type="text/markdown",
-    package_dir={'': 'app'}
+    # the dependencies of the query generation, the command line tool and the python client, the service itself is
+    # installed with requirements.txt
+    install_requires=[
+        'pydantic<2',
+        'orjson',
+        'python-dateutil',
+        'requests>=2.25.0',
+    ],
+    extras_require={
+        'parquet': ['pyarrow'],
+    },
+    entry_points={
+        'console_scripts': [
+            'partitioning-service-generate=app.cli:main',
+        ],
+    },
 )